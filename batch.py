@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Tuple
+
+from cache import dollar_quote_end
+from cli import output_file
+from explain import get_query_plan, get_pool, planner_settings, QueryNode
+from history import plan_history, record_run
+
+
+# Headless batch mode, explains every query of a workload and streams one JSON line per query.
+# Usage: python batch.py workload.sql [more.sql | queries_dir ...] --workers 4 --output report.jsonl
+# This module deliberately does not import the GUI, so it starts quickly and runs without a display.
+
+
+# splits sql text into statements on semicolons outside of quotes, dollar quotes and comments,
+# so function bodies and DO blocks stay whole
+def split_statements(text: str) -> List[str]:
+    statements = []
+    start = 0
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        dollar_end = dollar_quote_end(text, i) if c == "$" else None
+        if dollar_end is not None:
+            i = dollar_end
+        elif c in ("'", '"'):
+            j = text.find(c, i + 1)
+            while j != -1 and j + 1 < n and text[j + 1] == c:  # escaped quote
+                j = text.find(c, j + 2)
+            i = n if j == -1 else j + 1
+        elif text.startswith("--", i):
+            j = text.find("\n", i)
+            i = n if j == -1 else j + 1
+        elif text.startswith("/*", i):
+            j = text.find("*/", i + 2)
+            i = n if j == -1 else j + 2
+        elif c == ";":
+            statements.append(text[start:i])
+            i += 1
+            start = i
+        else:
+            i += 1
+    statements.append(text[start:])
+
+    return [s.strip() for s in statements if _has_sql(s)]
+
+
+def _has_sql(statement: str) -> bool:
+    for line in statement.splitlines():
+        line = line.strip()
+        if line and not line.startswith("--"):
+            return True
+    return False
+
+
+# yields (source, index within source, query) for every statement in the given files and directories
+def iter_workload(paths: List[str]) -> Iterator[Tuple[str, int, str]]:
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".sql"))
+        else:
+            files = [path]
+        for file in files:
+            with open(file) as f:
+                for i, q in enumerate(split_statements(f.read())):
+                    yield file, i, q
+
+
+# the json-friendly report of one explained query
+def plan_report(steps: List[Tuple[str, Dict[str, str], Any]], root_node: QueryNode) -> Dict[str, Any]:
+    report_steps = []
+    for s, d, node in steps:
+        entry = {"step": s}
+        if node is not None:
+            entry["node_type"] = node.node_type
+            entry["details"] = d
+            entry["insights"] = node.get_node_insights()
+            entry["costliest"] = node.costliest_node is node
+            entry["slowest"] = node.slowest_node is node
+        report_steps.append(entry)
+
+    return {
+        "steps": report_steps,
+        "plan_insight": root_node.get_plan_insight() if root_node is not None else {},
+    }
+
+
+def _explain(source: str, index: int, query: str, flags: Tuple[bool, bool, bool, bool], use_cache: bool,
+             analyze: bool) -> Dict[str, Any]:
+    entry = {"source": source, "index": index, "query": query}
+    try:
+        steps, root_node = get_query_plan(query, *flags, use_cache=use_cache and plan_history is None,
+                                          analyze=analyze)
+        regression = record_run(query, planner_settings(*flags), root_node)
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}".strip()
+        return entry
+    entry.update(plan_report(steps, root_node))
+    if regression is not None:
+        entry["regression"] = regression.report()
+    return entry
+
+
+def run(paths: List[str], out, workers: int = 4, flags: Tuple[bool, bool, bool, bool] = (True, True, True, True),
+        use_cache: bool = True, analyze: bool = True) -> int:
+    get_pool().ensure_capacity(workers)
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        futures = [executor.submit(_explain, source, i, q, flags, use_cache, analyze) for source, i, q in iter_workload(paths)]
+        for future in as_completed(futures):
+            entry = future.result()
+            failures += "error" in entry
+            out.write(json.dumps(entry) + "\n")
+            out.flush()
+
+    return failures
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Explain every query of a workload and stream JSONL reports.")
+    parser.add_argument("paths", nargs="+", help=".sql files or directories of .sql files")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of queries explained at once")
+    parser.add_argument("-o", "--output", help="file to write the JSONL report to, defaults to stdout")
+    parser.add_argument("--no-cache", action="store_true", help="always re-run EXPLAIN ANALYZE")
+    parser.add_argument("--estimate-only", action="store_true", help="only plan the queries, without executing them")
+    parser.add_argument("--disable-hashjoin", action="store_true")
+    parser.add_argument("--disable-mergejoin", action="store_true")
+    parser.add_argument("--disable-nestloop", action="store_true")
+    parser.add_argument("--disable-seqscan", action="store_true")
+    args = parser.parse_args(argv)
+
+    flags = (not args.disable_hashjoin, not args.disable_mergejoin, not args.disable_nestloop, not args.disable_seqscan)
+    with output_file(args.output) as out:
+        failures = run(args.paths, out, max(1, args.workers), flags, not args.no_cache, not args.estimate_only)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Any, Dict
+
+from explain import QueryNode, preorder
+
+
+# Micro benchmarks for building and explaining large plans, run with python bench.py.
+# Plans are generated, so no database is needed.
+
+
+# generates a plan of n nodes shaped like a big UNION ALL over partitioned table scans:
+# an Append whose children are Hash Joins of a filtered scan and a hashed scan.
+def generate_plan(n: int) -> Dict[str, Any]:
+    def scan(i: int, t: float) -> Dict[str, Any]:
+        return {
+            "Node Type": "Seq Scan", "Parent Relationship": "Outer", "Parallel Aware": False, "Async Capable": False,
+            "Relation Name": f"part_{i}", "Schema": "public", "Alias": f"p{i}",
+            "Startup Cost": 0.0, "Total Cost": 100.0, "Plan Rows": 1000, "Plan Width": 64,
+            "Actual Startup Time": 0.01, "Actual Total Time": t, "Actual Rows": 900, "Actual Loops": 1,
+            "Output": [f"p{i}.id", f"p{i}.val"], "Filter": f"(p{i}.val > 10)", "Rows Removed by Filter": 100,
+            "Shared Hit Blocks": 10, "Shared Read Blocks": 2, "Shared Dirtied Blocks": 0, "Shared Written Blocks": 0,
+            "Temp Read Blocks": 0, "Temp Written Blocks": 0,
+        }
+
+    children = []
+    size = 1
+    i = 0
+    while size + 4 <= n:
+        children.append({
+            "Node Type": "Hash Join", "Parent Relationship": "Member", "Parallel Aware": False, "Join Type": "Inner",
+            "Startup Cost": 120.0, "Total Cost": 300.0, "Plan Rows": 900, "Plan Width": 128,
+            "Actual Startup Time": 0.5, "Actual Total Time": 1.0, "Actual Rows": 900, "Actual Loops": 1,
+            "Hash Cond": f"(p{i}.id = p{i + 1}.id)", "Inner Unique": True,
+            "Plans": [
+                scan(i, 0.3),
+                {
+                    "Node Type": "Hash", "Parent Relationship": "Inner", "Parallel Aware": False,
+                    "Startup Cost": 100.0, "Total Cost": 100.0, "Plan Rows": 1000, "Plan Width": 64,
+                    "Actual Startup Time": 0.4, "Actual Total Time": 0.4, "Actual Rows": 900, "Actual Loops": 1,
+                    "Hash Buckets": 1024, "Original Hash Buckets": 1024, "Hash Batches": 1, "Peak Memory Usage": 80,
+                    "Plans": [scan(i + 1, 0.3)],
+                },
+            ],
+        })
+        size += 4
+        i += 2
+
+    return {
+        "Node Type": "Append", "Parallel Aware": False, "Startup Cost": 0.0, "Total Cost": 300.0 * len(children),
+        "Plan Rows": 900 * len(children), "Plan Width": 128, "Actual Startup Time": 0.5,
+        "Actual Total Time": 1.0 * len(children) + 1, "Actual Rows": 900 * len(children), "Actual Loops": 1,
+        "Plans": children,
+    }
+
+
+# generates a left-deep chain of depth nested loop joins, far deeper than the recursion limit
+def generate_deep_plan(depth: int) -> Dict[str, Any]:
+    def leaf(i: int) -> Dict[str, Any]:
+        return {
+            "Node Type": "Index Scan", "Parent Relationship": "Inner", "Relation Name": f"t{i}", "Alias": f"t{i}",
+            "Index Name": f"t{i}_pkey", "Scan Direction": "Forward", "Index Cond": f"(t{i}.id = t{i - 1}.id)",
+            "Startup Cost": 0.0, "Total Cost": 1.0, "Plan Rows": 1, "Plan Width": 8,
+            "Actual Startup Time": 0.001, "Actual Total Time": 0.001, "Actual Rows": 1, "Actual Loops": 1,
+        }
+
+    plan = {
+        "Node Type": "Seq Scan", "Parent Relationship": "Outer", "Relation Name": "t0", "Alias": "t0",
+        "Startup Cost": 0.0, "Total Cost": 1.0, "Plan Rows": 1, "Plan Width": 8,
+        "Actual Startup Time": 0.001, "Actual Total Time": 0.001, "Actual Rows": 1, "Actual Loops": 1,
+    }
+    for i in range(1, depth):
+        plan = {
+            "Node Type": "Nested Loop", "Parent Relationship": "Outer", "Join Type": "Inner",
+            "Startup Cost": 0.0, "Total Cost": 2.0 * i + 1, "Plan Rows": 1, "Plan Width": 8,
+            "Actual Startup Time": 0.001, "Actual Total Time": 0.002 * i + 0.001, "Actual Rows": 1, "Actual Loops": 1,
+            "Join Filter": f"(t{i}.id = t{i - 1}.id)", "Plans": [plan, leaf(i)],
+        }
+    plan["Parent Relationship"] = None
+    return plan
+
+
+def count_nodes(root: QueryNode) -> int:
+    return sum(1 for _ in preorder(root))
+
+
+def bench_construction(n: int, repeat: int = 5):
+    plan = generate_plan(n)
+
+    gc.collect()
+    tracemalloc.start()
+    root = QueryNode(plan)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes = count_nodes(root)
+    del root
+
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        QueryNode(plan)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"construction: {nodes} nodes, {size / nodes:.0f} bytes/node, "
+          f"{best * 1000:.1f}ms ({best / nodes * 1e6:.2f}us/node)")
+
+
+def bench_deep_explain(depth: int):
+    plan = generate_deep_plan(depth)
+
+    gc.collect()
+    start = time.perf_counter()
+    root = QueryNode(plan)
+    built = time.perf_counter() - start
+    steps, _, _ = root.explain()
+    explained = time.perf_counter() - start - built
+    for _, _, node in steps:
+        if node is not None:
+            node.get_node_insights()
+    insights = time.perf_counter() - start - built - explained
+
+    print(f"deep plan: depth {depth}, {count_nodes(root)} nodes, {len(steps)} steps, "
+          f"built in {built * 1000:.1f}ms, explained in {explained * 1000:.1f}ms, "
+          f"insights in {insights * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plan construction on generated plans.")
+    parser.add_argument("-n", "--nodes", type=int, default=10000, help="approximate number of nodes in the plan")
+    parser.add_argument("-d", "--depth", type=int, default=20000, help="depth of the generated left-deep plan")
+    args = parser.parse_args()
+
+    bench_construction(args.nodes)
+    bench_deep_explain(args.depth)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import statistics
+from math import ceil, comb, sqrt
+from typing import Any, Dict, List, Tuple
+
+from explain import get_pool, fetch_plan, planner_settings, build_query_plan, match_plans, QueryNode, CancelToken, \
+    STATEMENT_TIMEOUT, preorder
+
+# two plans are only called different when the chance of the gap being noise is below this
+SIGNIFICANCE_LEVEL = 0.05
+
+
+# The timings of one query over repeated EXPLAIN ANALYZE runs.
+# steps and root_node come from the run with the median execution time, every node of that
+# plan is aligned with its counterpart in the other runs to collect its exclusive time per run.
+class PlanBenchmark:
+    steps: List[Tuple[str, Dict[str, str], Any]] = None
+    root_node: QueryNode = None
+    execution_times: List[float] = None
+    node_times: Dict[QueryNode, List[float]] = None
+    warmup: int = None
+
+    def __init__(self, runs: List[Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode]], warmup: int = 0):
+        self.warmup = warmup
+        self.execution_times = [root.execution_time for _, root in runs]
+        median_run = sorted(range(len(runs)), key=lambda i: self.execution_times[i])[(len(runs) - 1) // 2]
+        self.steps, self.root_node = runs[median_run]
+
+        self.node_times = {}
+        for node in preorder(self.root_node):
+            self.node_times[node] = []
+        for _, root in runs:
+            matches = match_plans(self.root_node, root)
+            for node, times in self.node_times.items():
+                other = matches.get(node)
+                if other is not None and other.actual_op_cost is not None:
+                    times.append(other.actual_op_cost)
+
+    # median, p95 and standard deviation of the plan's execution time
+    def summary(self) -> Dict[str, str]:
+        slowest = max(self.node_times, key=lambda n: _median(self.node_times[n]))
+        return {
+            "Runs": f"{len(self.execution_times)} measured after {self.warmup} warmup",
+            **_distribution("Execution Time", self.execution_times),
+            "Slowest Operation (median)": f"{slowest.node_type} took {_median(self.node_times[slowest]):.2f}ms.",
+        }
+
+    # the distribution of a node's exclusive time across the runs
+    def node_summary(self, node: QueryNode) -> Dict[str, str]:
+        times = self.node_times.get(node)
+        if not times:
+            return {}
+        return {
+            "Samples": f"{len(times)}",
+            **_distribution("Operation Time", times),
+        }
+
+
+def _median(values: List[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+# nearest-rank percentile
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), ceil(p / 100 * len(ordered))) - 1)]
+
+
+def _distribution(label: str, values: List[float]) -> Dict[str, str]:
+    stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+    return {
+        f"{label} Median": f"{_median(values):.2f}ms",
+        f"{label} p95": f"{_percentile(values, 95):.2f}ms",
+        f"{label} Std Dev": f"{stdev:.2f}ms",
+    }
+
+
+# Runs EXPLAIN ANALYZE warmup times to warm the caches, then runs more times, measuring every node.
+# All runs share one pooled connection so they see the same session state.
+# Each run is cancelled with QueryCanceledError after statement_timeout milliseconds (STATEMENT_TIMEOUT by default).
+def benchmark_query_plan(query: str, enable_hj: bool, enable_mj: bool, enable_nfl: bool, enable_ss: bool,
+                         warmup: int = 1, runs: int = 5, cancel_token: CancelToken = None,
+                         statement_timeout: int = None) -> PlanBenchmark:
+    settings = planner_settings(enable_hj, enable_mj, enable_nfl, enable_ss)
+    if statement_timeout is None:
+        statement_timeout = STATEMENT_TIMEOUT
+    results = []
+    with get_pool().connection() as conn:
+        for i in range(warmup + max(1, runs)):
+            result = fetch_plan(conn, query, settings, cancel_token, statement_timeout=statement_timeout)
+            if not result:
+                raise ValueError("no plan returned")
+            if i >= warmup:
+                results.append(result)
+
+    return PlanBenchmark([build_query_plan(r) for r in results], warmup)
+
+
+# Two-sided Mann-Whitney U test of whether one sample tends to be larger than the other.
+# Uses the exact distribution of U for small samples without ties, the normal approximation otherwise.
+def mann_whitney_u(xs: List[float], ys: List[float]) -> Tuple[float, float]:
+    m, n = len(xs), len(ys)
+    ranked = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+    ranks = [0.0] * len(ranked)
+    ties = []
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        if j > i:
+            ties.append(j - i + 1)
+        i = j + 1
+
+    rank_sum = sum(r for r, (_, group) in zip(ranks, ranked) if group == 0)
+    u = rank_sum - m * (m + 1) / 2
+    u_min = min(u, m * n - u)
+
+    if not ties and m <= 20 and n <= 20:
+        # counts[k] = number of arrangements of the two samples with U = k
+        counts = _u_distribution(m, n)
+        p = 2 * sum(counts[:int(u_min) + 1]) / comb(m + n, m)
+        return u, min(1.0, p)
+
+    mean = m * n / 2
+    tie_correction = sum(t ** 3 - t for t in ties) / ((m + n) * (m + n - 1)) if m + n > 1 else 0
+    variance = m * n / 12 * ((m + n + 1) - tie_correction)
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / sqrt(variance)
+    return u, min(1.0, 2 * (1 - statistics.NormalDist().cdf(z)))
+
+
+def _u_distribution(m: int, n: int) -> List[int]:
+    # table[j][k] = number of sequences of i xs and j ys with U = k, built up one x at a time
+    table = [[1] for _ in range(n + 1)]
+    for i in range(1, m + 1):
+        new_table = [[1]]
+        for j in range(1, n + 1):
+            size = i * j + 1
+            row = [0] * size
+            # the last element is either an x, contributing j to U, or a y, contributing nothing
+            for k, c in enumerate(table[j]):
+                row[k + j] += c
+            for k, c in enumerate(new_table[j - 1]):
+                row[k] += c
+            new_table.append(row)
+        table = new_table
+    return table[n]
+
+
+# Compares the execution time of two benchmarked plans, only calling a winner when the difference is significant.
+def compare_benchmarks(old: PlanBenchmark, new: PlanBenchmark) -> Dict[str, str]:
+    old_median, new_median = _median(old.execution_times), _median(new.execution_times)
+    _, p = mann_whitney_u(old.execution_times, new.execution_times)
+    change = (new_median - old_median) / old_median * 100 if old_median else 0.0
+
+    if p < SIGNIFICANCE_LEVEL:
+        verdict = f"The new plan is {'faster' if new_median < old_median else 'slower'} ({change:+.2f}% median " \
+                  f"execution time)."
+    else:
+        verdict = f"No significant difference ({change:+.2f}% median execution time) at this number of runs, " \
+                  f"the gap may be run to run noise. Try more runs to be sure."
+
+    return {
+        "Verdict": verdict,
+        "Old Median Execution Time": f"{old_median:.2f}ms",
+        "New Median Execution Time": f"{new_median:.2f}ms",
+        "p-value": f"{p:.4f}\n\nMann-Whitney U test over {len(old.execution_times)} old and "
+                   f"{len(new.execution_times)} new runs, differences below {SIGNIFICANCE_LEVEL} are significant.",
+    }
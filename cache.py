@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+# opening delimiter of a dollar-quoted string, $$ or $tag$, a tag never starts with a digit as $1 is a parameter
+_DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+
+
+# End of the dollar-quoted string starting at i, past its closing delimiter, or the end of text when it is not
+# closed. None when no dollar quote starts at i, a $ inside an identifier such as a$b$ does not open one.
+def dollar_quote_end(text: str, i: int) -> int | None:
+    if i > 0 and (text[i - 1].isalnum() or text[i - 1] in "_$"):
+        return None
+    m = _DOLLAR_QUOTE.match(text, i)
+    if m is None:
+        return None
+    j = text.find(m.group(), m.end())
+    return len(text) if j == -1 else j + len(m.group())
+
+
+# Reduce a query to a canonical form so that formatting-only edits hit the same cache entry.
+# Comments are dropped, whitespace is collapsed and unquoted text is lower cased,
+# string literals, dollar-quoted strings and quoted identifiers are kept verbatim.
+def normalize_query(query: str) -> str:
+    out = []
+    i, n = 0, len(query)
+    pending_space = False
+    while i < n:
+        c = query[i]
+        dollar_end = dollar_quote_end(query, i) if c == "$" else None
+        if dollar_end is not None:
+            token = query[i:dollar_end]
+            i = dollar_end
+        elif c in ("'", '"'):
+            j = i + 1
+            while j < n:
+                if query[j] == c:
+                    if j + 1 < n and query[j + 1] == c:  # escaped quote
+                        j += 2
+                        continue
+                    break
+                j += 1
+            token = query[i:j + 1]
+            i = j + 1
+        elif query.startswith("--", i):
+            j = query.find("\n", i)
+            i = n if j == -1 else j
+            pending_space = True
+            continue
+        elif query.startswith("/*", i):
+            j = query.find("*/", i + 2)
+            i = n if j == -1 else j + 2
+            pending_space = True
+            continue
+        elif c.isspace():
+            pending_space = True
+            i += 1
+            continue
+        else:
+            token = c.lower()
+            i += 1
+
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(token)
+
+    return "".join(out).rstrip("; ")
+
+
+# builds the cache key for a query under a given set of planner settings
+def make_key(query: str, settings: Dict[str, Any], version: str = None) -> str:
+    h = hashlib.sha256()
+    h.update(normalize_query(query).encode())
+    for k in sorted(settings):
+        h.update(f"\0{k}={settings[k]}".encode())
+    if version:
+        h.update(f"\0version={version}".encode())
+    return h.hexdigest()
+
+
+# A size bounded LRU cache of raw EXPLAIN results, with optional TTL and on-disk persistence.
+# Values are stored as JSON text so every hit hands back a fresh copy which callers are free to mutate.
+class PlanCache:
+    max_entries: int = None
+    ttl: float = None
+    directory: str = None
+
+    def __init__(self, max_entries: int = 128, ttl: float = None, directory: str = None):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl or None
+        self.directory = directory or None
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+        if entry is not None and self._expired(entry[0]):
+            self.invalidate(key)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+        self._remember(key, entry)
+        return json.loads(entry[1])
+
+    def put(self, key: str, value: Any):
+        entry = time.time(), json.dumps(value)
+        self._remember(key, entry)
+        self._store(key, entry)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.directory:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+        if self.directory and os.path.isdir(self.directory):
+            keys = [f[:-len(".json")] for f in os.listdir(self.directory) if f.endswith(".json")]
+        for key in keys:
+            self.invalidate(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remember(self, key: str, entry: Tuple[float, str]):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def _load(self, key: str) -> Tuple[float, str] | None:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                created = float(f.readline())
+                return created, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key: str, entry: Tuple[float, str]):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(key) + f".{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{entry[0]}\n")
+            f.write(entry[1])
+        os.replace(tmp, self._path(key))
@@ -0,0 +1,204 @@
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from cli import output_file
+from explain import QueryNode, Q_ERROR_POOR, load_query_plans, preorder
+from flamegraph import frame_label
+from indexes import condition_columns
+
+# Finds where the row estimates of analyzed plans go wrong. A misestimate is traced to the lowest operation it
+# appears at, and followed up through the operations whose estimates it throws off, joins in particular.
+# Across a workload, misestimates are summed by relation and by predicate, with what to do about them.
+# Usage: python cardinality.py plan.json [more.json ...] --output cardinality.json
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_JOINS = ("Nested Loop", "Hash Join", "Merge Join")
+
+
+# An operation whose row estimate is off by at least Q_ERROR_POOR while the estimates of its inputs are not,
+# so the error starts here. spreads_to are the operations above it that stay misestimated, lowest first.
+class Misestimate:
+    query: str = None
+    node: QueryNode = None
+    q_error: float = None
+    spreads_to: List[QueryNode] = None
+
+    def __init__(self, query: str, node: QueryNode, spreads_to: List[QueryNode]):
+        self.query = query
+        self.node = node
+        self.q_error = node.q_error()
+        self.spreads_to = spreads_to
+
+    def underestimated(self) -> bool:
+        return self.node.total_rows > self.node.plan_rows * self.node.actual_loops
+
+    # relation the estimate is about: the scanned table, or the tables joined
+    def relation(self) -> str | None:
+        node = self.node
+        if node.relation_name:
+            return _qualified(node)
+        if node.node_type in _JOINS:
+            return " JOIN ".join(sorted({_qualified(n) for n in _descendants(node) if n.relation_name}))
+        return None
+
+    # the condition the estimate rests on, with constants left out and aliases replaced by table names
+    def predicate(self) -> str | None:
+        node = self.node
+        group_key = (node.extras or {}).get("Group Key")
+        condition = node.index_cond or node.filter or (node.extras or {}).get("Recheck Cond") or \
+            node.hash_cond or node.merge_cond or node.join_filter
+        if condition:
+            for n in [node] + _descendants(node):
+                if n.alias and n.relation_name and n.alias != n.relation_name:
+                    condition = re.sub(rf"\b{re.escape(n.alias)}\.", f"{n.relation_name}.", condition)
+            return _LITERAL.sub("?", condition)
+        if group_key:
+            return "GROUP BY " + ", ".join(group_key)
+        return None
+
+    # what would give the planner better numbers
+    def suggestion(self) -> str:
+        node = self.node
+        if node.relation_name:
+            table = _qualified(node)
+            columns = list(dict.fromkeys(condition_columns(node, node.index_cond) +
+                                         condition_columns(node, node.filter)))
+            if len(columns) > 1:
+                return f"The columns may be correlated, postgres assumes they are not: " \
+                       f"CREATE STATISTICS ON {', '.join(columns)} FROM {table}; ANALYZE {table};"
+            if columns:
+                return f"ANALYZE {table}, or give the column a larger sample: " \
+                       f"ALTER TABLE {table} ALTER COLUMN {columns[0]} SET STATISTICS 1000; ANALYZE {table};"
+            return f"ANALYZE {table}. Expressions and patterns are estimated with fixed selectivities, " \
+                   f"statistics on the expression (CREATE STATISTICS, postgres 14+) or an expression index " \
+                   f"give them real ones."
+        if node.node_type in _JOINS:
+            return "ANALYZE the joined tables. If the join columns are correlated with the filters below them, " \
+                   "extended statistics on those columns may help."
+        if (node.extras or {}).get("Group Key"):
+            return "The number of groups is misestimated, CREATE STATISTICS (ndistinct) on the group key columns " \
+                   "of one table may help."
+        return "ANALYZE the tables below this operation."
+
+    def report(self) -> Dict[str, Any]:
+        node = self.node
+        return {
+            "Operation": frame_label(node),
+            "q-error": f"{self.q_error:.2f}",
+            "Estimate": f"{'Under' if self.underestimated() else 'Over'}estimated: "
+                        f"{round(node.plan_rows * node.actual_loops)} rows estimated, {node.total_rows} returned",
+            "Spreads to": [f"{frame_label(n)} (q-error {n.q_error():.2f})" for n in self.spreads_to],
+            "Suggestion": self.suggestion(),
+        }
+
+
+def _qualified(node: QueryNode) -> str:
+    return f"{node.schema}.{node.relation_name}" if node.schema else node.relation_name
+
+
+def _descendants(node: QueryNode) -> List[QueryNode]:
+    return list(preorder(node))[1:]
+
+
+def _poor(node: QueryNode) -> bool:
+    q_error = node.q_error()
+    return q_error is not None and q_error >= Q_ERROR_POOR
+
+
+# Operations that may stop reading their input early return fewer rows than estimated without the estimate being
+# wrong: under a Limit, below a Merge Join, which stops once either side runs out, or on the inner side of a
+# semi or anti join. A Sort or Hash in between reads all of its input first, whatever happens above it.
+def _stops_early(parents: Dict[QueryNode, QueryNode], node: QueryNode) -> bool:
+    child, parent = node, parents.get(node)
+    while parent is not None:
+        if parent.node_type in ("Sort", "Hash"):
+            return False
+        if parent.node_type in ("Limit", "Merge Join"):
+            return True
+        if parent.join_type in ("Semi", "Anti") and len(parent.children) > 1 and child is parent.children[1]:
+            return True
+        child, parent = parent, parents.get(parent)
+    return False
+
+
+# The misestimates that start in an analyzed plan, worst first. Empty for estimated plans.
+def misestimates(root: QueryNode, query: str = None) -> List[Misestimate]:
+    nodes = list(preorder(root))
+    parents = {child: node for node in nodes for child in node.children}
+
+    found = []
+    for node in nodes:
+        if not _poor(node) or any(_poor(c) for c in node.children):
+            continue
+        if node.total_rows < node.plan_rows * node.actual_loops and _stops_early(parents, node):
+            continue
+        spreads_to = []
+        parent = parents.get(node)
+        while parent is not None and _poor(parent):
+            spreads_to.append(parent)
+            parent = parents.get(parent)
+        found.append(Misestimate(query, node, spreads_to))
+    return sorted(found, key=lambda m: -m.q_error)
+
+
+# Misestimates across the plans of a workload, by query name, summed by relation and by predicate.
+# Each list is sorted by the number of misestimates, then by the worst q-error among them.
+def cardinality_report(plans: Dict[str, QueryNode]) -> Dict[str, Any]:
+    found = {query: misestimates(root, query) for query, root in plans.items() if root is not None}
+    by_relation: Dict[str, List[Misestimate]] = defaultdict(list)
+    by_predicate: Dict[Tuple[str, str], List[Misestimate]] = defaultdict(list)
+    for query_misestimates in found.values():
+        for m in query_misestimates:
+            relation, predicate = m.relation(), m.predicate()
+            if relation is not None:
+                by_relation[relation].append(m)
+            if predicate is not None:
+                by_predicate[(relation, predicate)].append(m)
+
+    def summary(ms: List[Misestimate]) -> Dict[str, Any]:
+        under = sum(m.underestimated() for m in ms)
+        worst = max(ms, key=lambda m: m.q_error)
+        return {
+            "Misestimates": len(ms),
+            "Queries": len({m.query for m in ms}),
+            "Worst q-error": f"{worst.q_error:.2f}",
+            "Direction": "Under" if under == len(ms) else "Over" if not under else "Both",
+            "Suggestion": worst.suggestion(),
+        }
+
+    def ranked(groups: Dict[Any, List[Misestimate]]) -> List[Tuple[Any, List[Misestimate]]]:
+        return sorted(groups.items(), key=lambda kv: (-len(kv[1]), -max(m.q_error for m in kv[1])))
+
+    return {
+        "Plans": {query: [m.report() for m in ms] for query, ms in found.items()},
+        "Relations": [{"Relation": relation, **summary(ms)} for relation, ms in ranked(by_relation)],
+        "Predicates": [{"Relation": relation, "Predicate": predicate, **summary(ms)}
+                       for (relation, predicate), ms in ranked(by_predicate)],
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Trace row misestimates in analyzed plans and sum them by "
+                                                 "relation and predicate.")
+    parser.add_argument("plans", nargs="+", help="files of EXPLAIN (ANALYZE, FORMAT JSON) output")
+    parser.add_argument("-o", "--output", help="file to write the JSON report to, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    plans = {}
+    for path in args.plans:
+        loaded = load_query_plans(path)
+        for i, (_, root) in enumerate(loaded):
+            plans[path if len(loaded) == 1 else f"{path}#{i + 1}"] = root
+
+    with output_file(args.output) as out:
+        json.dump(cardinality_report(plans), out, indent=2)
+        out.write("\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+import sys
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+
+# Helpers shared by the command line tools. Kept free of the database and GUI modules so any tool can use them.
+
+
+# the file a tool writes its report to, stdout when no path is given, which is left open
+@contextmanager
+def output_file(path: str | None) -> Iterator[TextIO]:
+    if not path:
+        yield sys.stdout
+        return
+    with open(path, "w") as out:
+        yield out
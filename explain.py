@@ -1,77 +1,361 @@
+import json
+import re
+import threading
 from collections import defaultdict, deque
+from math import ceil, inf
+from contextlib import contextmanager
 from typing import List, Dict, Tuple, Any
 
 import psycopg2
 from dotenv import load_dotenv
 import os
 
+from cache import PlanCache, make_key
+
 load_dotenv()
 DATABASE = os.environ.get("DATABASE")
 HOST = os.environ.get("HOST")
 USER = os.environ.get("USER")
 PASSWORD = os.environ.get("PASSWORD")
 PORT = os.environ.get("PORT")
-
-conn = psycopg2.connect(database=DATABASE,
-                        host=HOST,
-                        user=USER,
-                        password=PASSWORD,
-                        port=PORT)
-conn.autocommit = False
-cursor = conn.cursor()
+POOL_SIZE = int(os.environ.get("POOL_SIZE", 4))
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", 128))
+PLAN_CACHE_TTL = float(os.environ.get("PLAN_CACHE_TTL", 0))
+PLAN_CACHE_DIR = os.environ.get("PLAN_CACHE_DIR")
+# when set, cache entries are tied to the server version and the last time statistics were gathered
+PLAN_CACHE_CHECK_VERSION = os.environ.get("PLAN_CACHE_CHECK_VERSION", "").lower() in ("1", "true", "yes")
+# milliseconds EXPLAIN ANALYZE may run before it is cancelled and the estimated plan shown instead, 0 never cancels
+STATEMENT_TIMEOUT = int(os.environ.get("STATEMENT_TIMEOUT", 0))
+
+
+# A bounded pool of postgres connections.
+# Nothing is opened until a connection is first requested, so importing this module
+# never touches the database. Every connection handed out is rolled back on release
+# (we never commit, so analyze does not change db state), and connections that fail to
+# roll back cleanly are closed and dropped instead of being returned to the pool.
+class ConnectionPool:
+    database: str = None
+    max_size: int = None
+
+    def __init__(self, database: str = DATABASE, max_size: int = POOL_SIZE, **connect_kwargs):
+        self.database = database
+        self.max_size = max(1, max_size)
+        self._connect_kwargs = dict(host=HOST, user=USER, password=PASSWORD, port=PORT)
+        self._connect_kwargs.update(connect_kwargs)
+        self._idle = []
+        self._opened = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        conn = psycopg2.connect(database=self.database, **self._connect_kwargs)
+        conn.autocommit = False
+        return conn
+
+    # blocks until a connection is free, or a new one may be opened.
+    def acquire(self, timeout: float = None):
+        with self._cond:
+            while not self._idle and self._opened >= self.max_size:
+                if not self._cond.wait(timeout):
+                    raise TimeoutError(f"no free connection to {self.database} after {timeout}s")
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        if not broken and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        with self._cond:
+            if broken or conn.closed:
+                self._opened -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+        if broken and not conn.closed:
+            conn.close()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except psycopg2.extensions.QueryCanceledError:
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    # raises max_size to at least size, waking the threads waiting for a connection
+    def ensure_capacity(self, size: int):
+        with self._cond:
+            if size > self.max_size:
+                self.max_size = size
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+# Lets another thread cancel a query running on a pooled connection.
+# get_query_plan binds the connection it borrows to the token, cancel() then sends
+# a postgres cancel request for whatever statement is in flight on it.
+class CancelToken:
+    cancelled: bool = False
+
+    def __init__(self):
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def bind(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise psycopg2.extensions.QueryCanceledError("query was cancelled")
+            self._conn = conn
+
+    def unbind(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None and not self._conn.closed:
+                self._conn.cancel()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+# returns the shared pool for a database, creating it (but not connecting) on first use
+def get_pool(database: str = None) -> ConnectionPool:
+    database = database or DATABASE
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = ConnectionPool(database)
+        return _pools[database]
+
+
+plan_cache = PlanCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL, PLAN_CACHE_DIR)
+
+
+# EXPLAIN key of every attribute loaded from it, in the order postgres writes them, see QueryNode.to_dict
+_EXPLAIN_FIELDS = (
+    ("node_type", "Node Type"), ("parent_relationship", "Parent Relationship"), ("parallel_aware", "Parallel Aware"),
+    ("scan_direction", "Scan Direction"), ("index_name", "Index Name"), ("relation_name", "Relation Name"),
+    ("schema", "Schema"), ("alias", "Alias"), ("join_type", "Join Type"), ("startup_cost", "Startup Cost"),
+    ("total_cost", "Total Cost"), ("plan_rows", "Plan Rows"), ("plan_width", "Plan Width"),
+    ("actual_startup_time", "Actual Startup Time"), ("actual_total_time", "Actual Total Time"),
+    ("actual_rows", "Actual Rows"), ("actual_loops", "Actual Loops"), ("output", "Output"),
+    ("workers_planned", "Workers Planned"), ("single_copy", "Single Copy"), ("inner_unique", "Inner Unique"),
+    ("sort_key", "Sort Key"), ("sort_method", "Sort Method"), ("sort_space_type", "Sort Space Type"),
+    ("merge_cond", "Merge Cond"), ("hash_cond", "Hash Cond"), ("index_cond", "Index Cond"),
+    ("join_filter", "Join Filter"), ("filter", "Filter"), ("rows_removed_by_filter", "Rows Removed by Filter"),
+    ("hash_buckets", "Hash Buckets"),
+    ("shared_hit_blocks", "Shared Hit Blocks"), ("shared_read_blocks", "Shared Read Blocks"),
+    ("shared_dirtied_blocks", "Shared Dirtied Blocks"), ("shared_written_blocks", "Shared Written Blocks"),
+    ("local_hit_blocks", "Local Hit Blocks"), ("local_read_blocks", "Local Read Blocks"),
+    ("local_dirtied_blocks", "Local Dirtied Blocks"), ("local_written_blocks", "Local Written Blocks"),
+    ("temp_read_blocks", "Temp Read Blocks"), ("temp_written_blocks", "Temp Written Blocks"),
+    ("workers", "Workers"),
+)
+# values QueryNode derives, written by to_dict(derived=True) and ignored when a plan is loaded back
+_DERIVED_EXPLAIN_KEYS = ("Operation Cost", "Inclusive Time", "Exclusive Time", "Total Rows")
+
+# EXPLAIN keys that QueryNode parses into attributes, everything else goes into QueryNode.extras
+_KNOWN_EXPLAIN_KEYS = frozenset({
+    "Node Type", "Parallel Aware", "Startup Cost", "Total Cost", "Plan Rows", "Plan Width", "Output",
+    "Workers Planned", "Single Copy", "Parent Relationship", "Scan Direction", "Index Name", "Join Type",
+    "Join Filter", "Inner Unique", "Hash Cond", "Relation Name", "Schema", "Alias", "Sort Key", "Sort Method",
+    "Sort Space Type", "Merge Cond", "Index Cond", "Filter", "Actual Startup Time", "Actual Total Time",
+    "Actual Rows", "Actual Loops", "Rows Removed by Filter", "Hash Buckets", "Workers", "Plans",
+    "Shared Hit Blocks", "Shared Read Blocks", "Shared Dirtied Blocks", "Shared Written Blocks",
+    "Local Hit Blocks", "Local Read Blocks", "Local Dirtied Blocks", "Local Written Blocks",
+    "Temp Read Blocks", "Temp Written Blocks",
+})
+
+# postgres' default block size, used to turn BUFFERS block counts into bytes
+BLOCK_SIZE = 8192
+# operations reading or spilling at least this many MB get an I/O insight
+IO_INSIGHT_MB = 1
+# an in-memory sort needs more room than the same rows written to disk, scale disk usage by this
+SORT_MEMORY_FACTOR = 2
+# hash tables may use work_mem * hash_mem_multiplier, postgres' default since version 15
+HASH_MEM_MULTIPLIER = 2
+# a parallel operation is skewed when one process produced this many times its even share of the rows,
+# or took this many times the average worker time. Operations producing fewer rows than the minimum are ignored.
+WORKER_SKEW_RATIO = 1.5
+WORKER_SKEW_MIN_ROWS = 1000
+# a Gather is flagged when the time its leader spends beyond the slowest worker is at least this share of its
+# time, and at least GATHER_OVERHEAD_MIN_MS
+GATHER_OVERHEAD_SHARE = 0.3
+GATHER_OVERHEAD_MIN_MS = 1
+# row estimates within this q-error (the larger of estimated/actual and actual/estimated) are good,
+# from Q_ERROR_POOR on they are poor enough to mislead the planner's choices above them
+Q_ERROR_GOOD = 2
+Q_ERROR_POOR = 10
+
+
+def _blocks_to_mb(blocks: int) -> float:
+    return blocks * BLOCK_SIZE / (1024 * 1024)
 
 
 class QueryNode:
-    children: List = None
-    node_type: str = None
-    parallel_aware: str = None
-    startup_cost: float = None
-    total_cost: float = None
-    plan_rows: int = None
-    plan_width: int = None
-    output: List[str] = None
-    workers_planned: int = None
-    single_copy: bool = None
+    # plans can have thousands of nodes, slots keep each one compact
+    __slots__ = (
+        "children", "node_type", "parallel_aware", "startup_cost", "total_cost", "plan_rows", "plan_width",
+        "output", "workers_planned", "single_copy",
+        "parent_relationship", "scan_direction", "index_name", "join_type", "join_filter", "inner_unique",
+        "hash_cond", "relation_name", "schema", "alias",
+        "sort_key", "sort_method", "sort_space_type", "merge_cond", "index_cond", "filter",
+        "actual_startup_time", "actual_total_time", "actual_rows", "actual_loops", "rows_removed_by_filter",
+        "hash_buckets", "workers", "extras",
+        "shared_hit_blocks", "shared_read_blocks", "shared_dirtied_blocks", "shared_written_blocks",
+        "local_hit_blocks", "local_read_blocks", "local_dirtied_blocks", "local_written_blocks",
+        "temp_read_blocks", "temp_written_blocks",
+        "op_shared_hit_blocks", "op_shared_read_blocks", "op_local_read_blocks",
+        "op_temp_read_blocks", "op_temp_written_blocks",
+        "processes", "inclusive_time", "total_rows",
+        "op_cost", "actual_op_cost", "plan_total_cost", "plan_total_time",
+        "costliest_node", "slowest_node", "planning_time", "execution_time", "statement_timeout",
+        "_explanation", "_insights",
+        # lets views cache things per plan without keeping it alive, see layout.py
+        "__weakref__",
+    )
+
+    children: List
+    node_type: str
+    parallel_aware: str
+    startup_cost: float
+    total_cost: float
+    plan_rows: int
+    plan_width: int
+    output: List[str]
+    workers_planned: int
+    single_copy: bool
 
     # extras for intermediate nodes
-    parent_relationship: str = None
-    scan_direction: str = None
-    index_name: str = None
-    join_type: str = None
-    join_filter: str = None
-    inner_unique: bool = None
-    hash_cond: str = None
-
-    relation_name: str = None
-    schema: str = None
-    alias: str = None
-
-    sort_key: List = None
-    sort_method: str = None
-    sort_space_type: str = None
-    merge_cond: str = None
-    index_cond: str = None
-    filter: str = None
-    actual_startup_time = None
-    actual_total_time = None
-    actual_rows = None
-    actual_loops = None
-    hash_buckets = None
-    workers: List[Dict[str, str]] = None
-
-    # individual operation cost
-    op_cost: float = None
-    actual_op_cost: float = None
-    plan_total_cost: float = None
-    plan_total_time: float = None
+    parent_relationship: str
+    scan_direction: str
+    index_name: str
+    join_type: str
+    join_filter: str
+    inner_unique: bool
+    hash_cond: str
+
+    relation_name: str
+    schema: str
+    alias: str
+
+    sort_key: List
+    sort_method: str
+    sort_space_type: str
+    merge_cond: str
+    index_cond: str
+    filter: str
+    actual_startup_time: float
+    actual_total_time: float
+    actual_rows: int
+    actual_loops: int
+    rows_removed_by_filter: int
+    hash_buckets: int
+    workers: List[Dict[str, str]]
+    # EXPLAIN keys without a dedicated attribute, None if there are none
+    extras: Dict[str, Any] | None
+
+    # BUFFERS counters, in blocks, for this operation and all of its children. None without BUFFERS.
+    shared_hit_blocks: int
+    shared_read_blocks: int
+    shared_dirtied_blocks: int
+    shared_written_blocks: int
+    local_hit_blocks: int
+    local_read_blocks: int
+    local_dirtied_blocks: int
+    local_written_blocks: int
+    temp_read_blocks: int
+    temp_written_blocks: int
+    # the same counters for this operation only, computed like actual_op_cost
+    op_shared_hit_blocks: int
+    op_shared_read_blocks: int
+    op_local_read_blocks: int
+    op_temp_read_blocks: int
+    op_temp_written_blocks: int
+
+    # Postgres reports times and rows per loop, averaged over every process running the operation.
+    # These are the totals: inclusive_time is the wall clock milliseconds spent in this operation and its children
+    # over all of its loops (loops run by parallel processes overlap, so they are divided by processes), and
+    # total_rows the rows it produced over all loops and processes. None for estimated plans.
+    processes: int
+    inclusive_time: float
+    total_rows: int
+
+    # individual operation cost, actual_op_cost is the exclusive counterpart of inclusive_time
+    op_cost: float
+    actual_op_cost: float
+    plan_total_cost: float
+    plan_total_time: float
 
     # plan-wide
-    costliest_node = None
-    slowest_node = None
-    planning_time = None
-    execution_time = None
-
+    costliest_node: "QueryNode"
+    slowest_node: "QueryNode"
+    planning_time: float
+    execution_time: float
+
+    # Builds the whole tree below explain_map in a single iterative post-order pass,
+    # so arbitrarily deep plans never hit the recursion limit. On the way down each child's
+    # times are clamped to its parent's, on the way up op_cost and actual_op_cost are computed.
     def __init__(self, explain_map, plan_total_cost=None, plan_total_time=None):
+        self._load(explain_map, plan_total_cost, plan_total_time)
+
+        has_subplans = False
+        stack = [(self, explain_map, False)]
+        while stack:
+            node, node_map, visited = stack.pop()
+            if visited:
+                node._compute_op_cost()
+                continue
+
+            stack.append((node, node_map, True))
+            plans = node_map.get("Plans")
+            if not plans:
+                continue
+            children = node.children = []
+            processes = node._child_processes()
+            for p in plans:
+                child = QueryNode.__new__(QueryNode)
+                child._load(p, node.plan_total_cost, node.plan_total_time, processes)
+                node._clamp_child(child)
+                children.append(child)
+                stack.append((child, p, False))
+                has_subplans = has_subplans or child.parent_relationship in ("InitPlan", "SubPlan")
+
+        if has_subplans:
+            _attribute_subplan_times(self)
+
+    # populates this node's own fields from its EXPLAIN entry, without children.
+    # processes is the number of processes running the operation, more than 1 below a Gather.
+    def _load(self, explain_map, plan_total_cost=None, plan_total_time=None, processes: int = 1):
         self.node_type = explain_map.get("Node Type")
         self.parallel_aware = explain_map.get("Parallel Aware")
         self.startup_cost = explain_map.get("Startup Cost")
@@ -99,83 +383,291 @@ class QueryNode:
         self.filter = explain_map.get("Filter")
         self.actual_startup_time = explain_map.get("Actual Startup Time")
         self.actual_total_time = explain_map.get("Actual Total Time")
-        self.actual_rows = explain_map.get("Actual Rows", 0)
+        self.actual_rows = explain_map.get("Actual Rows")
         self.actual_loops = explain_map.get("Actual Loops")
-        self.rows_removed_by_filter = explain_map.get("Rows Removed by Filter", 0)
+        self.rows_removed_by_filter = explain_map.get("Rows Removed by Filter")
         self.hash_buckets = explain_map.get("Hash Buckets")
         self.workers = explain_map.get("Workers", [])
+        self.shared_hit_blocks = explain_map.get("Shared Hit Blocks")
+        self.shared_read_blocks = explain_map.get("Shared Read Blocks")
+        self.shared_dirtied_blocks = explain_map.get("Shared Dirtied Blocks")
+        self.shared_written_blocks = explain_map.get("Shared Written Blocks")
+        self.local_hit_blocks = explain_map.get("Local Hit Blocks")
+        self.local_read_blocks = explain_map.get("Local Read Blocks")
+        self.local_dirtied_blocks = explain_map.get("Local Dirtied Blocks")
+        self.local_written_blocks = explain_map.get("Local Written Blocks")
+        self.temp_read_blocks = explain_map.get("Temp Read Blocks")
+        self.temp_written_blocks = explain_map.get("Temp Written Blocks")
+        self.extras = {k: v for k, v in explain_map.items()
+                       if k not in _KNOWN_EXPLAIN_KEYS and k not in _DERIVED_EXPLAIN_KEYS} or None
+
+        # the Workers array, when VERBOSE reported one, says exactly which processes ran the operation
+        if self.workers:
+            worker_loops = sum(w.get("Actual Loops") or 1 for w in self.workers)
+            processes = len(self.workers) + (1 if (self.actual_loops or 0) > worker_loops else 0)
+        # an operation looped fewer times than there are processes was not run by all of them
+        if self.actual_loops is not None:
+            processes = min(processes, max(1, self.actual_loops))
+        self.processes = max(1, processes)
+        self.inclusive_time = None
+        self.total_rows = None
+        if self.actual_total_time is not None:
+            loops = self.actual_loops if self.actual_loops is not None else 1
+            self.total_rows = round((self.actual_rows or 0) * loops)
+            if self.workers and all(w.get("Actual Total Time") is not None for w in self.workers):
+                # the processes ran side by side, the operation took as long as the slowest of them
+                worker_times = [w["Actual Total Time"] * (w.get("Actual Loops") or 1) for w in self.workers]
+                leader_time = max(0.0, self.actual_total_time * loops - sum(worker_times))
+                self.inclusive_time = max(worker_times + [leader_time])
+            else:
+                # without a breakdown, assume the loops were spread evenly over the processes that ran them
+                self.inclusive_time = self.actual_total_time * loops / self.processes
+
+        self.op_cost = None
+        self.actual_op_cost = None
+        self.costliest_node = None
+        self.slowest_node = None
+        self.planning_time = None
+        self.execution_time = None
+        self.statement_timeout = None
+        self._explanation = None
+        self._insights = None
 
         if not plan_total_cost and not plan_total_time:
-            plan_total_cost = self.op_cost
-            plan_total_time = self.actual_total_time
+            plan_total_cost = self.total_cost
+            plan_total_time = self.inclusive_time
         self.plan_total_cost = plan_total_cost
         self.plan_total_time = plan_total_time
-
-        self.children = [QueryNode(p, plan_total_cost, plan_total_time) for p in explain_map.get("Plans", [])]
-
-        self._explainMapping = {
-            "Gather": self._explain_gather,
-            "Hash Join": self._explain_hj,
-            "Seq Scan": self._explain_ss,
-            "Hash": self._explain_hash,
-            "Merge Join": self._explain_merge_join,
-            "Sort": self._explain_sort,
-            "Nested Loop": self._explain_nl_join,
-            "Index Only Scan": self._explain_index_only_scan,
-            "Index Scan": self._explain_index_scan
-        }
+        self.children = []
+
+    # number of processes running this node's children, the Gather's workers and usually its leader
+    def _child_processes(self) -> int:
+        if self.node_type not in ("Gather", "Gather Merge"):
+            return self.processes
+        launched = self.workers_launched()
+        processes = launched if launched is not None else self.workers_planned or 0
+        # with Single Copy the leader only collects, unless no worker could be launched
+        return processes if self.single_copy and processes else processes + 1
+
+    # Postgres can report a child as taking longer than its parent (e.g. a Gather whose workers
+    # started before the leader), clamp it so the parent's own time stays non-negative.
+    # Only the derived total is clamped, the reported per-loop times are kept as they are.
+    def _clamp_child(self, child: "QueryNode"):
+        if self.inclusive_time is None or child.inclusive_time is None:
+            return
+        if child.inclusive_time > self.inclusive_time:
+            child.inclusive_time = self.inclusive_time
+            child.invalidate()
+
+    # cost and time of this operation alone, its children must already be built.
+    # Call again (it invalidates the cached explanation) whenever the times of this node or its children change.
+    def _compute_op_cost(self):
+        self.op_cost = self.total_cost
+        for child in self.children:
+            self.op_cost -= child.total_cost
+        self.actual_op_cost = self._exclusive_time()
+
+        self.op_shared_hit_blocks = self._exclusive_blocks("shared_hit_blocks")
+        self.op_shared_read_blocks = self._exclusive_blocks("shared_read_blocks")
+        self.op_local_read_blocks = self._exclusive_blocks("local_read_blocks")
+        self.op_temp_read_blocks = self._exclusive_blocks("temp_read_blocks")
+        self.op_temp_written_blocks = self._exclusive_blocks("temp_written_blocks")
+        self.invalidate()
+
+    # inclusive_time minus the children's, never below 0. A CTE is not subtracted, its time is already inside
+    # the CTE Scans reading it, see _attribute_subplan_times. Neither are the children in skipped, while charged
+    # is time spent in this operation on behalf of a node that is not its child.
+    def _exclusive_time(self, skipped=(), charged: float = 0.0) -> float | None:
+        if self.inclusive_time is None:
+            return None
+        time = self.inclusive_time - charged
+        for child in self.children:
+            if child.inclusive_time is not None and not child.is_cte() and child not in skipped:
+                time -= child.inclusive_time
+        return max(0.0, time)
+
+    # the name Postgres gives an InitPlan, SubPlan or CTE below its parent, e.g. "InitPlan 1 (returns $0)"
+    def subplan_name(self) -> str | None:
+        return (self.extras or {}).get("Subplan Name")
+
+    # whether this node produces a CTE, materialized once and read by CTE Scans elsewhere in the plan
+    def is_cte(self) -> bool:
+        return self.parent_relationship == "InitPlan" and (self.subplan_name() or "").startswith("CTE ")
+
+    # a BUFFERS counter minus the children's, never below 0 since shared subplans can be counted twice
+    def _exclusive_blocks(self, attr: str) -> int | None:
+        blocks = getattr(self, attr)
+        if blocks is None:
+            return None
+        for child in self.children:
+            blocks -= getattr(child, attr) or 0
+        return max(0, blocks)
+
+    # fraction of shared buffer accesses served from cache, for this operation only or including its children
+    def buffer_hit_ratio(self, inclusive: bool = False) -> float | None:
+        hit = self.shared_hit_blocks if inclusive else self.op_shared_hit_blocks
+        read = self.shared_read_blocks if inclusive else self.op_shared_read_blocks
+        if hit is None or read is None or hit + read == 0:
+            return None
+        return hit / (hit + read)
+
+    # MB read from outside of postgres' shared buffers (os cache or disk)
+    def disk_read_mb(self, inclusive: bool = False) -> float:
+        if inclusive:
+            return _blocks_to_mb((self.shared_read_blocks or 0) + (self.local_read_blocks or 0))
+        return _blocks_to_mb((self.op_shared_read_blocks or 0) + (self.op_local_read_blocks or 0))
+
+    # MB written to temporary files because the operation did not fit in work_mem
+    def temp_spill_mb(self, inclusive: bool = False) -> float:
+        return _blocks_to_mb((self.temp_written_blocks if inclusive else self.op_temp_written_blocks) or 0)
+
+    # work_mem, in kB, this operation would have needed to stay in memory, None if it did not spill to disk.
+    # A Sort spills when its Sort Space Type is Disk, a Hash when it needs more than one batch and a
+    # hashed Aggregate when it reports Disk Usage. Parallel workers each get their own work_mem, so the
+    # largest of the leader's and workers' needs is taken.
+    def work_mem_needed_kb(self) -> int | None:
+        extras = self.extras or {}
+        entries = [{**extras, "Sort Space Type": self.sort_space_type}] + list(self.workers)
+        needed = []
+        for e in entries:
+            if self.node_type == "Sort" and e.get("Sort Space Type") == "Disk" and e.get("Sort Space Used"):
+                needed.append(e["Sort Space Used"] * SORT_MEMORY_FACTOR)
+            elif self.node_type == "Hash" and (e.get("Hash Batches") or 1) > 1 and e.get("Peak Memory Usage"):
+                needed.append(e["Peak Memory Usage"] * e["Hash Batches"] / HASH_MEM_MULTIPLIER)
+            elif self.node_type == "Aggregate" and (e.get("Disk Usage") or 0) > 0:
+                needed.append((e.get("Peak Memory Usage", 0) + e["Disk Usage"] * SORT_MEMORY_FACTOR)
+                              / HASH_MEM_MULTIPLIER)
+        return ceil(max(needed)) if needed else None
+
+    # rows and time of every process that ran this node in a parallel plan, workers first then the leader.
+    # Postgres reports the node's rows and time averaged over the loops of every process, so the leader's
+    # share is what is left of the totals once the workers' are taken out. Empty when no worker ran the node.
+    def worker_stats(self) -> List[Dict[str, Any]]:
+        if not self.workers:
+            return []
+        stats = [{
+            "Process": f"Worker {w.get('Worker Number', i)}",
+            "Rows": (w.get("Actual Rows") or 0) * (w.get("Actual Loops") or 1),
+            "Time": w.get("Actual Total Time"),
+        } for i, w in enumerate(self.workers)]
+        leader_loops = (self.actual_loops or 0) - sum(w.get("Actual Loops") or 1 for w in self.workers)
+        if leader_loops > 0:
+            worker_rows = sum(s["Rows"] for s in stats)
+            leader_time = None
+            if self.actual_total_time is not None and all(s["Time"] is not None for s in stats):
+                worker_time = sum(w["Actual Total Time"] * (w.get("Actual Loops") or 1) for w in self.workers)
+                leader_time = round(max(0.0, self.actual_total_time * self.actual_loops - worker_time) / leader_loops, 3)
+            stats.append({"Process": "Leader", "Rows": max(0, (self.total_rows or 0) - worker_rows),
+                          "Time": leader_time})
+        return stats
+
+    # how unevenly the rows were spread over the processes that ran this node: the largest share over the
+    # even share, 1 when perfectly balanced. None when fewer than two processes ran it or it produced no rows.
+    def worker_row_skew(self) -> float | None:
+        rows = [s["Rows"] for s in self.worker_stats()]
+        if len(rows) < 2 or not sum(rows):
+            return None
+        return max(rows) / (sum(rows) / len(rows))
+
+    # the slowest process' time over the average, None with fewer than two timed processes
+    def worker_time_skew(self) -> float | None:
+        times = [s["Time"] for s in self.worker_stats() if s["Time"] is not None]
+        if len(times) < 2 or not sum(times):
+            return None
+        return max(times) / (sum(times) / len(times))
+
+    # How far off the row estimate was, as max(estimated / actual, actual / estimated), both over all loops
+    # (Plan Rows is per loop like Actual Rows, and per process for a parallel operation) and at least 1 row.
+    # 1 is a perfect estimate. None for estimated plans and operations that never ran.
+    def q_error(self) -> float | None:
+        if not self.analyzed() or not self.actual_loops or self.plan_rows is None:
+            return None
+        estimated = max(1.0, self.plan_rows * self.actual_loops)
+        actual = max(1.0, self.total_rows)
+        return max(estimated / actual, actual / estimated)
+
+    # number of workers a Gather or Gather Merge actually got, which can be fewer than planned
+    # when max_parallel_workers or max_worker_processes run out. None for other operations.
+    def workers_launched(self) -> int | None:
+        return (self.extras or {}).get("Workers Launched")
+
+    # milliseconds a Gather spent beyond the slowest process running its input: starting the workers and
+    # collecting and passing on their rows. None for other operations and estimated plans.
+    def gather_overhead_ms(self) -> float | None:
+        if self.node_type not in ("Gather", "Gather Merge") or not self.children or self.actual_total_time is None:
+            return None
+        child = self.children[0]
+        times = [st["Time"] for st in child.worker_stats() if st["Time"] is not None]
+        slowest = max(times, default=child.actual_total_time or 0)
+        return max(0.0, self.actual_total_time - slowest)
 
     # In natural language, explain what this node does.
     # We parse the explanation from bottom up.
     def explain(self) -> Tuple[List[Tuple[str, Dict[str, str], Any]], float, float]:
         res = []
-        self.op_cost = self.total_cost
-        self.actual_op_cost = self.actual_total_time
-        for i, child in enumerate(self.children):
-            l, child_cost, actual_child_cost = child.explain()
-            self.op_cost -= child_cost
-            self.actual_op_cost -= actual_child_cost
-            res.extend(l)
-            if i + 1 < len(self.children):
-                res.append(
-                    (
-                        f"The above output is then passed into a {self.node_type} operation as an input."
-                        f" However, before we can process the {self.node_type} operation, "
-                        f"we still have to process {len(self.children) - i - 1}"
-                        " more intermediate input, discussed immediately below.\n", None, None)
-                )
-
-        if self.node_type not in self._explainMapping:
-            print(self.node_type + " is not supported")
-        res.append(self.explain_self())
+        stack = [(self, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i < len(node.children):
+                if i > 0:
+                    res.append(
+                        (
+                            f"The above output is then passed into a {node.node_type} operation as an input."
+                            f" However, before we can process the {node.node_type} operation, "
+                            f"we still have to process {len(node.children) - i}"
+                            " more intermediate input, discussed immediately below.\n", None, None)
+                    )
+                stack.append((node, i + 1))
+                stack.append((node.children[i], 0))
+                continue
+
+            if node.node_type not in self._EXPLAIN_MAPPING:
+                print(node.node_type + " is not supported")
+            res.append(node.explain_self())
 
         return res, self.total_cost, self.actual_total_time
 
     # explains itself only, does not parse the tree.
+    # The explanation is built on first use and cached until the node is invalidated.
     def explain_self(self) -> Tuple[str, Dict[str, str], Any]:
-        exp = self._explainMapping.get(self.node_type, self._generic_explain)()
-        return exp[0], exp[1], self
+        if self._explanation is None:
+            self._explanation = self._EXPLAIN_MAPPING.get(self.node_type, QueryNode._generic_explain)(self)
+        return self._explanation[0], dict(self._explanation[1]), self
+
+    # whether the plan was executed (EXPLAIN ANALYZE), plain EXPLAIN only has estimates
+    def analyzed(self) -> bool:
+        return self.actual_total_time is not None
+
+    # drops the cached explanation and insights, call after changing any of this node's fields
+    def invalidate(self):
+        self._explanation = None
+        self._insights = None
 
     # analyze itself to get insights for the user
     # potential insights can include:
     # 1. Index scan more appropriate than a seq scan if filter
     #  condition removes large % of rows, recc to build an index
-    # 2. Quality of estimation for plan rows vs actual rows
+    # 2. Quality of estimation for plan rows vs actual rows, as the q-error over all loops
     # 3. % of time spent on this operation alone
     # 4. Whether this operation is slow. > 5ms (Slow), > 10ms (Very Slow)
     # 5. Estimated cost is high or not.
     # 6. If the sort is by a single column, or multiple columns from the same table,
     # you may be able to avoid it entirely by adding an index with the desired order.
+    # 7. MB read from disk or spilled to temp files by this operation alone.
+    # 8. The work_mem a sort, hash or hash aggregate that spilled to disk would need to stay in memory.
     def get_node_insights(self) -> Dict[str, str]:
-        if not self.actual_op_cost:
-            self.explain()
+        if self._insights is None:
+            self._insights = self._compute_node_insights()
+        return dict(self._insights)
 
+    def _compute_node_insights(self) -> Dict[str, str]:
         insights = {}  # label: Description
 
         # Checking potential scan optimisation
-        if "scan" in self.node_type.lower() and self.filter:
-            ttl_rows = self.actual_rows + self.rows_removed_by_filter
-            perc_removed = self.rows_removed_by_filter / ttl_rows * 100
+        if "scan" in self.node_type.lower() and self.filter and self.analyzed():
+            removed = self.rows_removed_by_filter or 0
+            ttl_rows = (self.actual_rows or 0) + removed
+            perc_removed = removed / ttl_rows * 100 if ttl_rows else 0
             if perc_removed > 70:
                 if self.node_type == "Seq Scan":
                     insights[
@@ -188,23 +680,30 @@ class QueryNode:
                                                  f"Consider building indexes on the attributes in the filter " \
                                                  f"condition as an index only scan might perform better."
 
-        # checking quality of row estimation
-        est_rows_accuracy = abs(self.plan_rows - self.actual_rows) / max(1, self.actual_rows)
-        if est_rows_accuracy < 0.5:
-            insights["Row Estimation Quality"] = "Poor row estimation accuracy."
-        elif est_rows_accuracy < 0.8:
-            insights["Row Estimation Quality"] = "Decent row estimation accuracy."
-        else:
-            insights["Row Estimation Quality"] = "Good row estimation accuracy."
-
-        # 3. % of time spent on operation
-        insights["Percentage Of Time Spent On Operation"] = f"{self.actual_op_cost / self.plan_total_time * 100:.2f}%"
-
-        # 4. whether this op is slow
-        if 5 < self.actual_op_cost < 10:
-            insights["Raw Speed"] = f"{self.actual_op_cost}ms.\n\nOperation is slow."
-        elif self.actual_op_cost >= 10:
-            insights["Raw Speed"] = f"{self.actual_op_cost}ms.\n\nOperation is very slow."
+        # 2. to 4. compare against what actually happened, an estimated plan has nothing to compare against
+        if self.analyzed():
+            # checking quality of row estimation, over all loops
+            q_error = self.q_error()
+            if q_error is not None:
+                if q_error >= Q_ERROR_POOR:
+                    quality = "Poor"
+                elif q_error > Q_ERROR_GOOD:
+                    quality = "Decent"
+                else:
+                    quality = "Good"
+                insights["Row Estimation Quality"] = \
+                    f"{quality} row estimation accuracy.\n\n{round(self.plan_rows * self.actual_loops)} rows " \
+                    f"estimated, {self.total_rows} returned{self._loops_note()}: a q-error of {q_error:.2f}."
+
+            # 3. % of time spent on operation
+            insights["Percentage Of Time Spent On Operation"] = \
+                f"{self.actual_op_cost / self.plan_total_time * 100:.2f}%"
+
+            # 4. whether this op is slow
+            if 5 < self.actual_op_cost < 10:
+                insights["Raw Speed"] = f"{self.actual_op_cost:.2f}ms.\n\nOperation is slow."
+            elif self.actual_op_cost >= 10:
+                insights["Raw Speed"] = f"{self.actual_op_cost:.2f}ms.\n\nOperation is very slow."
 
         # 5. estimated cost is high or low
         if 3000 < self.op_cost < 10000:
@@ -228,13 +727,67 @@ class QueryNode:
                     "Potential sort index"] = "The sort is by a single column, or multiple columns from the same table.\n" \
                                               "You may be able to avoid it entirely by adding an index with the desired" \
                                               " order."
+
+        # 7. I/O done by this operation alone, slow operations are often waiting on disk rather than the cpu
+        read_mb = self.disk_read_mb()
+        if read_mb >= IO_INSIGHT_MB:
+            hit_ratio = self.buffer_hit_ratio()
+            insights["Disk Reads"] = f"This operation read {read_mb:.2f} MB from disk." + (
+                f"\n\n{hit_ratio * 100:.2f}% of its shared buffer accesses were cache hits." if hit_ratio is not None
+                else "")
+        spill_mb = self.temp_spill_mb()
+        if spill_mb >= IO_INSIGHT_MB:
+            insights["Temp Spill"] = f"This operation spilled {spill_mb:.2f} MB to temp files.\n\n" \
+                                     f"It did not fit in work_mem, raising work_mem may keep it in memory."
+
+        # 8. work_mem that would have kept a spilling sort, hash or hash aggregate in memory
+        work_mem_kb = self.work_mem_needed_kb()
+        if work_mem_kb is not None:
+            insights["Work Mem Spill"] = f"This {self.node_type} spilled to disk.\n\n" \
+                                         f"It would need a work_mem of about {ceil(work_mem_kb / 1024)}MB to stay " \
+                                         f"in memory."
+
+        # 9. one process doing most of a parallel operation's work, the others wait for it
+        row_skew, time_skew = self.worker_row_skew(), self.worker_time_skew()
+        total_rows = sum(s["Rows"] for s in self.worker_stats())
+        if row_skew is not None and row_skew >= WORKER_SKEW_RATIO and total_rows >= WORKER_SKEW_MIN_ROWS:
+            busiest = max(self.worker_stats(), key=lambda st: st["Rows"])
+            insights["Parallel Skew"] = f"{busiest['Process']} produced {busiest['Rows'] / total_rows * 100:.2f}% " \
+                                        f"of the rows, {row_skew:.2f}x its even share.\n\nThe other processes sat " \
+                                        f"idle waiting for it, uneven data such as a few very large partitions " \
+                                        f"or a skewed join key is the usual cause."
+        elif time_skew is not None and time_skew >= WORKER_SKEW_RATIO and total_rows >= WORKER_SKEW_MIN_ROWS:
+            insights["Parallel Skew"] = f"The slowest process took {time_skew:.2f}x the average time.\n\n" \
+                                        f"The other processes sat idle waiting for it."
+
+        # 10. fewer workers than planned, the plan was costed for more parallelism than it got
+        launched = self.workers_launched()
+        if launched is not None and self.workers_planned and launched < self.workers_planned:
+            insights["Workers Launched"] = f"Only {launched} of {self.workers_planned} planned workers were " \
+                                           f"launched.\n\nThe server ran out of background workers, consider " \
+                                           f"raising max_parallel_workers and max_worker_processes."
+
+        # 11. leader time spent gathering rather than in the workers
+        overhead = self.gather_overhead_ms()
+        if overhead is not None and overhead >= GATHER_OVERHEAD_MIN_MS and \
+                overhead >= GATHER_OVERHEAD_SHARE * self.actual_total_time:
+            insights["Gather Overhead"] = f"{overhead:.2f}ms ({overhead / self.actual_total_time * 100:.2f}%) " \
+                                          f"of this {self.node_type} was spent beyond its slowest process.\n\n" \
+                                          f"Starting workers and passing rows between processes is not paying " \
+                                          f"off, the query may be faster without parallelism."
+
         return insights
 
     def _explain_gather(self) -> Tuple[str, Dict[str, str]]:
+        launched = self.workers_launched()
+        overhead = self.gather_overhead_ms()
         return f"A Gather operation is performed on the output of {self.workers_planned} workers.", dict({
             "Description": "Gather combines the output of child nodes, which are executed "
                            "by parallel workers. Gather does not make any guarantee about "
                            "ordering, unlike Gather Merge, which preserves sort order.",
+            **({"Workers Launched": f"{launched} of {self.workers_planned} planned"} if launched is not None else {}),
+            **({"Gather overhead": f"{overhead:.2f}ms\n\nTime spent beyond the slowest process running the input, "
+                                   f"starting workers and collecting their rows."} if overhead is not None else {}),
             **self._generic_explain_dict()
         })
 
@@ -248,7 +801,7 @@ class QueryNode:
         }, **self._generic_explain_dict())
 
     def _explain_ss(self) -> Tuple[str, Dict[str, str]]:
-        return f"A sequential scan is performed on the {self.schema + '.' if self.relation_name else ''}{self.relation_name}" \
+        return f"A sequential scan is performed on the {self.schema + '.' if self.schema else ''}{self.relation_name}" \
                " relation.\n", dict({
             "Description": "A Sequential Scan reads the rows from the table, in order.\nWhen reading from a table,"
                            " Seq Scans (unlike Index Scans) perform a single read operation"
@@ -256,7 +809,7 @@ class QueryNode:
             "Relation": f"{self.schema + '.' if self.schema else ''}"
                         f"{self.relation_name}{f' as {self.alias}' if self.alias else ''}",
             "Filter condition": f"{self.filter}",
-            "Rows removed by filter": f"{self.rows_removed_by_filter}\n\nThe per-loop average number of rows "
+            "Rows removed by filter": f"{(self.rows_removed_by_filter or 0) if self.analyzed() else 'NA'}\n\nThe per-loop average number of rows "
                                       f"removed by the filtering condition."
         }, **self._generic_explain_dict())
 
@@ -278,45 +831,18 @@ class QueryNode:
         }, **self._generic_explain_dict())
 
     def _explain_sort(self) -> Tuple[str, Dict[str, str]]:
-        return f"A sort operation is performed based on {','.join(self.sort_key)} and is done in {self.sort_space_type}.", dict(
+        # where the sort was done is only known once it has run
+        done_in = f" and is done in {self.sort_space_type}" if self.sort_space_type else ""
+        return f"A sort operation is performed based on {','.join(self.sort_key)}{done_in}.", dict(
             {
                 "Description": "Sorting is performed as a result of an ORDER BY clause.\n"
                                "Sorting is expensive in terms of time and memory. The work_mem setting determines how much memory is given to Postgres per sort.\n"
                                "If sorting requires more memroy than work_mem, it will be carried out on the disk with slower speed.\n",
                 "Join type": self.join_type,
                 "Parent Relationship": self.parent_relationship,
-                "Sort Method": self.sort_method.capitalize()
+                "Sort Method": self.sort_method.capitalize() if self.sort_method else "NA"
             }, **self._generic_explain_dict())
     
-    def _explain_nl_join(self) -> Tuple[str, Dict[str, str]]:
-       return f"A Nested Loop Join operation is performed on {self.join_filter}.", dict({
-            "Description": "Nested Loop Join is run by iterating through one list, and for every row it contains, its corresponding"
-                           "partner is looked up in the other list.\n"
-                           "This is effective when one of the lists are very small, resulting in a small number of loops being run\n",
-            "Join type": self.join_type
-        }, **self._generic_explain_dict()) 
-
-    def _explain_index_only_scan(self) -> Tuple[str, Dict[str, str]]:
-        return f"An index-only scan can retrieve all the necessary data from an index without having to access the table, provided that the required information is available in the index.\n", dict({
-            "Description": "If the query includes a condition that can be satisfied by the index alone, "
-                            "and all the columns needed for the query are included in the index, the database engine can perform an index-only scan to retrieve the data directly from the index.\n"
-                            "This makes it faster than index scan and its performance can be seen in large datasets.\n",
-            "Relation": f"{self.schema + '.' if self.schema else ''}"
-                        f"{self.relation_name}{f' as {self.alias}' if self.alias else ''}",
-            "Filter condition": f"{self.filter}",
-            "Index Condition": f"{self.index_cond}"
-        }, **self._generic_explain_dict()) 
-    
-    def _explain_index_scan(self) -> Tuple[str, Dict[str, str]]:
-        return f"An index scan requires the accessing of the all the columns of the index to see if it matches the condition\n", dict({
-            "Description": "The process of an index scan involves searching the index for rows that meet a specific condition and then fetching those rows from the table.\n"
-             "This method can be highly efficient if only a small portion of the rows are required and can also be useful for retrieving rows in a specific order.\n"
-             "This two-step process of index scan therefore, makes it slower than sequential scan if all rows are needed and no particular order is required\n",
-            "Scan Direction": f"{self.scan_direction}",
-            "Index Name": f"{self.index_name}",
-            "Index Cond": f"{self.index_cond}"
-        }, **self._generic_explain_dict())  
-
     def _explain_nl_join(self) -> Tuple[str, Dict[str, str]]:
         return f"A Nested Loop Join operation is performed on {self.join_filter}.", dict({
             "Description": "Nested Loop Join is run by iterating through one list, and for every row it contains, its corresponding"
@@ -365,56 +891,266 @@ class QueryNode:
             "Planned Rows": f"{self.plan_rows}\n\nNumber of rows estimated to be returned.",
             "Planned Width": f"{self.plan_width}\n\nAverage number of bytes estimated in a row returned "
                              f"by the operation.",
+            **self._actual_explain_dict(),
+            **self._workers_explain_dict(),
+            **self._buffers_explain_dict(),
+        }
+
+    def _loops_note(self) -> str:
+        return f" over {self.actual_loops} loops" if self.actual_loops > 1 else ""
+
+    def _processes_note(self) -> str:
+        if self.processes == 1:
+            return ""
+        return f", the loops of its {self.processes} parallel processes overlapping"
+
+    def _workers_explain_dict(self) -> Dict[str, str]:
+        stats = self.worker_stats()
+        if not stats:
+            return {}
+        lines = [f"{st['Process']}: {st['Rows']} rows" + (f" in {st['Time']}ms" if st["Time"] is not None else "")
+                 for st in stats]
+        skew = self.worker_row_skew()
+        return {
+            "Workers": "\n".join(lines) + (f"\n\nThe busiest process produced {skew:.2f}x its even share of the "
+                                           f"rows." if skew is not None else ""),
+        }
+
+    # the measured times and rows, only known when the plan was analyzed
+    def _actual_explain_dict(self) -> Dict[str, str]:
+        if not self.analyzed():
+            return {}
+        return {
             "Actual startup time": f"{self.actual_startup_time}\n\nThe amount of time, in milliseconds, it takes to get "
                                    f"the first row out of the operation.",
             "Actual total time": f"{self.actual_total_time}\n\nThe actual amount of time in milliseconds spent on "
                                  f"this operation and all of its children. It is a per-loop average, "
                                  f"rounded to the nearest thousandth of a millisecond.",
-            # Actual operation time with subplans and CTE is tricky to calculate.
-            "Actual Operation time": f"{self.actual_op_cost:.2f}\n\nThe actual time taken in milliseconds for this operation only.",
+            # InitPlans, SubPlans and CTEs are attributed to where they are evaluated, see _attribute_subplan_times
+            "Actual Operation time": f"{self.actual_op_cost:.2f}\n\nThe actual time taken in milliseconds for this operation only"
+                                     f"{', over all of its loops' if self.actual_loops and self.actual_loops > 1 else ''}.",
+            "Total time": f"{self.inclusive_time:.2f}\n\nThe time in milliseconds spent on this operation and all of its "
+                          f"children over all of its loops{self._processes_note()}.",
             "Actual Rows": f"{self.actual_rows}\n\nThe average number of rows returned by the operation per loop,"
                            f" rounded to the nearest integer.",
+            "Total Rows": f"{self.total_rows}\n\nThe number of rows returned by the operation over all of its loops.",
             "Actual Loops": f"{self.actual_loops}\n\nThe number of times the operation is executed.",
         }
 
+    def _buffers_explain_dict(self) -> Dict[str, str]:
+        if self.op_shared_hit_blocks is None:
+            return {}
+        hit_ratio = self.buffer_hit_ratio()
+        return {
+            "Shared buffers": f"{self.op_shared_hit_blocks} hit, {self.op_shared_read_blocks} read"
+                              f"{f' ({hit_ratio * 100:.2f}% hit ratio)' if hit_ratio is not None else ''}\n\n"
+                              f"Blocks found in postgres' cache (hit) or read from the os or disk (read), "
+                              f"by this operation only.",
+            "Temp blocks": f"{self.op_temp_read_blocks} read, {self.op_temp_written_blocks} written "
+                           f"({self.temp_spill_mb():.2f} MB)\n\nBlocks of temporary files used by this operation "
+                           f"because its data did not fit in work_mem.",
+        }
+
+    # node type to the method explaining it, shared by every node
+    _EXPLAIN_MAPPING = {
+        "Gather": _explain_gather,
+        "Hash Join": _explain_hj,
+        "Seq Scan": _explain_ss,
+        "Hash": _explain_hash,
+        "Merge Join": _explain_merge_join,
+        "Sort": _explain_sort,
+        "Nested Loop": _explain_nl_join,
+        "Index Only Scan": _explain_index_only_scan,
+        "Index Scan": _explain_index_scan
+    }
+
     def __str__(self):
         return self.node_type
 
+    # The tree below this node as EXPLAIN (FORMAT JSON) would write it, so QueryNode(node.to_dict()) rebuilds it.
+    # Keys are always written in the same order and absent values are left out, so equal plans serialize
+    # equally. With derived=True every node also gets the cost, times and rows computed from the plan.
+    def to_dict(self, derived: bool = False) -> Dict[str, Any]:
+        out = None
+        stack = [(self, None)]
+        while stack:
+            node, parent_plans = stack.pop()
+            d = {key: getattr(node, attr) for attr, key in _EXPLAIN_FIELDS
+                 if getattr(node, attr) is not None and getattr(node, attr) != []}
+            if node.extras:
+                d.update(node.extras)
+            if derived:
+                d["Operation Cost"] = node.op_cost
+                if node.analyzed():
+                    d["Inclusive Time"] = node.inclusive_time
+                    d["Exclusive Time"] = node.actual_op_cost
+                    d["Total Rows"] = node.total_rows
+            if node.children:
+                d["Plans"] = [None] * len(node.children)
+                stack.extend((child, (d["Plans"], i)) for i, child in enumerate(node.children))
+            if parent_plans is None:
+                out = d
+            else:
+                parent_plans[0][parent_plans[1]] = d
+        return out
+
     def get_plan_insight(self):
-        if self.costliest_node is None or self.slowest_node is None:
+        if self.costliest_node is None:
             return {}
 
+        if self.slowest_node is None:
+            return {
+                "Estimated Plan": "The query was not executed, only the planner's estimates are shown."
+                                  f"{self._timeout_note()}",
+                "Costliest Operation": f"{self.costliest_node.node_type} was estimated at a cost of {self.costliest_node.op_cost:.2f}.",
+                "Planning Time": f"{self.planning_time}ms",
+            }
+
         return {
             "Slowest Operation": f"{self.slowest_node.node_type} took {self.slowest_node.actual_op_cost:.2f}ms.",
             "Costliest Operation": f"{self.costliest_node.node_type} was estimated at a cost of {self.costliest_node.op_cost:.2f}.",
             "Planning Time": f"{self.planning_time}ms",
-            "Plan Execution Time": f"{self.execution_time}ms"
+            "Plan Execution Time": f"{self.execution_time}ms",
+            **self._plan_io_insight(),
+            **self._plan_parallel_insight(),
+        }
+
+    def _timeout_note(self) -> str:
+        if self.statement_timeout is None:
+            return ""
+        return f"\n\nEXPLAIN ANALYZE was cancelled after the {self.statement_timeout}ms statement timeout."
+
+    def _plan_parallel_insight(self) -> Dict[str, str]:
+        gathers = [n for n in preorder(self) if n.workers_launched() is not None]
+        if not gathers:
+            return {}
+        planned = sum(n.workers_planned or 0 for n in gathers)
+        launched = sum(n.workers_launched() for n in gathers)
+        insight = {"Parallel Workers": f"{launched} of {planned} planned workers launched"}
+        skewed = [n for n in preorder(self) if "Parallel Skew" in n.get_node_insights()]
+        if skewed:
+            insight["Parallel Skew"] = f"{len(skewed)} parallel operations were skewed, the worst being " \
+                                       f"{max(skewed, key=lambda n: n.worker_row_skew() or 0).node_type}."
+        return insight
+
+    def _plan_io_insight(self) -> Dict[str, str]:
+        if self.shared_hit_blocks is None:
+            return {}
+        hit_ratio = self.buffer_hit_ratio(inclusive=True)
+        return {
+            "Shared Buffer Hit Ratio": f"{hit_ratio * 100:.2f}%" if hit_ratio is not None else "NA",
+            "Disk Reads": f"{self.disk_read_mb(inclusive=True):.2f} MB",
+            "Temp Spill": f"{self.temp_spill_mb(inclusive=True):.2f} MB",
         }
 
 
 # returns the query plan graph node
-def get_query_plan(query: str, enable_hj: bool, enable_mj: bool, enable_nfl: bool, enable_ss: bool) -> Tuple[List[
+# Results are cached by normalized query text and planner settings, pass use_cache=False to force a re-run.
+# With analyze=False the query is only planned, not executed, and the plan has estimates but no times.
+# When analyzing takes longer than statement_timeout milliseconds (STATEMENT_TIMEOUT by default, 0 for no limit)
+# it is cancelled and the estimated plan is returned instead, with root_node.statement_timeout set.
+# The query runs against database, DATABASE by default, on its shared pool.
+def get_query_plan(query: str, enable_hj: bool, enable_mj: bool, enable_nfl: bool, enable_ss: bool,
+                   cancel_token: CancelToken = None, use_cache: bool = True, analyze: bool = True,
+                   statement_timeout: int = None, database: str = None) -> Tuple[List[
     Tuple[str, Dict[Any, Any], Any]], None] | Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode]:
-    # we do not commit the transaction so analyze does not change db state
+    settings = planner_settings(enable_hj, enable_mj, enable_nfl, enable_ss)
+    if statement_timeout is None:
+        statement_timeout = STATEMENT_TIMEOUT
+    pool = get_pool(database)
+
+    key = None
+    if use_cache:
+        version = None
+        if PLAN_CACHE_CHECK_VERSION:
+            with pool.connection() as conn:
+                version = _catalog_version(conn)
+        key_settings = settings if analyze else {**settings, "explain": "estimate"}
+        if pool.database != DATABASE:
+            key_settings = {**key_settings, "database": pool.database}
+        key = make_key(query, key_settings, version)
+        result = plan_cache.get(key)
+        if result is not None:
+            return build_query_plan(result)
+
+    # we do not commit the transaction so analyze does not change db state,
+    # the pool rolls back every connection when it is handed back.
     try:
-        cursor.execute(f"set enable_hashjoin = {'true' if enable_hj else 'false'};")
-        cursor.execute(f"set enable_mergejoin = {'true' if enable_mj else 'false'};")
-        cursor.execute(f"set enable_nestloop = {'true' if enable_nfl else 'false'};")
-        cursor.execute(f"set enable_seqscan = {'true' if enable_ss else 'false'};")
-        cursor.execute("EXPLAIN (ANALYZE, COSTS, FORMAT JSON, VERBOSE, BUFFERS) " + query.rstrip(";") + ";")
-        r = cursor.fetchone()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    
-    if not r or not r[0]:
+        with pool.connection() as conn:
+            result = fetch_plan(conn, query, settings, cancel_token, analyze,
+                                statement_timeout if analyze else None)
+    except psycopg2.extensions.QueryCanceledError:
+        if not analyze or not statement_timeout or (cancel_token is not None and cancel_token.cancelled):
+            raise
+        with pool.connection() as conn:
+            result = fetch_plan(conn, query, settings, cancel_token, analyze=False)
+        steps, root_node = build_query_plan(result)
+        if root_node is not None:
+            root_node.statement_timeout = statement_timeout
+        return steps, root_node
+
+    if key is not None and result:
+        plan_cache.put(key, result)
+    return build_query_plan(result)
+
+
+# the planner settings applied for the GUI's checkboxes
+def planner_settings(enable_hj: bool, enable_mj: bool, enable_nfl: bool, enable_ss: bool) -> Dict[str, bool]:
+    return {
+        "enable_hashjoin": enable_hj,
+        "enable_mergejoin": enable_mj,
+        "enable_nestloop": enable_nfl,
+        "enable_seqscan": enable_ss,
+    }
+
+
+# runs EXPLAIN ANALYZE on a borrowed connection, returning the raw json result
+# statement_timeout (milliseconds) makes the server cancel it with QueryCanceledError when it runs longer.
+def fetch_plan(conn, query: str, settings: Dict[str, Any], cancel_token: CancelToken = None,
+               analyze: bool = True, statement_timeout: int = None) -> List[Dict[str, Any]]:
+    options = "ANALYZE, COSTS, FORMAT JSON, VERBOSE, BUFFERS" if analyze else "COSTS, FORMAT JSON, VERBOSE"
+    if statement_timeout:
+        settings = {**settings, "statement_timeout": int(statement_timeout)}
+    # the settings and the explain are sent in a single round trip, local to the transaction the pool rolls back
+    statements = [f"set local {name} = {_setting_literal(value)};" for name, value in settings.items()]
+    statements.append(f"EXPLAIN ({options}) " + query.rstrip().rstrip(";") + ";")
+
+    if cancel_token is not None:
+        cancel_token.bind(conn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("\n".join(statements))
+            r = cursor.fetchone()
+    finally:
+        if cancel_token is not None:
+            cancel_token.unbind()
+    return r[0] if r else None
+
+
+def _setting_literal(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# a token that changes whenever a cached plan may no longer be representative
+def _catalog_version(conn) -> str:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version(), "
+                       "(SELECT max(greatest(last_analyze, last_autoanalyze))::text FROM pg_stat_user_tables);")
+        return "|".join(str(v) for v in cursor.fetchone())
+
+
+# Builds the explanation steps and QueryNode tree from a raw EXPLAIN (FORMAT JSON) result.
+def build_query_plan(result: List[Dict[str, Any]]) -> Tuple[List[
+    Tuple[str, Dict[Any, Any], Any]], None] | Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode]:
+    if not result:
         print("no plan returned")
         return [("No plan returned", {}, None)], None
 
-    plan = r[0][0]["Plan"]
-    sanitize_plan(plan)
-
-    root_node = QueryNode(plan)
+    root_node = QueryNode(result[0]["Plan"])
     res, _, _ = root_node.explain()
     # formatting and mark costliest and slowest node in plan
     costliest = None
@@ -430,100 +1166,467 @@ def get_query_plan(query: str, enable_hj: bool, enable_mj: bool, enable_nfl: boo
             continue
         if costliest is None or node.op_cost > costliest.op_cost:
             costliest = node
-        if slowest is None or node.actual_op_cost > slowest.actual_op_cost:
+        # an estimated plan has no times, so no slowest node
+        if node.actual_op_cost is not None and (slowest is None or node.actual_op_cost > slowest.actual_op_cost):
             slowest = node
 
     root_node.slowest_node = slowest
     root_node.costliest_node = costliest
-    slowest.slowest_node = slowest
+    if slowest is not None:
+        slowest.slowest_node = slowest
     costliest.costliest_node = costliest
 
-    root_node.planning_time = r[0][0].get("Planning Time", "NA")
-    root_node.execution_time = r[0][0].get("Execution Time", "NA")
+    root_node.planning_time = result[0].get("Planning Time", "NA")
+    root_node.execution_time = result[0].get("Execution Time", "NA")
 
     return res, root_node
 
 
-def sanitize_plan(plan):
-    actual_ttl = plan["Actual Total Time"]
-    for sub_plan in plan.get("Plans", []):
-        if sub_plan["Actual Total Time"] > actual_ttl:
-            sub_plan["Actual Total Time"] = actual_ttl - 0.01
-            sub_plan["Actual Startup Time"] = plan["Actual Startup Time"] - 0.01
-        sanitize_plan(sub_plan)
+# Builds (steps, root_node) for every plan in saved EXPLAIN (FORMAT JSON) output, without a database.
+# source may be a path to a file, the json text itself, or already parsed json.
+def load_query_plans(source) -> List[Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode]]:
+    return [build_query_plan([entry]) for entry in iter_explain_entries(source)]
+
+
+# like load_query_plans, for sources holding a single statement's plan
+def load_query_plan(source) -> Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode]:
+    for entry in iter_explain_entries(source):
+        return build_query_plan([entry])
+    return build_query_plan([])
+
+
+# Yields one {"Plan": ..., "Planning Time": ..., ...} entry per statement found in the source.
+# Accepts the array postgres returns (one element per statement), several arrays or objects
+# concatenated in one file, a bare plan node, and text copied out of psql with its
+# "QUERY PLAN" header and "+" line continuations.
+# A string naming an existing file is read from it, any other string must hold the json itself: a single line
+# without any json raises FileNotFoundError, as it was most likely meant as a path, other text ValueError.
+def iter_explain_entries(source):
+    if isinstance(source, (list, dict)):
+        yield from _explain_entries(source)
+        return
+
+    if isinstance(source, bytes):
+        source = source.decode()
+    if isinstance(source, os.PathLike) or os.path.isfile(source):
+        with open(source) as f:
+            source = f.read()
+    elif "[" not in source and "{" not in source:
+        if "\n" not in source.strip():
+            raise FileNotFoundError(f"no such plan file: {source}")
+        raise ValueError("no EXPLAIN (FORMAT JSON) output found")
+
+    text = _strip_psql_formatting(source)
+    decoder = json.JSONDecoder()
+    i = 0
+    while True:
+        while i < len(text) and text[i] not in "[{":
+            i += 1
+        if i >= len(text):
+            return
+        doc, i = decoder.raw_decode(text, i)
+        yield from _explain_entries(doc)
+
+
+def _explain_entries(doc):
+    if isinstance(doc, list):
+        for d in doc:
+            yield from _explain_entries(d)
+    elif "Plan" in doc:
+        yield doc
+    elif "Node Type" in doc:
+        yield {"Plan": doc}
+    elif "QUERY PLAN" in doc:  # row exported from a client as {"QUERY PLAN": [...]}
+        yield from _explain_entries(doc["QUERY PLAN"])
+
+
+def _strip_psql_formatting(text: str) -> str:
+    if "QUERY PLAN" not in text[:200]:
+        return text
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped == "QUERY PLAN" or set(stripped) <= set("-+") or (stripped.startswith("(") and "row" in stripped):
+            continue
+        lines.append(line.rstrip().removesuffix("+"))
+    return "\n".join(lines)
 
 
 # Takes in 2 query node, returns a nested dict describing the diff
-# the outer key is the category of node_type, with a corresponding list of dict describing
-# each diff identified
+# the outer key is the category of the diff, with a corresponding list of dict describing
+# each diff identified:
+# "Scans" and "Joins" for scan and join operations found in both plans,
+# "Other" for any other operation found in both plans but changed,
+# "Removed" and "Inserted" for operations found in only the old or new plan.
+# Operations are paired up structurally by match_plans, so repeated relations, self-joins
+# and aliased scans each get their own entry.
 def get_plan_diff(old_root, new_root) -> Dict[str, List[Dict[str, str]]]:
     res = defaultdict(list)
-
-    old_scans = _identify_scans(old_root)
-    new_scans = _identify_scans(new_root)
-    for k, v in old_scans.items():
-        if k in new_scans:
-            tmp = {
-                "Old scan time taken": f"{v.actual_op_cost:.2f}ms",
-                "New scan time taken": f"{new_scans[k].actual_op_cost:.2f}ms",
-                "Relation": k,
-            }
-            if v.node_type != new_scans[k].node_type:
-                tmp[
-                    "Description"] = f"In old plan, a {v.node_type} on {k} was done{f' with filter: {v.filter}' if v.filter else ''}. In the new plan, a {new_scans[k].node_type} on {k} was done{f' with filter: {new_scans[k].filter}' if new_scans[k].filter else ''} instead."
-            else:
-                filter_str = ""
-                if v.filter or new_scans[k].filter:
-                    filter_str = "\nBoth scans were also performed with the same filter condition."
-                if v.filter != new_scans[k].filter:
-                    filter_str = f"\nHowever, the old plan scan was performed with a filtering condition of {v.filter}, " \
-                                 f"while the new plan scan was performed with a filtering condition of {new_scans[k].filter}"
-                tmp["Description"] = f"In both plans, a {v.node_type} scan was performed on {k}." + filter_str
-            res["Scans"].append(tmp)
-
-    old_joins = _identify_joins(old_root)
-    new_joins = _identify_joins(new_root)
-    for k, v in old_joins.items():
-        if k in new_joins:
-            tmp = {
-                "Old join time taken": f"{v.actual_op_cost:.2f}ms",
-                "New join time taken": f"{new_joins[k].actual_op_cost:.2f}ms",
-                "Join condition": k,
-            }
-            if v.node_type != new_joins[k].node_type:
-                tmp[
-                    "Description"] = f"In old plan, a {v.node_type} with join condition {k} was done. In the new plan, a {new_joins[k].node_type} with join condition {k} was done instead."
-            else:
-                tmp["Description"] = f"In both plans, a {v.node_type} was performed with join condition {k}."
-            res["Joins"].append(tmp)
+    matches = match_plans(old_root, new_root)
+
+    for old in preorder(old_root):
+        new = matches.get(old)
+        if new is None:
+            res["Removed"].append({
+                "Operation": _operation_label(old),
+                "Old time taken": _format_ms(old.actual_op_cost),
+                "Old cost": f"{old.op_cost:.2f}",
+                "Description": f"The old plan performed a {_operation_label(old)}, which the new plan does not.",
+            })
+        elif "scan" in old.node_type.lower() and old.relation_name:
+            res["Scans"].append(_scan_diff(old, new))
+        elif "join" in old.node_type.lower() or old.node_type == "Nested Loop":
+            res["Joins"].append(_join_diff(old, new))
+        elif _node_label(old) != _node_label(new):
+            tmp = _deltas(old, new, "operation")
+            tmp["Operation"] = _operation_label(old)
+            tmp["Description"] = f"In old plan, a {_operation_label(old)} was done. " \
+                                 f"In the new plan, a {_operation_label(new)} was done instead."
+            res["Other"].append(tmp)
+
+    matched_new = set(matches.values())
+    for new in preorder(new_root):
+        if new not in matched_new:
+            res["Inserted"].append({
+                "Operation": _operation_label(new),
+                "New time taken": _format_ms(new.actual_op_cost),
+                "New cost": f"{new.op_cost:.2f}",
+                "Description": f"The new plan performs a {_operation_label(new)}, which the old plan did not.",
+            })
 
     return res
 
 
-def _identify_scans(root: QueryNode) -> Dict[str, QueryNode]:
-    queue = deque([root])
-
-    scans = {}
-    while queue:
-        top = queue.popleft()
-        if "scan" in top.node_type.lower() and top.relation_name:
-            scans[top.relation_name] = top
-
-        queue.extend(top.children)
-
-    return scans
-
-
-def _identify_joins(root: QueryNode) -> Dict[str, QueryNode]:
-    queue = deque([root])
-
-    joins = {}
-    while queue:
-        top = queue.popleft()
-        join_cond = top.merge_cond or top.hash_cond
-        if "join" in top.node_type.lower() and join_cond:
-            joins[join_cond] = top
-
-        queue.extend(top.children)
-
-    return joins
+def _scan_diff(v: QueryNode, new: QueryNode) -> Dict[str, str]:
+    k = v.relation_name
+    tmp = _deltas(v, new, "scan")
+    tmp["Relation"] = k
+    if v.node_type != new.node_type:
+        tmp[
+            "Description"] = f"In old plan, a {v.node_type} on {k} was done{f' with filter: {v.filter}' if v.filter else ''}. In the new plan, a {new.node_type} on {k} was done{f' with filter: {new.filter}' if new.filter else ''} instead."
+    else:
+        filter_str = ""
+        if v.filter or new.filter:
+            filter_str = "\nBoth scans were also performed with the same filter condition."
+        if v.filter != new.filter:
+            filter_str = f"\nHowever, the old plan scan was performed with a filtering condition of {v.filter}, " \
+                         f"while the new plan scan was performed with a filtering condition of {new.filter}"
+        tmp["Description"] = f"In both plans, a {v.node_type} scan was performed on {k}." + filter_str
+    return tmp
+
+
+def _join_diff(v: QueryNode, new: QueryNode) -> Dict[str, str]:
+    k = _join_condition(v)
+    new_k = _join_condition(new)
+    tmp = _deltas(v, new, "join")
+    tmp["Join condition"] = k
+    if v.node_type != new.node_type:
+        tmp[
+            "Description"] = f"In old plan, a {v.node_type} with join condition {k} was done. In the new plan, a {new.node_type} with join condition {new_k} was done instead."
+    elif k != new_k:
+        tmp["Description"] = f"In both plans, a {v.node_type} was performed, with join condition {k} in the old " \
+                             f"plan and {new_k} in the new plan."
+    else:
+        tmp["Description"] = f"In both plans, a {v.node_type} was performed with join condition {k}."
+    return tmp
+
+
+def _deltas(old: QueryNode, new: QueryNode, kind: str) -> Dict[str, str]:
+    tmp = {
+        f"Old {kind} time taken": _format_ms(old.actual_op_cost),
+        f"New {kind} time taken": _format_ms(new.actual_op_cost),
+    }
+    if old.actual_op_cost is not None and new.actual_op_cost is not None:
+        tmp["Time difference"] = f"{new.actual_op_cost - old.actual_op_cost:+.2f}ms"
+    tmp["Cost difference"] = f"{new.op_cost - old.op_cost:+.2f}"
+    return tmp
+
+
+def _format_ms(ms: float | None) -> str:
+    return "NA" if ms is None else f"{ms:.2f}ms"
+
+
+def _join_condition(node: QueryNode) -> str:
+    return node.merge_cond or node.hash_cond or node.join_filter or "none"
+
+
+def _operation_label(node: QueryNode) -> str:
+    if node.relation_name:
+        return f"{node.node_type} on {node.relation_name}{f' as {node.alias}' if node.alias else ''}"
+    cond = node.merge_cond or node.hash_cond or node.join_filter
+    if cond:
+        return f"{node.node_type} on {cond}"
+    if node.sort_key:
+        return f"{node.node_type} on {', '.join(node.sort_key)}"
+    return node.node_type
+
+
+# every operation of the plan, the root first and each child's subtree in order
+def preorder(root: QueryNode):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+
+
+# Moves the time of subplans to where Postgres actually spends it, once the whole tree is built.
+# Every operation's time includes the subplans it evaluates, so by default a child's time is taken out of its
+# parent's. That holds for a SubPlan, evaluated by its parent once per row, its loops already counting every
+# evaluation. It does not for:
+#  - a CTE, materialized once by whichever CTE Scan reads it first and then read by the others. Its time is
+#    inside the CTE Scans', so it is taken out of those instead, in proportion to the rows each scan read.
+#  - an InitPlan, run once by the first operation that needs its result. When that is a descendant of the
+#    operation it is attached to, its time is inside that descendant's and is taken out there.
+def _attribute_subplan_times(root: QueryNode):
+    skipped: Dict[QueryNode, List[QueryNode]] = defaultdict(list)
+    charged: Dict[QueryNode, float] = defaultdict(float)
+    cte_scans: Dict[QueryNode, List[QueryNode]] = {}
+
+    # CTEs are visible to every descendant of the operation they are attached to
+    stack = [(root, {})]
+    while stack:
+        node, ctes = stack.pop()
+        producers = {c.subplan_name()[len("CTE "):]: c for c in node.children if c.is_cte()}
+        if producers:
+            ctes = {**ctes, **producers}
+            for producer in producers.values():
+                cte_scans.setdefault(producer, [])
+        if node.node_type == "CTE Scan":
+            producer = ctes.get((node.extras or {}).get("CTE Name"))
+            if producer is not None:
+                cte_scans[producer].append(node)
+
+        for child in node.children:
+            if child.parent_relationship == "InitPlan" and not child.is_cte() and child.inclusive_time:
+                consumer = _initplan_consumer(node, child)
+                if consumer is not None:
+                    skipped[node].append(child)
+                    charged[consumer] += child.inclusive_time
+            stack.append((child, ctes))
+
+    for producer, scans in cte_scans.items():
+        if not producer.inclusive_time:
+            continue
+        # a CTE nobody read was still evaluated by the operation it is attached to
+        if not scans:
+            charged[_parent_of(root, producer)] += producer.inclusive_time
+            continue
+        rows = sum(scan.total_rows or 0 for scan in scans)
+        for scan in scans:
+            share = (scan.total_rows or 0) / rows if rows else 1 / len(scans)
+            charged[scan] += producer.inclusive_time * share
+
+    for node in set(skipped) | set(charged):
+        node.actual_op_cost = node._exclusive_time(skipped.get(node, ()), charged.get(node, 0.0))
+        node.invalidate()
+
+
+# the deepest operation below parent, other than the InitPlan itself, whose expressions use the InitPlan's
+# result, None when only parent does. Results are named $0, $1... in the InitPlan's name before Postgres 16,
+# (InitPlan 1).col1 from 16 on.
+def _initplan_consumer(parent: QueryNode, initplan: QueryNode) -> QueryNode | None:
+    name = initplan.subplan_name() or ""
+    params = re.findall(r"\$\d+", name)
+    patterns = [re.escape(p) + r"(?!\d)" for p in params]
+    number = re.match(r"InitPlan (\d+)", name)
+    if number:
+        patterns.append(re.escape(f"(InitPlan {number.group(1)})"))
+    if not patterns:
+        return None
+    used = re.compile("|".join(patterns))
+
+    consumer, consumer_depth = None, 0
+    stack = [(c, 1) for c in parent.children if c is not initplan]
+    while stack:
+        node, depth = stack.pop()
+        if depth > consumer_depth and any(used.search(e) for e in _expressions(node)):
+            consumer, consumer_depth = node, depth
+        stack.extend((c, depth + 1) for c in node.children)
+    return consumer
+
+
+# the conditions and output of an operation, where subplan results can be referenced
+def _expressions(node: QueryNode) -> List[str]:
+    extras = node.extras or {}
+    expressions = [node.filter, node.index_cond, node.join_filter, node.hash_cond, node.merge_cond,
+                   extras.get("Recheck Cond"), extras.get("One-Time Filter"), extras.get("TID Cond")]
+    return [e for e in expressions if e] + list(node.output or [])
+
+
+def _parent_of(root: QueryNode, child: QueryNode) -> QueryNode | None:
+    for node in preorder(root):
+        if any(c is child for c in node.children):
+            return node
+    return None
+
+
+# what makes two operations the same, ignoring their inputs, times and costs
+def _node_label(node: QueryNode) -> Tuple:
+    return (node.node_type, node.relation_name, node.alias, node.index_name, node.join_type,
+            node.hash_cond, node.merge_cond, node.join_filter, node.index_cond, node.filter,
+            tuple(node.sort_key) if node.sort_key else None)
+
+
+# operations of the same kind can stand in for each other in a diff,
+# e.g. a Seq Scan replaced by an Index Scan on the same relation, or a Hash Join by a Merge Join
+def _node_kind(node: QueryNode) -> Tuple:
+    node_type = node.node_type.lower()
+    if "scan" in node_type and node.relation_name:
+        return "scan", node.relation_name
+    if "join" in node_type or node_type == "nested loop":
+        return "join",
+    if node_type.startswith("gather"):
+        return "gather",
+    if "aggregate" in node_type:
+        return "aggregate",
+    return node_type,
+
+
+# identifies a plan's shape, plans using the same operations in the same tree share a signature
+def plan_signature(root: QueryNode) -> int:
+    return _subtree_signatures(root)[root]
+
+
+# hash of every subtree's labels, computed bottom up so equal subtrees share a signature
+def _subtree_signatures(root: QueryNode) -> Dict[QueryNode, int]:
+    sigs = {}
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            sigs[node] = hash((_node_label(node), tuple(sigs[c] for c in node.children)))
+            continue
+        stack.append((node, True))
+        stack.extend((c, False) for c in node.children)
+    return sigs
+
+
+# above this many cells, children are paired greedily rather than by edit distance
+_MAX_ALIGN_CELLS = 10000
+
+
+# Pairs up the operations of two plans, returning old node -> new node.
+# 1. identical subtrees are matched whole by their signatures, largest first.
+# 2. from the roots down, the remaining children of every matched pair are aligned by a sequence edit
+#    distance over their labels (a top-down constrained tree edit distance), matching same-kind operations.
+# 3. operations left over, e.g. under a parent that only exists in one plan, are paired by label then
+#    by kind in plan order, and their children aligned as in 2.
+# Every step is linear in the plan size, except ordering the subtrees by size and the edit distance over a
+# node's unmatched children.
+def match_plans(old_root: QueryNode, new_root: QueryNode) -> Dict[QueryNode, QueryNode]:
+    old_sigs = _subtree_signatures(old_root)
+    new_sigs = _subtree_signatures(new_root)
+    matches = {}
+    matched_new = set()
+
+    def match_subtrees(old: QueryNode, new: QueryNode):
+        for o, n in zip(preorder(old), preorder(new)):
+            matches[o] = n
+            matched_new.add(n)
+
+    # 1. identical subtrees. Matching a small subtree first could take a node out of a larger identical
+    # subtree, which would then overwrite that match and leave its new node paired with nothing.
+    candidates = defaultdict(deque)
+    for node in preorder(old_root):
+        candidates[old_sigs[node]].append(node)
+    new_nodes = list(preorder(new_root))
+    sizes = {}
+    for node in reversed(new_nodes):
+        sizes[node] = 1 + sum(sizes[c] for c in node.children)
+    for node in sorted(new_nodes, key=lambda n: -sizes[n]):
+        # descendants of a subtree matched whole are already paired
+        if node in matched_new:
+            continue
+        pending = candidates.get(new_sigs[node])
+        while pending and pending[0] in matches:
+            pending.popleft()
+        if pending:
+            match_subtrees(pending.popleft(), node)
+
+    # 2. top-down alignment of what is left
+    def align(queue: List[Tuple[List[QueryNode], List[QueryNode]]]):
+        while queue:
+            old_children, new_children = queue.pop()
+            for o, n in _align_children(old_children, new_children, matches, matched_new):
+                matches[o] = n
+                matched_new.add(n)
+                queue.append((o.children, n.children))
+
+    align([([old_root], [new_root])])
+
+    # 3. leftovers
+    for key in (_node_label, _node_kind):
+        leftover = defaultdict(deque)
+        for node in preorder(old_root):
+            if node not in matches:
+                leftover[key(node)].append(node)
+        queue = []
+        for node in preorder(new_root):
+            pending = leftover.get(key(node))
+            if node in matched_new or not pending:
+                continue
+            old = pending.popleft()
+            matches[old] = node
+            matched_new.add(node)
+            queue.append((old.children, node.children))
+        align(queue)
+
+    return matches
+
+
+# pairs the unmatched nodes of two child lists by edit distance,
+# relabelling costs less for identical operations than for operations of the same kind
+def _align_children(olds: List[QueryNode], news: List[QueryNode], matches: Dict[QueryNode, QueryNode],
+                    matched_new: set) -> List[Tuple[QueryNode, QueryNode]]:
+    olds = [o for o in olds if o not in matches]
+    news = [n for n in news if n not in matched_new]
+    if not olds or not news:
+        return []
+
+    if len(olds) * len(news) > _MAX_ALIGN_CELLS:
+        pairs = []
+        by_kind = defaultdict(deque)
+        for n in news:
+            by_kind[_node_kind(n)].append(n)
+        for o in olds:
+            pending = by_kind.get(_node_kind(o))
+            if pending:
+                pairs.append((o, pending.popleft()))
+        return pairs
+
+    # operations whose inputs were already matched to each other are the likelier pair
+    def relabel_cost(o: QueryNode, n: QueryNode) -> float:
+        if _node_kind(o) != _node_kind(n):
+            return inf
+        shared = 0
+        if o.children and n.children:
+            shared = sum(1 for c in o.children if matches.get(c) in n.children) / max(len(o.children), len(n.children))
+        if _node_label(o) == _node_label(n):
+            return 0.5 - 0.5 * shared
+        return 1 - 0.5 * shared
+
+    rows, cols = len(olds), len(news)
+    dist = [[0.0] * (cols + 1) for _ in range(rows + 1)]
+    for i in range(rows + 1):
+        dist[i][0] = i
+    for j in range(cols + 1):
+        dist[0][j] = j
+    for i in range(1, rows + 1):
+        for j in range(1, cols + 1):
+            dist[i][j] = min(dist[i - 1][j] + 1, dist[i][j - 1] + 1,
+                             dist[i - 1][j - 1] + relabel_cost(olds[i - 1], news[j - 1]))
+
+    pairs = []
+    i, j = rows, cols
+    while i > 0 and j > 0:
+        cost = relabel_cost(olds[i - 1], news[j - 1])
+        if cost != inf and dist[i][j] == dist[i - 1][j - 1] + cost:
+            pairs.append((olds[i - 1], news[j - 1]))
+            i, j = i - 1, j - 1
+        elif dist[i][j] == dist[i - 1][j] + 1:
+            i -= 1
+        else:
+            j -= 1
+    pairs.reverse()
+    return pairs
@@ -0,0 +1,155 @@
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+from cli import output_file
+from explain import QueryNode, load_query_plan, match_plans
+
+# folded stacks carry integer weights, exclusive times are written in microseconds
+FOLDED_UNITS_PER_MS = 1000
+
+
+# Exports of an analyzed plan's time for flame graph viewers. Every operation is a frame whose parents are the
+# operations above it in the plan, weighted by its exclusive time (actual_op_cost).
+
+
+# operator, relation and condition of an operation, e.g. Index Scan on public.orders as o using orders_pkey
+# (o.o_orderkey = l.l_orderkey). Folded stacks separate frames with ";" so it is replaced.
+def frame_label(node: QueryNode) -> str:
+    label = node.node_type
+    if node.relation_name:
+        label += f" on {node.schema + '.' if node.schema else ''}{node.relation_name}"
+        if node.alias and node.alias != node.relation_name:
+            label += f" as {node.alias}"
+    if node.index_name:
+        label += f" using {node.index_name}"
+    subplan = (node.extras or {}).get("Subplan Name")
+    if subplan:
+        label += f" [{subplan}]"
+    cond = node.index_cond or node.hash_cond or node.merge_cond or node.join_filter or node.filter
+    if cond:
+        label += f" {cond}"
+    elif node.sort_key:
+        label += f" by {', '.join(node.sort_key)}"
+    return " ".join(label.replace(";", ",").split())
+
+
+def _check_analyzed(root: QueryNode):
+    if root is None or not root.analyzed():
+        raise ValueError("the plan was not analyzed, it has no times to draw")
+
+
+# every operation with the labels of the operations above it, root first
+def _stacks(root: QueryNode) -> List[Tuple[QueryNode, Tuple[str, ...]]]:
+    stacks = []
+    stack = [(root, (frame_label(root),))]
+    while stack:
+        node, path = stack.pop()
+        stacks.append((node, path))
+        for child in reversed(node.children):
+            stack.append((child, path + (frame_label(child),)))
+    return stacks
+
+
+def _folded_weight(ms: float) -> int:
+    return round((ms or 0) * FOLDED_UNITS_PER_MS)
+
+
+# The plan in collapsed stack format, one "root;child;...;operation weight" line per distinct stack, as read by
+# flamegraph.pl, inferno and speedscope. Weights are exclusive times in microseconds.
+def folded_stacks(root: QueryNode) -> List[str]:
+    _check_analyzed(root)
+    weights: Dict[Tuple[str, ...], int] = {}
+    for node, path in _stacks(root):
+        weights[path] = weights.get(path, 0) + _folded_weight(node.actual_op_cost)
+    return [f"{';'.join(path)} {weight}" for path, weight in weights.items() if weight > 0]
+
+
+# Two plans in the "stack old_weight new_weight" format of difffolded.pl, for a differential flame graph.
+# Operations aligned by match_plans share the new plan's stack, so a changed operation shows as one frame
+# that grew or shrank; operations only in one plan keep their own stack with a weight of 0 in the other.
+def folded_diff(old_root: QueryNode, new_root: QueryNode) -> List[str]:
+    _check_analyzed(old_root)
+    _check_analyzed(new_root)
+    new_paths = {node: path for node, path in _stacks(new_root)}
+    matches = match_plans(old_root, new_root)
+
+    weights: Dict[Tuple[str, ...], List[int]] = {}
+    for node, path in _stacks(old_root):
+        match = matches.get(node)
+        weights.setdefault(new_paths[match] if match is not None else path, [0, 0])[0] += \
+            _folded_weight(node.actual_op_cost)
+    for node, path in new_paths.items():
+        weights.setdefault(path, [0, 0])[1] += _folded_weight(node.actual_op_cost)
+    return [f"{';'.join(path)} {old} {new}" for path, (old, new) in weights.items() if old or new]
+
+
+# A speedscope (https://www.speedscope.app) file with one evented profile per plan, named by the keys of plans,
+# so two plans can be flipped between or viewed side by side. Frames are shared between the profiles.
+# Each operation spans its exclusive time plus its children's spans, children laid out one after the other.
+def speedscope_profile(plans: Dict[str, QueryNode], name: str = "Query plan") -> Dict[str, Any]:
+    frames: List[Dict[str, str]] = []
+    frame_index: Dict[str, int] = {}
+    profiles = []
+    for profile_name, root in plans.items():
+        _check_analyzed(root)
+        events = []
+        at = 0.0
+        stack = [(root, False)]
+        while stack:
+            node, closing = stack.pop()
+            label = frame_label(node)
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({"name": label})
+            if closing:
+                at += node.actual_op_cost or 0
+                events.append({"type": "C", "frame": frame_index[label], "at": at})
+                continue
+            events.append({"type": "O", "frame": frame_index[label], "at": at})
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+        profiles.append({
+            "type": "evented",
+            "name": profile_name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": at,
+            "events": events,
+        })
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "postgres query plan visualizer",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export an analyzed plan, or the diff of two, for flame graph "
+                                                 "viewers.")
+    parser.add_argument("plan", help="EXPLAIN (ANALYZE, FORMAT JSON) output of the plan")
+    parser.add_argument("new_plan", nargs="?", help="a second plan to compare the first against")
+    parser.add_argument("-f", "--format", choices=("folded", "speedscope"), default="folded",
+                        help="collapsed stacks (or old/new pairs for two plans), or a speedscope json profile")
+    parser.add_argument("-o", "--output", help="file to write to, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    _, root = load_query_plan(args.plan)
+    new_root = load_query_plan(args.new_plan)[1] if args.new_plan else None
+    if args.format == "speedscope":
+        plans = {"Old plan": root, "New plan": new_root} if new_root is not None else {"Plan": root}
+        text = json.dumps(speedscope_profile(plans))
+    else:
+        text = "\n".join(folded_diff(root, new_root) if new_root is not None else folded_stacks(root))
+
+    with output_file(args.output) as out:
+        out.write(text + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
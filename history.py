@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Any, Dict, List
+
+from cache import normalize_query
+from explain import QueryNode, build_query_plan, get_plan_diff, plan_signature, DATABASE
+
+# sqlite file keeping every analyzed plan, history is off when unset
+PLAN_HISTORY_PATH = os.environ.get("PLAN_HISTORY_PATH")
+# number of most recent runs of a query its new runs are compared against
+BASELINE_RUNS = int(os.environ.get("BASELINE_RUNS", 5))
+# a run this much slower than the baseline's median execution time is a regression
+REGRESSION_THRESHOLD = float(os.environ.get("REGRESSION_THRESHOLD", 0.2))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    query TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    execution_time REAL,
+    planning_time REAL,
+    plan TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs (fingerprint, recorded_at);
+CREATE INDEX IF NOT EXISTS runs_recorded_at ON runs (recorded_at);
+"""
+
+
+# identifies a query across runs, formatting-only edits keep the same fingerprint
+def fingerprint(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode()).hexdigest()
+
+
+# One stored analysis of a query. The plan tree is only rebuilt when root_node is first called.
+class HistoryRun:
+    id: int = None
+    query: str = None
+    settings: Dict[str, Any] = None
+    recorded_at: float = None
+    execution_time: float = None
+    planning_time: float = None
+    plan: Dict[str, Any] = None
+
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.query = row["query"]
+        self.settings = json.loads(row["settings"])
+        self.recorded_at = row["recorded_at"]
+        self.execution_time = row["execution_time"]
+        self.planning_time = row["planning_time"]
+        self.plan = json.loads(row["plan"])
+        self._root_node = None
+
+    def root_node(self) -> QueryNode:
+        if self._root_node is None:
+            _, self._root_node = build_query_plan([{
+                "Plan": self.plan, "Planning Time": self.planning_time, "Execution Time": self.execution_time,
+            }])
+        return self._root_node
+
+
+# A new run of a query that is slower than its baseline, or planned differently.
+# diff compares the baseline run with the median execution time against the new run, like get_plan_diff.
+class Regression:
+    run: HistoryRun = None
+    baseline: List[HistoryRun] = None
+    baseline_time: float = None
+    change: float = None
+    shape_changed: bool = None
+    diff: Dict[str, List[Dict[str, str]]] = None
+
+    def __init__(self, run: HistoryRun, baseline: List[HistoryRun], shape_changed: bool):
+        self.run = run
+        self.baseline = baseline
+        self.baseline_time = statistics.median(r.execution_time for r in baseline)
+        self.change = (run.execution_time - self.baseline_time) / self.baseline_time if self.baseline_time else 0.0
+        self.shape_changed = shape_changed
+        median_run = sorted(baseline, key=lambda r: r.execution_time)[(len(baseline) - 1) // 2]
+        self.diff = get_plan_diff(median_run.root_node(), run.root_node())
+
+    def report(self) -> Dict[str, str]:
+        reasons = []
+        if self.change > REGRESSION_THRESHOLD:
+            reasons.append(f"{self.change * 100:+.2f}% execution time")
+        if self.shape_changed:
+            reasons.append("a plan shape not seen in the baseline")
+        changes = ", ".join(f"{len(self.diff[c])} {c.lower()}" for c in ("Scans", "Joins", "Other", "Removed",
+                                                                         "Inserted") if self.diff.get(c))
+        return {
+            "Regression": f"This run shows {' and '.join(reasons)}.",
+            "Baseline": f"Median of {len(self.baseline)} runs from "
+                        f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(self.baseline[-1].recorded_at))} to "
+                        f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(self.baseline[0].recorded_at))}: "
+                        f"{self.baseline_time:.2f}ms",
+            "This run": f"{self.run.execution_time:.2f}ms",
+            "Plan changes": changes or "none",
+        }
+
+
+# Every analyzed plan, kept in a sqlite file by query fingerprint and time, to spot queries that got slower.
+# Safe to share between threads.
+class PlanHistory:
+    path: str = None
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    # stores an analyzed plan, returning the stored run
+    def record(self, query: str, settings: Dict[str, Any], root_node: QueryNode,
+               recorded_at: float = None) -> HistoryRun:
+        if not root_node.analyzed():
+            raise ValueError("only analyzed plans have an execution time to keep")
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (fingerprint, query, settings, recorded_at, execution_time, planning_time, plan) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint(query), query, json.dumps(settings, sort_keys=True),
+                 recorded_at if recorded_at is not None else time.time(), _number(root_node.execution_time),
+                 _number(root_node.planning_time), json.dumps(root_node.to_dict())))
+            row = self._conn.execute("SELECT * FROM runs WHERE id = ?", (cursor.lastrowid,)).fetchone()
+        return HistoryRun(row)
+
+    # runs of a query, most recent first, under the given planner settings only when given
+    def runs(self, query: str, settings: Dict[str, Any] = None, limit: int = None,
+             before: float = None) -> List[HistoryRun]:
+        sql = "SELECT * FROM runs WHERE fingerprint = ?"
+        params: List[Any] = [fingerprint(query)]
+        if settings is not None:
+            sql += " AND settings = ?"
+            params.append(json.dumps(settings, sort_keys=True))
+        if before is not None:
+            sql += " AND recorded_at < ?"
+            params.append(before)
+        sql += " ORDER BY recorded_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [HistoryRun(row) for row in self._conn.execute(sql, params)]
+
+    # Compares a run against the BASELINE_RUNS runs of the same query and settings before it.
+    # Returns a Regression when it is REGRESSION_THRESHOLD slower than their median or its plan shape is not
+    # one of theirs, None otherwise or when the query has no history yet.
+    def check(self, run: HistoryRun) -> Regression | None:
+        baseline = [r for r in self.runs(run.query, run.settings, BASELINE_RUNS + 1, before=run.recorded_at + 1e-6)
+                    if r.id != run.id and r.execution_time is not None][:BASELINE_RUNS]
+        if not baseline or run.execution_time is None:
+            return None
+        signature = plan_signature(run.root_node())
+        shape_changed = all(plan_signature(r.root_node()) != signature for r in baseline)
+        regression = Regression(run, baseline, shape_changed)
+        if regression.change > REGRESSION_THRESHOLD or shape_changed:
+            return regression
+        return None
+
+    def record_and_check(self, query: str, settings: Dict[str, Any], root_node: QueryNode) -> Regression | None:
+        return self.check(self.record(query, settings, root_node))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _number(value) -> float | None:
+    return value if isinstance(value, (int, float)) else None
+
+
+plan_history = PlanHistory(PLAN_HISTORY_PATH) if PLAN_HISTORY_PATH else None
+
+
+# Records an analyzed plan of a query in plan_history and checks it against the query's baseline, kept apart for
+# each database. None without a history, for an estimated plan and when the run did not regress. While a history
+# is configured callers bypass the plan cache, a cached plan is not a new run and would pad the baseline with copies.
+def record_run(query: str, settings: Dict[str, Any], root_node: QueryNode,
+               database: str = None) -> Regression | None:
+    if plan_history is None or root_node is None or not root_node.analyzed():
+        return None
+    if database and database != DATABASE:
+        settings = {**settings, "database": database}
+    return plan_history.record_and_check(query, settings, root_node)
@@ -0,0 +1,289 @@
+import argparse
+import json
+import re
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+from batch import iter_workload
+from cli import output_file
+from explain import get_query_plan, get_pool, fetch_plan, planner_settings, build_query_plan, QueryNode, \
+    CancelToken, STATEMENT_TIMEOUT, preorder
+
+# Turns the "Filter Optimisation" and "Potential sort index" insights of a workload's plans into CREATE INDEX
+# candidates, and measures each one by building it and planning the queries it is meant for again.
+# Estimated plans have no filter insights, as the rows a filter removes are not known, so every Seq Scan filter
+# on indexable columns becomes a candidate and the re-planning decides whether it helps.
+# Usage: python indexes.py workload.sql [more.sql | queries_dir ...] --output advice.json
+
+# btree indexes wider than this are rarely worth their upkeep, longer candidates are cut
+MAX_INDEX_COLUMNS = 3
+# postgres truncates identifiers longer than this
+_MAX_IDENTIFIER = 63
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_CAST = re.compile(r"::(?:\"[^\"]+\"|[a-z_][a-z0-9_ ]*?)(?:\(\d+(?:,\s*\d+)?\))?(?:\[\])?(?=[\s),=<>]|$)",
+                   re.IGNORECASE)
+_WRAPPED_COLUMN = re.compile(r"\(((?:\w+\.)?\w+)\)")
+# a column compared with a constant or parameter in a btree-indexable way
+_COMPARISON = re.compile(r"(?<![\w.'])((?:\w+\.)?[a-z_]\w*)\s*(=|<=|>=|<|>)\s*(?:ANY\s*)?(?=['\d$(-])",
+                         re.IGNORECASE)
+_SORT_COLUMN = re.compile(r"^(?:(\w+)\.)?(\w+)((?: DESC)?(?: NULLS (?:FIRST|LAST))?)$")
+
+
+# An index to try: columns on schema.table, each column optionally followed by DESC and NULLS FIRST/LAST.
+# sources are the operations of the workload it was suggested for, by the name of their query.
+class IndexCandidate:
+    schema: str = None
+    table: str = None
+    columns: Tuple[str, ...] = None
+    sources: List[Tuple[str, QueryNode]] = None
+
+    def __init__(self, schema: str, table: str, columns: Tuple[str, ...]):
+        self.schema = schema
+        self.table = table
+        self.columns = columns
+        self.sources = []
+
+    def name(self) -> str:
+        name = "advised_" + "_".join([self.table] + [c.split()[0] for c in self.columns]) + "_idx"
+        return name if len(name) <= _MAX_IDENTIFIER else name[:_MAX_IDENTIFIER - 4] + "_idx"
+
+    def ddl(self) -> str:
+        table = f"{_quote(self.schema)}.{_quote(self.table)}" if self.schema else _quote(self.table)
+        columns = ", ".join(" ".join([_quote(c.split()[0])] + c.split()[1:]) for c in self.columns)
+        return f"CREATE INDEX {_quote(self.name())} ON {table} ({columns})"
+
+    def queries(self) -> List[str]:
+        return list(dict.fromkeys(query for query, _ in self.sources))
+
+    # whether an index on these columns also serves as an index on other's, being the same or longer
+    def covers(self, other: "IndexCandidate") -> bool:
+        return (self.schema, self.table) == (other.schema, other.table) and \
+            self.columns[:len(other.columns)] == other.columns
+
+
+def _quote(identifier: str) -> str:
+    return identifier if re.fullmatch(r"[a-z_][a-z0-9_$]*", identifier) else \
+        '"' + identifier.replace('"', '""') + '"'
+
+
+# columns of the operation's relation a condition compares with constants, equalities first then ranges,
+# as a btree index serves equalities on its leading columns and a range on the column after them
+def condition_columns(node: QueryNode, condition: str) -> List[str]:
+    if not condition or re.search(r"\bOR\b", condition):
+        return []
+    text = _LITERAL.sub("'?'", condition)
+    text = _CAST.sub("", text)
+    text = _WRAPPED_COLUMN.sub(r"\1", text)
+    equalities, ranges = [], []
+    for match in _COMPARISON.finditer(text):
+        column = _own_column(node, match.group(1))
+        if column is None:
+            continue
+        target = equalities if match.group(2) == "=" else ranges
+        if column not in equalities and column not in ranges:
+            target.append(column)
+    return equalities + ranges
+
+
+# the column name when the reference is to the operation's own relation, unqualified or by its alias or name
+def _own_column(node: QueryNode, reference: str) -> str | None:
+    qualifier, _, column = reference.rpartition(".")
+    if qualifier and qualifier not in (node.alias, node.relation_name):
+        return None
+    return column
+
+
+# the scan of the relation a sort key refers to, below the sort
+def _sorted_scan(sort: QueryNode, qualifier: str | None) -> QueryNode | None:
+    scans = [node for node in preorder(sort) if node is not sort and node.relation_name is not None and
+             (qualifier is None or qualifier in (node.alias, node.relation_name))]
+    return scans[0] if len(scans) == 1 else None
+
+
+def _suggestions(query: str, root: QueryNode) -> List[IndexCandidate]:
+    candidates = []
+    for node in preorder(root):
+        insights = node.get_node_insights()
+        unmeasured_filter = not node.analyzed() and node.node_type == "Seq Scan" and node.filter
+
+        if ("Filter Optimisation" in insights or unmeasured_filter) and node.relation_name:
+            # an index scan already uses its index condition, the filter columns come after it
+            columns = condition_columns(node, node.index_cond) + condition_columns(node, node.filter)
+            columns = list(dict.fromkeys(columns))
+            if columns:
+                candidates.append(IndexCandidate(node.schema, node.relation_name,
+                                                 tuple(columns[:MAX_INDEX_COLUMNS])))
+                candidates[-1].sources.append((query, node))
+
+        if "Potential sort index" in insights:
+            keys = [_SORT_COLUMN.match(k.strip()) for k in node.sort_key]
+            if all(keys) and len({k.group(1) for k in keys}) == 1:
+                scan = _sorted_scan(node, keys[0].group(1))
+                if scan is not None:
+                    columns = tuple(k.group(2) + k.group(3) for k in keys)[:MAX_INDEX_COLUMNS]
+                    candidates.append(IndexCandidate(scan.schema, scan.relation_name, columns))
+                    candidates[-1].sources.append((query, node))
+    return candidates
+
+
+# Index candidates for the plans of a workload, by query name. Candidates whose columns are a prefix of another
+# candidate's on the same table are merged into it, as the longer index serves both.
+def index_candidates(plans: Dict[str, QueryNode]) -> List[IndexCandidate]:
+    suggested = [c for query, root in plans.items() if root is not None for c in _suggestions(query, root)]
+    merged: List[IndexCandidate] = []
+    for candidate in sorted(suggested, key=lambda c: -len(c.columns)):
+        into = next((m for m in merged if m.covers(candidate)), None)
+        if into is None:
+            merged.append(candidate)
+        else:
+            into.sources.extend(candidate.sources)
+    return merged
+
+
+# One candidate built and its queries planned again. before and after are by query name; saved is the
+# workload-wide reduction in execution time (ms), or in estimated cost when the plans were not analyzed.
+# failure is why the index could not be built, its queries then have no after plans.
+class IndexAdvice:
+    candidate: IndexCandidate = None
+    before: Dict[str, QueryNode] = None
+    after: Dict[str, QueryNode] = None
+    errors: Dict[str, str] = None
+    failure: str = None
+    weights: Dict[str, float] = None
+    by_time: bool = None
+    saved: float = None
+
+    def __init__(self, candidate: IndexCandidate, before: Dict[str, QueryNode], after: Dict[str, QueryNode],
+                 errors: Dict[str, str], weights: Dict[str, float] = None, failure: str = None):
+        self.candidate = candidate
+        self.before = before
+        self.after = after
+        self.errors = errors
+        self.failure = failure
+        self.weights = weights or {}
+        self.by_time = all(r.analyzed() for r in before.values()) and all(r.analyzed() for r in after.values())
+        self.saved = sum((self._measure(before[q]) - self._measure(after[q])) * self.weights.get(q, 1)
+                         for q in after)
+
+    def _measure(self, root: QueryNode) -> float:
+        return root.inclusive_time if self.by_time else root.total_cost
+
+    # queries whose new plan reads the index
+    def used_by(self) -> List[str]:
+        name = self.candidate.name()
+        return [q for q, root in self.after.items() if _uses_index(root, name)]
+
+    def report(self) -> Dict[str, Any]:
+        unit = "ms" if self.by_time else ""
+        measure = "Time" if self.by_time else "Cost"
+        return {
+            "Index": self.candidate.ddl(),
+            "Suggested by": [f"{node.node_type} in {query}" for query, node in self.candidate.sources],
+            "Used by": self.used_by(),
+            f"{measure} before": f"{sum(self._measure(self.before[q]) for q in self.after):.2f}{unit}",
+            f"{measure} after": f"{sum(self._measure(self.after[q]) for q in self.after):.2f}{unit}",
+            f"{measure} saved": f"{self.saved:.2f}{unit}",
+            **({"Failed": self.failure} if self.failure is not None else {}),
+            **({"Errors": self.errors} if self.errors else {}),
+        }
+
+
+def _uses_index(root: QueryNode, name: str) -> bool:
+    return any(node.index_name == name for node in preorder(root))
+
+
+# runs fn inside a savepoint, rolling back to it when fn fails, returns fn's result or the error
+def _in_savepoint(conn, fn: Callable[[], Any], cancel_token: CancelToken = None) -> Tuple[Any, str | None]:
+    with conn.cursor() as cursor:
+        cursor.execute("SAVEPOINT index_advisor")
+    try:
+        return fn(), None
+    except psycopg2.Error as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            raise
+        with conn.cursor() as cursor:
+            cursor.execute("ROLLBACK TO SAVEPOINT index_advisor")
+        return None, f"{type(e).__name__}: {e}".strip()
+
+
+# the measurements' statement_timeout is lifted first, building the index on a large table may take longer
+def _create(conn, ddl: str):
+    with conn.cursor() as cursor:
+        cursor.execute("RESET statement_timeout")
+        cursor.execute(ddl)
+
+
+# Plans the candidate's queries, builds it and plans them again, all on one connection inside a transaction that
+# is rolled back when the connection goes back to the pool, so the index never outlives the measurement and both
+# plans of a query see the same data. With analyze each query is first run once unmeasured, so "before" is not
+# measured with colder caches than "after". Building it holds a SHARE lock on the table until then, which blocks
+# writes to it. A candidate that cannot be built (no CREATE privilege, a taken name, a view or foreign table)
+# is rolled back to a savepoint and reported as failed.
+def validate_candidate(candidate: IndexCandidate, settings: Dict[str, Any], analyze: bool = True,
+                       weights: Dict[str, float] = None, cancel_token: CancelToken = None) -> IndexAdvice:
+    timeout = STATEMENT_TIMEOUT if analyze else None
+    before, after, errors = {}, {}, {}
+
+    def plan(query: str) -> QueryNode:
+        return build_query_plan(fetch_plan(conn, query, settings, cancel_token, analyze, timeout))[1]
+
+    with get_pool().connection() as conn:
+        for query in candidate.queries():
+            if analyze:
+                _, errors[query] = _in_savepoint(conn, lambda: plan(query), cancel_token)
+                if errors[query] is not None:
+                    continue
+            root, errors[query] = _in_savepoint(conn, lambda: plan(query), cancel_token)
+            if root is not None:
+                before[query] = root
+
+        _, failure = _in_savepoint(conn, lambda: _create(conn, candidate.ddl()), cancel_token)
+        if failure is not None:
+            return IndexAdvice(candidate, before, {}, {q: e for q, e in errors.items() if e}, weights, failure)
+
+        for query in before:
+            root, errors[query] = _in_savepoint(conn, lambda: plan(query), cancel_token)
+            if root is not None:
+                after[query] = root
+    return IndexAdvice(candidate, before, after, {q: e for q, e in errors.items() if e}, weights)
+
+
+# Index advice for a workload's plans, by query name, planned under the given settings. Every candidate is
+# measured on its own, so the savings of two candidates are not additive. weights scales each query's saving,
+# e.g. by how often it runs. Sorted by saving, largest first.
+def advise_indexes(plans: Dict[str, QueryNode], settings: Dict[str, Any], analyze: bool = True,
+                   weights: Dict[str, float] = None, cancel_token: CancelToken = None) -> List[IndexAdvice]:
+    advice = [validate_candidate(c, settings, analyze, weights, cancel_token) for c in index_candidates(plans)]
+    return sorted(advice, key=lambda a: -a.saved)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Suggest indexes for a workload and measure each one inside a "
+                                                 "rolled-back transaction.")
+    parser.add_argument("paths", nargs="+", help=".sql files or directories of .sql files")
+    parser.add_argument("-o", "--output", help="file to write the JSON report to, defaults to stdout")
+    parser.add_argument("--estimate-only", action="store_true", help="compare estimated costs, without executing")
+    args = parser.parse_args(argv)
+
+    analyze = not args.estimate_only
+    flags = (True, True, True, True)
+    plans, failures = {}, {}
+    for source, i, query in iter_workload(args.paths):
+        try:
+            plans[query] = get_query_plan(query, *flags, analyze=analyze)[1]
+        except Exception as e:
+            failures[f"{source}#{i + 1}"] = f"{type(e).__name__}: {e}".strip()
+
+    advice = advise_indexes(plans, planner_settings(*flags), analyze)
+    report = {"Indexes": [a.report() for a in advice], **({"Errors": failures} if failures else {})}
+    with output_file(args.output) as out:
+        json.dump(report, out, indent=2)
+        out.write("\n")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,18 @@
-from math import inf
-from typing import Dict
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from math import ceil
+from typing import Callable, Dict, List, Tuple
 
 import dearpygui.dearpygui as dpg
 
-from explain import get_query_plan, QueryNode, get_plan_diff
+from benchmark import benchmark_query_plan, compare_benchmarks, PlanBenchmark
+from explain import get_query_plan, QueryNode, get_plan_diff, CancelToken, STATEMENT_TIMEOUT, planner_settings
+from history import plan_history, record_run, Regression
+from layout import tree_layout, layout_order
+from spill import what_if_work_mem
+from sweep import sweep_query_plans, sweep_report
 
 old_query_ref: int | str = None
 new_query_ref: int | str = None
@@ -18,104 +27,319 @@ ch_ref: int | str = None
 cm_ref: int | str = None
 cnl_ref: int | str = None
 cs_ref: int | str = None
+runs_ref: int | str = None
+warmup_ref: int | str = None
+estimate_ref: int | str = None
+timeout_ref: int | str = None
+
+
+# number of steps or diff entries shown at once, the rest are only built when their page is opened
+PAGE_SIZE = 20
+# number of graph nodes added per frame when drawing a plan
+GRAPH_BATCH_SIZE = 200
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="explain")
+current_run: "ExplainRun" = None
+# Results of the executor threads waiting to be shown. Only the database work runs on those threads, widgets are
+# created on the GUI thread alone: DPG's container stack is global, so two threads building at once could put
+# items under each other's parents. start() runs these between frames, with the DPG callbacks.
+ui_tasks: "queue.SimpleQueue[Callable[[], None]]" = queue.SimpleQueue()
+
+status_g: int | str = None
+old_status: int | str = None
+new_status: int | str = None
+cancel_b: int | str = None
 
 
 def view_graphic_callback(sender, app_data, user_data):
     root_node = user_data
+    if root_node is None:
+        return
     # place graphical visualization in a separate window pop up
     _build_graph_window(root_node)
 
 
+# State of one click of the explain button.
+# Both queries are explained concurrently on their own pooled connection, each side is rendered
+# as soon as its plan arrives and the diff is rendered once both sides are in.
+class ExplainRun:
+    tokens: Dict[str, CancelToken] = None
+    results: Dict[str, Tuple] = None
+    started: float = None
+    cancelled: bool = False
+
+    def __init__(self):
+        self.tokens = {"old": CancelToken(), "new": CancelToken()}
+        self.results = {}
+        self.started = time.perf_counter()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        for token in self.tokens.values():
+            token.cancel()
+
+
 def button_callback():
+    global current_run
     if old_query_ref is None or new_query_ref is None:
         return
 
+    if current_run is not None:
+        current_run.cancel()
+
     # first, clear prev items
     dpg.delete_item(main_g, children_only=True)
     dpg.delete_item(old_g, children_only=True)
     dpg.delete_item(new_g, children_only=True)
+    dpg.set_item_user_data(old_b, None)
+    dpg.set_item_user_data(new_b, None)
 
     old_q = dpg.get_value(old_query_ref)
     new_q = dpg.get_value(new_query_ref)
+    flags = (dpg.get_value(ch_ref), dpg.get_value(cm_ref), dpg.get_value(cnl_ref), dpg.get_value(cs_ref))
+    runs, warmup = dpg.get_value(runs_ref), dpg.get_value(warmup_ref)
+    analyze, timeout = not dpg.get_value(estimate_ref), dpg.get_value(timeout_ref)
+
+    run = ExplainRun()
+    current_run = run
+    dpg.show_item(status_g)
+    dpg.show_item(cancel_b)
+    for side, q in (("old", old_q), ("new", new_q)):
+        _set_status(side, "running...")
+        future = executor.submit(_explain_query, q, flags, runs, warmup, analyze, timeout, run.tokens[side])
+        future.add_done_callback(_on_ui_thread(_plan_done_callback, run, side))
+
+
+# Explains a query, benchmarking it when runs > 1, and records it in the plan history when one is configured.
+# Returns the plan (or PlanBenchmark) and the regression found against the query's history, if any.
+def _explain_query(query: str, flags: Tuple[bool, bool, bool, bool], runs: int, warmup: int, analyze: bool,
+                   timeout: int, cancel_token: CancelToken):
+    if runs > 1 and analyze:
+        result = benchmark_query_plan(query, *flags, warmup=warmup, runs=runs, cancel_token=cancel_token,
+                                      statement_timeout=timeout)
+        root_node = result.root_node
+    else:
+        result = get_query_plan(query, *flags, cancel_token=cancel_token, use_cache=plan_history is None,
+                                analyze=analyze, statement_timeout=timeout)
+        root_node = result[1]
+
+    return result, record_run(query, planner_settings(*flags), root_node)
+
+
+# plans the new query under every combination of planner settings and ranks the distinct plans found
+def sweep_callback():
+    if new_query_ref is None:
+        return
+
+    dpg.delete_item(main_g, children_only=True)
+    status = dpg.add_text("Sweeping planner settings for the new query...", parent=main_g, color=[255, 255, 0])
+    future = executor.submit(sweep_query_plans, dpg.get_value(new_query_ref), analyze=not dpg.get_value(estimate_ref),
+                             statement_timeout=dpg.get_value(timeout_ref))
+    future.add_done_callback(_on_ui_thread(_sweep_done_callback, status))
 
+
+def _sweep_done_callback(status, future: Future):
     try:
-        old_qep, old_root_node = get_query_plan(old_q,
-                                                dpg.get_value(ch_ref),
-                                                dpg.get_value(cm_ref),
-                                                dpg.get_value(cnl_ref),
-                                                dpg.get_value(cs_ref))
-        new_qep, new_root_node = get_query_plan(new_q,
-                                                dpg.get_value(ch_ref),
-                                                dpg.get_value(cm_ref),
-                                                dpg.get_value(cnl_ref),
-                                                dpg.get_value(cs_ref))
+        rows = sweep_report(future.result())
     except Exception as e:
-        print("Runtime exception", e)
-        dpg.add_text(f"Runtime exception: {e}", parent=main_g, color=[255, 10, 10])
+        _show_exception(status, e)
+        return
+
+    dpg.set_value(status, f"Planner settings sweep found {len(rows)} distinct plans, fastest first.")
+    _add_rows_table(rows)
+
+
+# re-runs the new query with enough work_mem for every operation that spilled to disk, and compares
+def work_mem_callback():
+    if new_query_ref is None:
         return
 
-    dpg.show_item(labels)
-    # place natural lang explanation in primary window (this will be scrollable)
+    dpg.delete_item(main_g, children_only=True)
+    if dpg.get_value(estimate_ref):
+        dpg.add_text("The work_mem what-if compares executions, untick \"Estimate only\" to run it.", parent=main_g,
+                     color=[255, 99, 71])
+        return
+    status = dpg.add_text("Checking the new query for operations spilling to disk...", parent=main_g,
+                          color=[255, 255, 0])
+    flags = (dpg.get_value(ch_ref), dpg.get_value(cm_ref), dpg.get_value(cnl_ref), dpg.get_value(cs_ref))
+    future = executor.submit(what_if_work_mem, dpg.get_value(new_query_ref), *flags,
+                             statement_timeout=dpg.get_value(timeout_ref))
+    future.add_done_callback(_on_ui_thread(_work_mem_done_callback, status))
 
-    dpg.set_item_user_data(old_b, old_root_node)
-    dpg.set_item_user_data(new_b, new_root_node)
-    # dpg.add_spacer(width=50)
 
-    for s, d, node in old_qep:
-        dpg.add_text(s + "\n", wrap=500, parent=old_g)
+def _work_mem_done_callback(status, future: Future):
+    try:
+        what_if = future.result()
+    except Exception as e:
+        _show_exception(status, e)
+        return
+
+    dpg.set_value(status, "Work mem what-if")
+    CollapsibleTable("Summary", "Summary", main_g, what_if.summary(), True)
+    _add_rows_table(what_if.report())
+
+
+def _show_exception(status, e: Exception):
+    print("Runtime exception", e)
+    dpg.set_value(status, f"Runtime exception: {e}")
+    dpg.configure_item(status, color=[255, 10, 10])
+
+
+# a table with a header row from a list of dicts sharing the same keys
+def _add_rows_table(rows: List[Dict[str, str]]):
+    if not rows:
+        return
+    t = dpg.add_table(parent=main_g, header_row=True, borders_innerV=True, borders_innerH=True)
+    for k in rows[0]:
+        dpg.add_table_column(label=k, parent=t)
+    for row in rows:
+        with dpg.table_row(parent=t) as r:
+            for v in row.values():
+                dpg.add_text(v, parent=r, wrap=400)
+
+
+# a done callback for an executor future, calling fn(*args, future) on the GUI thread
+def _on_ui_thread(fn: Callable, *args) -> Callable[[Future], None]:
+    return lambda future: ui_tasks.put(partial(fn, *args, future))
+
+
+# runs the tasks queued so far, tasks they queue in turn wait for the next frame
+def run_ui_tasks():
+    for _ in range(ui_tasks.qsize()):
+        ui_tasks.get_nowait()()
+
+
+def cancel_callback():
+    if current_run is None:
+        return
+    current_run.cancel()
+    dpg.hide_item(cancel_b)
+
+
+# runs on the GUI thread once a side's EXPLAIN ANALYZE finishes
+def _plan_done_callback(run: ExplainRun, side: str, future: Future):
+    if run is not current_run:
+        return
+
+    elapsed = time.perf_counter() - run.started
+    benchmark = None
+    try:
+        result, regression = future.result()
+        if isinstance(result, PlanBenchmark):
+            benchmark = result
+            result = benchmark.steps, benchmark.root_node
+        qep, root_node = result
+    except Exception as e:
+        if run.cancelled:
+            _set_status(side, "cancelled.")
+        else:
+            print("Runtime exception", e)
+            _set_status(side, "failed.")
+            dpg.add_text(f"Runtime exception ({side} query): {e}", parent=main_g, color=[255, 10, 10])
+        result = None
+    else:
+        _set_status(side, f"done in {elapsed:.2f}s.")
+        result = qep, root_node, benchmark
+        if root_node is not None:
+            dpg.show_item(labels)
+            if side == "old":
+                _render_plan(qep, root_node, old_g, old_b, "Old Plan Summary", benchmark, regression)
+            else:
+                _render_plan(qep, root_node, new_g, new_b, "New Plan Summary", benchmark, regression)
+
+    run.results[side] = result
+    if len(run.results) < 2:
+        return
+
+    dpg.hide_item(cancel_b)
+    if run.results["old"] is None or run.results["new"] is None:
+        return
+    _, old_root_node, old_benchmark = run.results["old"]
+    _, new_root_node, new_benchmark = run.results["new"]
+    if old_root_node is None or new_root_node is None:
+        return
+    _render_diff(old_root_node, new_root_node, old_benchmark, new_benchmark)
+
+
+def _set_status(side: str, status: str):
+    ref = old_status if side == "old" else new_status
+    dpg.set_value(ref, f"{side.capitalize()} query: {status}")
+
+
+# place natural lang explanation of a plan in its column (this will be scrollable)
+def _render_plan(qep, root_node: QueryNode, parent, graph_button, summary_label: str,
+                 benchmark: PlanBenchmark = None, regression: Regression = None):
+    dpg.set_item_user_data(graph_button, root_node)
+
+    def render_step(step, g):
+        s, d, node = step
+        dpg.add_text(s + "\n", wrap=500, parent=g)
         if node is not None and node.costliest_node == node:
-            dpg.add_text("Costliest!", color=[255, 99, 71], parent=old_g)
+            dpg.add_text("Costliest!", color=[255, 99, 71], parent=g)
         if node is not None and node.slowest_node == node:
-            dpg.add_text("Slowest!", color=[255, 99, 71], parent=old_g)
+            dpg.add_text("Slowest!", color=[255, 99, 71], parent=g)
         if not d:
-            continue
-
-        CollapsibleTable("Operation Details", "Operation Details", old_g, d, False)
-        CollapsibleTable("Smart Insights", "Smart Insights", old_g, node.get_node_insights(), False)
-
-    with dpg.child_window(parent=old_g):
+            return
+
+        CollapsibleTable("Operation Details", "Operation Details", g, d, False)
+        CollapsibleTable("Smart Insights", "Smart Insights", g, node.get_node_insights, False)
+        if benchmark is not None:
+            CollapsibleTable("Timing Distribution", "Timing Distribution", g, partial(benchmark.node_summary, node),
+                             False)
+
+    steps = PagedList(parent, qep, render_step)
+    if steps.pages() > 1:
+        with dpg.group(parent=parent, horizontal=True, before=steps.g):
+            for label, attr in (("Go to costliest", "costliest_node"), ("Go to slowest", "slowest_node")):
+                target = getattr(root_node, attr)
+                index = next((i for i, (_, _, n) in enumerate(qep) if n is not None and n is target), None)
+                if index is not None:
+                    dpg.add_button(label=label, callback=lambda s, a, u: steps.show_index(u), user_data=index)
+
+    with dpg.child_window(parent=parent):
         dpg.add_spacer(height=10)
         dpg.add_separator()
         dpg.add_spacer(height=10)
-    dpg.add_text("Old Plan Summary", wrap=500, parent=old_g, color=[114, 137, 218])
-    CollapsibleTable("Plan Summary", "Plan Summary", old_g, old_root_node.get_plan_insight(), True)
-
+    dpg.add_text(summary_label, wrap=500, parent=parent, color=[114, 137, 218])
+    CollapsibleTable("Plan Summary", "Plan Summary", parent, root_node.get_plan_insight(), True)
+    if benchmark is not None:
+        CollapsibleTable("Timing Distribution", "Timing Distribution", parent, benchmark.summary(), True)
+    if regression is not None:
+        dpg.add_text("Regressed against its history!", wrap=500, parent=parent, color=[255, 99, 71])
+        CollapsibleTable("Regression", "Regression", parent, regression.report(), True)
+        _render_diff_entries(regression.diff, parent)
+
+
+def _render_diff(old_root_node: QueryNode, new_root_node: QueryNode, old_benchmark: PlanBenchmark = None,
+                 new_benchmark: PlanBenchmark = None):
     with dpg.group(parent=main_g) as g:
         dpg.add_spacer(height=10, parent=g)
         dpg.add_text("Plan Diff Report!", wrap=500, parent=g, color=[255, 255, 0])
         dpg.add_spacer(height=20, parent=g)
-        report_diff = get_plan_diff(old_root_node, new_root_node)
-        dpg.add_text("Scan Diffs", wrap=500, parent=g, color=[122, 137, 198])
-        for entry in report_diff["Scans"]:
-            CollapsibleTable(entry["Relation"], entry["Relation"], g, entry, True)
-
-        report_diff = get_plan_diff(old_root_node, new_root_node)
-        dpg.add_text("Join Diffs", wrap=500, parent=g, color=[122, 137, 198])
-        for entry in report_diff["Joins"]:
-            CollapsibleTable(entry["Join condition"], entry["Join condition"], g, entry, True)
-
-    for s, d, node in new_qep:
-        dpg.add_text(s + "\n", wrap=500, parent=new_g)
-        if node is not None and node.costliest_node == node:
-            dpg.add_text("Costliest!", color=[255, 99, 71], parent=new_g)
-        if node is not None and node.slowest_node == node:
-            dpg.add_text("Slowest!", color=[255, 99, 71], parent=new_g)
-        if not d:
+        if old_benchmark is not None and new_benchmark is not None:
+            CollapsibleTable("Benchmark Verdict", "Benchmark Verdict", g,
+                             compare_benchmarks(old_benchmark, new_benchmark), True)
+        _render_diff_entries(get_plan_diff(old_root_node, new_root_node), g)
+
+
+# every category of a get_plan_diff report, a page at a time
+def _render_diff_entries(report_diff: Dict[str, List[Dict[str, str]]], g):
+    for category, title, key in (("Scans", "Scan Diffs", "Relation"), ("Joins", "Join Diffs", "Join condition"),
+                                 ("Other", "Other Changed Operations", "Operation"),
+                                 ("Removed", "Operations Only In Old Plan", "Operation"),
+                                 ("Inserted", "Operations Only In New Plan", "Operation")):
+        if not report_diff[category] and category not in ("Scans", "Joins"):
             continue
-
-        CollapsibleTable("Operation Details", "Operation Details", new_g, d, False)
-        CollapsibleTable("Smart Insights", "Smart Insights", new_g, node.get_node_insights(), False)
-
-    with dpg.child_window(parent=new_g):
-        dpg.add_spacer(height=10)
-        dpg.add_separator()
-        dpg.add_spacer(height=10)
-    dpg.add_text("New Plan Summary", wrap=500, parent=new_g, color=[114, 137, 218])
-    CollapsibleTable("Plan Summary", "Plan Summary", new_g, new_root_node.get_plan_insight(), True)
+        dpg.add_text(title, wrap=500, parent=g, color=[122, 137, 198])
+        PagedList(g, report_diff[category],
+                  lambda entry, parent, key=key: CollapsibleTable(entry[key], entry[key], parent, entry, True))
 
 
 def start():
     dpg.create_context()
+    # callbacks are run by the render loop below, on this thread, alongside the executor results in ui_tasks
+    dpg.configure_app(manual_callback_management=True)
 
     dpg.create_viewport(title='Postgres SQL Query Plan Visualizer', width=1600)
     dpg.setup_dearpygui()
@@ -159,11 +383,32 @@ def start():
                 cm_ref = dpg.add_checkbox(label="Enable merge join", default_value=True)
                 cnl_ref = dpg.add_checkbox(label="Enable nested loop join", default_value=True)
                 cs_ref = dpg.add_checkbox(label="Enable sequential scan", default_value=True)
+                global runs_ref, warmup_ref
+                dpg.add_spacer(height=10)
+                runs_ref = dpg.add_input_int(label="Benchmark runs", default_value=1, min_value=1, min_clamped=True,
+                                             width=100)
+                warmup_ref = dpg.add_input_int(label="Warmup runs", default_value=1, min_value=0, min_clamped=True,
+                                               width=100)
+                global estimate_ref, timeout_ref
+                dpg.add_spacer(height=10)
+                estimate_ref = dpg.add_checkbox(label="Estimate only (do not execute the queries)", default_value=False)
+                timeout_ref = dpg.add_input_int(label="Statement timeout (ms, 0 for none)", default_value=STATEMENT_TIMEOUT,
+                                                min_value=0, min_clamped=True, width=100)
 
         dpg.add_spacer(height=50)
         with dpg.group(horizontal=True):
             dpg.add_spacer(width=600)
             dpg.add_button(label="Explain Query Plan Diff", callback=button_callback)
+            dpg.add_button(label="Sweep Planner Settings (New Query)", callback=sweep_callback)
+            dpg.add_button(label="What-if work_mem (New Query)", callback=work_mem_callback)
+
+        global status_g, old_status, new_status, cancel_b
+        with dpg.group(horizontal=True, show=False) as status_g:
+            dpg.add_spacer(width=600)
+            with dpg.group():
+                old_status = dpg.add_text("")
+                new_status = dpg.add_text("")
+            cancel_b = dpg.add_button(label="Cancel", callback=cancel_callback, show=False)
 
         with dpg.group(horizontal=True, show=False) as la:
             global labels
@@ -209,11 +454,17 @@ def start():
         dpg.add_spacer(height=100)
 
     dpg.show_viewport()
-    dpg.start_dearpygui()
+    while dpg.is_dearpygui_running():
+        dpg.run_callbacks(dpg.get_callback_queue())
+        run_ui_tasks()
+        dpg.render_dearpygui_frame()
 
     dpg.destroy_context()
 
 
+# A button toggling a two column table of data.
+# Rows are only created the first time the table is expanded, data may also be a function returning the
+# dict so that computing it is deferred as well.
 class CollapsibleTable:
     parent = None
     data = None
@@ -222,6 +473,7 @@ class CollapsibleTable:
     t = None
     b = None
     button_label = None
+    built = False
 
     def __init__(self, button_label, table_label, parent, data, active=False):
         self.parent = parent
@@ -229,90 +481,81 @@ class CollapsibleTable:
         self.active = active
         self.button_label = button_label
         self.table_label = table_label
+        self.built = False
 
         self.b = dpg.add_button(parent=self.parent, label=f"{'V' if self.active else '>'} {self.button_label}",
                                 callback=self._click)
 
-        t = dpg.add_table(label=self.table_label, parent=self.parent, header_row=False, borders_innerV=True,
-                          show=self.active, borders_innerH=True)
-        dpg.add_table_column(parent=t)
-        dpg.add_table_column(parent=t)
-        for k, v in self.data.items():
-            with dpg.table_row(parent=t) as r:
+        self.t = dpg.add_table(label=self.table_label, parent=self.parent, header_row=False, borders_innerV=True,
+                               show=self.active, borders_innerH=True)
+        dpg.add_spacer(parent=self.parent, height=30)
+        if self.active:
+            self._build_rows()
+
+    def _build_rows(self):
+        self.built = True
+        data = self.data() if callable(self.data) else self.data
+        dpg.add_table_column(parent=self.t)
+        dpg.add_table_column(parent=self.t)
+        for k, v in data.items():
+            with dpg.table_row(parent=self.t) as r:
                 dpg.add_text(k, parent=r)
                 dpg.add_text(v, parent=r, wrap=280)
-        dpg.add_spacer(parent=self.parent, height=30)
-        self.t = t
 
     def _click(self):
         self.active = not self.active
+        if self.active and not self.built:
+            self._build_rows()
         dpg.configure_item(self.t, show=self.active)
         dpg.configure_item(self.b, label=f"{'V' if self.active else '>'} {self.button_label}")
 
 
-# offset from parent to child: (+300,+/-80)
+# Shows a long list one page at a time, only the entries of the current page exist as widgets.
+# render_item(item, parent) adds the widgets for one entry.
+class PagedList:
+    items = None
+    render_item = None
+    page_size = None
+    page = None
+    g = None
+    label = None
+
+    def __init__(self, parent, items, render_item, page_size=PAGE_SIZE):
+        self.items = items
+        self.render_item = render_item
+        self.page_size = page_size
+        self.page = 0
+
+        with dpg.group(parent=parent, horizontal=True, show=len(items) > page_size):
+            dpg.add_button(label="< Prev", callback=lambda: self.show_page(self.page - 1))
+            self.label = dpg.add_text("")
+            dpg.add_button(label="Next >", callback=lambda: self.show_page(self.page + 1))
+        self.g = dpg.add_group(parent=parent)
+        self.show_page(0)
+
+    def pages(self) -> int:
+        return max(1, ceil(len(self.items) / self.page_size))
+
+    def show_page(self, page: int):
+        self.page = max(0, min(page, self.pages() - 1))
+        dpg.delete_item(self.g, children_only=True)
+        start = self.page * self.page_size
+        for item in self.items[start:start + self.page_size]:
+            self.render_item(item, self.g)
+        dpg.set_value(self.label, f"Page {self.page + 1} of {self.pages()} ({len(self.items)} entries)")
+
+    # switches to the page holding the entry at index
+    def show_index(self, index: int):
+        self.show_page(index // self.page_size)
+
+
 def _build_graph_window(root_node: QueryNode):
-    nodes_by_levels = [{None: [root_node]}]  # parent: child
-    i = 0
-    while i < len(nodes_by_levels):
-        last_level = nodes_by_levels[i]
-        nxt_level = {}
-        for k, v in last_level.items():
-            for n in v:
-                t_n = []
-                for child in n.children:
-                    t_n.append(child)
-                if t_n:
-                    nxt_level[n] = sorted(t_n, key=lambda o: 0 if o.parent_relationship == "Outer" else 1)
-        if nxt_level:
-            nodes_by_levels.append(nxt_level)
-
-        i += 1
-
-    pos_map = {}
-    x, y = 0, 0
-    y_spacing = 250
-    x_spacing = 250
-    # initialization step, last column child, populate with coords first
-    for k, l in nodes_by_levels[-1].items():
-        for c in l:
-            pos_map[c] = (x, y)
-            y += y_spacing  # spacing between 2 nodes in same level
-            # Note: We use the convention of outer relation on the top
-
-    for i in range(len(nodes_by_levels) - 1, -1, -1):
-        node_map = nodes_by_levels[i]
-        for k, l in node_map.items():
-            if k is None:
-                break
-            x -= x_spacing
-            # ensure all nodes at this level have assigned pos
-            # there can be a max of 2 children
-            if len(l) > 2:
-                print("More than 2 children graph not supported.")
-                return
-            min_y, max_y = inf, -inf
-            for j, c in enumerate(l):
-                if c not in pos_map:
-                    if j + 1 < len(l):  # can safely assume there is an inner child then
-                        pos_map[c] = (pos_map[l[j + 1]][0], pos_map[l[j + 1]][1] - y_spacing)
-                    else:  # else, it is an inner child
-                        pos_map[c] = (pos_map[l[j + 1]][0], pos_map[l[j + 1]][1] + y_spacing)
-
-                min_y, max_y = min(pos_map[c][1], min_y), max(pos_map[c][1], max_y)
-            if len(l) == 1:
-                y_pos = min_y
-            else:
-                y_pos = int((min_y + max_y) / len(l))
-            pos_map[k] = (x, y_pos)
+    pos_map = tree_layout(root_node)
+    order = layout_order(root_node)
 
     # apply appropriate offsets to make root_node be at pos(100,200)
     offset = (100 - pos_map[root_node][0], 200 - pos_map[root_node][1])
-    for k in pos_map.keys():
-        pos_map[k] = pos_map[k][0] + offset[0], pos_map[k][1] + offset[1]
 
-    graph_ref = {}
-    added_parent = False
     # place graphical visualization in a separate window pop up
     with dpg.window(label="Graph Viz", width=1250, height=600, pos=(150, 70)):
         with dpg.group():
@@ -323,34 +566,43 @@ def _build_graph_window(root_node: QueryNode):
                          "other child input is regarded as the outer relation.", wrap=1000)
 
         with dpg.node_editor() as f:
-            for lvl in nodes_by_levels[1:]:
-                for p, l in lvl.items():
-                    if p not in graph_ref:
-                        graph_ref[p] = dpg.add_node(label=p.node_type, pos=pos_map[p], parent=f)
-
-                    for c in l:
-                        out = dpg.add_node_attribute(parent=graph_ref[p], attribute_type=dpg.mvNode_Attr_Output)
-                        if not added_parent:
-                            added_parent = True
-                            s, d, _ = p.explain_self()
-                            dpg.add_text(summarise(s, d, p), parent=out, wrap=200)
-                            if p is not None and p.costliest_node == p:
-                                dpg.add_text("Costliest!", color=[255, 99, 71], parent=out)
-                            if p is not None and p.slowest_node == p:
-                                dpg.add_text("Slowest!", color=[255, 99, 71], parent=out)
-
-                        graph_ref[c] = dpg.add_node(label=c.node_type, pos=pos_map[c], parent=f)
-                        to = dpg.add_node_attribute(parent=graph_ref[c])
-
-                        dpg.add_node_link(out, to, parent=f)
-                        s, d, _ = c.explain_self()
-                        dpg.add_text(summarise(s, d, c), parent=to, wrap=200)
-
-                        if c is not None and c.costliest_node == c:
-                            dpg.add_text("Costliest!", color=[255, 99, 71], parent=to)
-                        if c is not None and c.slowest_node == c:
-                            dpg.add_text("Slowest!", color=[255, 99, 71], parent=to)
+            pass
+
+    _add_graph_nodes(f, order, pos_map, offset, {}, 0)
+
+
+# Adds the next GRAPH_BATCH_SIZE nodes of the plan to the node editor and schedules the rest for the next
+# frame, so large plans show up progressively instead of freezing the window. order is parents first, so
+# every parent's output attribute exists by the time its children are linked to it.
+def _add_graph_nodes(f, order: List[QueryNode], pos_map: Dict[QueryNode, Tuple[int, int]], offset: Tuple[int, int],
+                     outputs: Dict[QueryNode, int | str], start: int):
+    if not dpg.does_item_exist(f):
+        return
+    for node in order[start:start + GRAPH_BATCH_SIZE]:
+        x, y = pos_map[node]
+        n = dpg.add_node(label=node.node_type, pos=(x + offset[0], y + offset[1]), parent=f)
+        attr = dpg.add_node_attribute(parent=n, attribute_type=dpg.mvNode_Attr_Static)
+        s, d, _ = node.explain_self()
+        dpg.add_text(summarise(s, d, node), parent=attr, wrap=200)
+        if node.costliest_node == node:
+            dpg.add_text("Costliest!", color=[255, 99, 71], parent=attr)
+        if node.slowest_node == node:
+            dpg.add_text("Slowest!", color=[255, 99, 71], parent=attr)
+
+        if node in outputs:
+            to = dpg.add_node_attribute(parent=n)
+            dpg.add_node_link(outputs.pop(node), to, parent=f)
+        if node.children:
+            out = dpg.add_node_attribute(parent=n, attribute_type=dpg.mvNode_Attr_Output)
+            for child in node.children:
+                outputs[child] = out
+
+    if start + GRAPH_BATCH_SIZE < len(order):
+        # DPG only calls functions and lambdas, a functools.partial has no __code__ and would be dropped silently
+        dpg.set_frame_callback(dpg.get_frame_count() + 1,
+                               lambda sender, app_data, user_data: _add_graph_nodes(*user_data),
+                               user_data=(f, order, pos_map, offset, outputs, start + GRAPH_BATCH_SIZE))
 
 
 def summarise(s: str, d: Dict[str, str], node: QueryNode) -> str:
-    return f"{d['Actual Operation time']}\n\nEstimated cost: {node.op_cost:.2f}\n"
+    return f"{d.get('Actual Operation time', 'Not executed')}\n\nEstimated cost: {node.op_cost:.2f}\n"
@@ -0,0 +1,179 @@
+from typing import Dict, List, Tuple
+from weakref import WeakKeyDictionary
+
+from explain import QueryNode
+
+# distance between two depth levels, and between two neighbouring nodes of the same depth
+LEVEL_SPACING = 250
+SIBLING_SPACING = 250
+
+# positions of every node of a plan in layout order, keyed weakly by the plan's root node so a plan that
+# is no longer referenced drops its layout too. The value must not reference the nodes themselves.
+_layout_cache: "WeakKeyDictionary[QueryNode, List[Tuple[int, int]]]" = WeakKeyDictionary()
+
+
+# Working state of one node while laying out, see Buchheim, Junger and Leipert,
+# "Improving Walker's Algorithm to Run in Linear Time".
+class _LayoutNode:
+    __slots__ = ("children", "parent", "number", "x", "mod", "shift", "change", "thread", "ancestor", "midpoint")
+
+    def __init__(self, parent: "_LayoutNode", number: int):
+        self.children = []
+        self.parent = parent
+        self.number = number  # index among its siblings
+        self.x = 0.0
+        self.mod = 0.0
+        self.shift = 0.0
+        self.change = 0.0
+        self.thread = None
+        self.ancestor = self
+        self.midpoint = 0.0
+
+    # next node on the left and right contour of the subtree
+    def left(self) -> "_LayoutNode":
+        return self.thread or (self.children[0] if self.children else None)
+
+    def right(self) -> "_LayoutNode":
+        return self.thread or (self.children[-1] if self.children else None)
+
+    def left_brother(self) -> "_LayoutNode":
+        return self.parent.children[self.number - 1] if self.parent is not None and self.number > 0 else None
+
+    def leftmost_sibling(self) -> "_LayoutNode":
+        return self.parent.children[0] if self.parent is not None and self.number > 0 else None
+
+
+# the children of a node in the order they are drawn, outer relation on top
+def layout_children(node: QueryNode) -> List[QueryNode]:
+    return sorted(node.children, key=lambda o: 0 if o.parent_relationship == "Outer" else 1)
+
+
+# the plan's nodes in the order their positions are stored
+def layout_order(root: QueryNode) -> List[QueryNode]:
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(reversed(layout_children(node)))
+    return order
+
+
+# Tidy tree layout of a plan of any fan-out in O(n): the root is at depth 0 on the left, every level is
+# LEVEL_SPACING further right, and siblings are spread top to bottom so no two subtrees overlap while each
+# parent is centered on its children. Computed once per plan and cached.
+def tree_layout(root: QueryNode) -> Dict[QueryNode, Tuple[int, int]]:
+    order = layout_order(root)
+    positions = _layout_cache.get(root)
+    if positions is None:
+        positions = _compute_layout(root)
+        _layout_cache[root] = positions
+    return dict(zip(order, positions))
+
+
+def _compute_layout(root: QueryNode) -> List[Tuple[int, int]]:
+    # mirror the plan into layout nodes, in the same preorder layout_order uses
+    layout_root = _LayoutNode(None, 0)
+    nodes = []
+    depths = []
+    stack = [(root, layout_root, 0)]
+    while stack:
+        node, v, depth = stack.pop()
+        nodes.append(v)
+        depths.append(depth)
+        children = layout_children(node)
+        v.children = [_LayoutNode(v, i) for i in range(len(children))]
+        stack.extend(zip(reversed(children), reversed(v.children), [depth + 1] * len(children)))
+
+    # first walk, bottom up: reversed preorder visits every child before its parent
+    for v in reversed(nodes):
+        if not v.children:
+            continue
+        default_ancestor = v.children[0]
+        for w in v.children:
+            _place(w)
+            default_ancestor = _apportion(w, default_ancestor)
+        _execute_shifts(v)
+        v.midpoint = (v.children[0].x + v.children[-1].x) / 2
+    _place(layout_root)
+
+    # second walk, top down: add up the modifiers of the ancestors
+    ys = {}
+    stack = [(layout_root, 0.0)]
+    while stack:
+        v, m = stack.pop()
+        ys[v] = v.x + m
+        for w in v.children:
+            stack.append((w, m + v.mod))
+
+    return [(d * LEVEL_SPACING, round(ys[v] * SIBLING_SPACING)) for v, d in zip(nodes, depths)]
+
+
+# preliminary position of a node next to its left brother, once the subtrees left of it are in place
+def _place(v: _LayoutNode):
+    w = v.left_brother()
+    if not v.children:
+        v.x = w.x + 1 if w is not None else 0.0
+    elif w is not None:
+        v.x = w.x + 1
+        v.mod = v.x - v.midpoint
+    else:
+        v.x = v.midpoint
+
+
+# pushes the subtree of v right until it clears every subtree left of it, spreading the shift over
+# the siblings in between
+def _apportion(v: _LayoutNode, default_ancestor: _LayoutNode) -> _LayoutNode:
+    w = v.left_brother()
+    if w is None:
+        return default_ancestor
+
+    # inner and outer contours on the right (r) of the left subtrees and the left (l) of v's subtree
+    vir = vor = v
+    vil = w
+    vol = v.leftmost_sibling()
+    sir = sor = v.mod
+    sil = vil.mod
+    sol = vol.mod
+    while vil.right() is not None and vir.left() is not None:
+        vil, vir = vil.right(), vir.left()
+        vol, vor = vol.left(), vor.right()
+        vor.ancestor = v
+        shift = (vil.x + sil) - (vir.x + sir) + 1
+        if shift > 0:
+            ancestor = vil.ancestor if vil.ancestor.parent is v.parent else default_ancestor
+            _move_subtree(ancestor, v, shift)
+            sir += shift
+            sor += shift
+        sil += vil.mod
+        sir += vir.mod
+        sol += vol.mod
+        sor += vor.mod
+
+    if vil.right() is not None and vor.right() is None:
+        vor.thread = vil.right()
+        vor.mod += sil - sor
+    else:
+        if vir.left() is not None and vol.left() is None:
+            vol.thread = vir.left()
+            vol.mod += sir - sol
+        default_ancestor = v
+    return default_ancestor
+
+
+def _move_subtree(wl: _LayoutNode, wr: _LayoutNode, shift: float):
+    subtrees = wr.number - wl.number
+    wr.change -= shift / subtrees
+    wr.shift += shift
+    wl.change += shift / subtrees
+    wr.x += shift
+    wr.mod += shift
+
+
+def _execute_shifts(v: _LayoutNode):
+    shift = change = 0.0
+    for w in reversed(v.children):
+        w.x += shift
+        w.mod += shift
+        change += w.change
+        shift += w.shift + change
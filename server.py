@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+from batch import plan_report
+from explain import get_query_plan, get_pool, load_query_plan, get_plan_diff, QueryNode, CancelToken, \
+    DATABASE, POOL_SIZE, planner_settings, preorder
+from flamegraph import frame_label
+from history import plan_history, record_run, Regression
+
+# A long-running JSON API over the analyzer, so dashboards and several people can share one process and its
+# connection pools instead of each running the desktop app. Requests are read on an asyncio loop, the database
+# work runs on a thread pool, at most DATABASE_CONCURRENCY requests at a time per database.
+# Usage: python server.py --host 127.0.0.1 --port 8080
+#
+# POST /explain   {"query": "...", "database": "...", "analyze": true, "statement_timeout": 0, "use_cache": true,
+#                  "enable_hashjoin": true, "enable_mergejoin": true, "enable_nestloop": true, "enable_seqscan": true}
+# POST /insights  {"query": ...} like /explain, or {"plan": EXPLAIN (FORMAT JSON) output}
+# POST /diff      {"old": {...}, "new": {...}}, each like the body of /insights
+# GET  /health
+#
+# With PLAN_HISTORY_PATH set every analyzed query is recorded, bypassing the plan cache, and /explain reports
+# whether it regressed against the query's history.
+#
+# Plans are returned as QueryNode.to_dict(derived=True): the EXPLAIN (FORMAT JSON) keys postgres writes, plus
+# the operation cost, inclusive and exclusive time and total rows the analyzer derives.
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8080))
+# seconds a request may take before it is cancelled and answered with 504, 0 for no limit
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 60))
+# requests running against one database at once, the rest wait their turn
+DATABASE_CONCURRENCY = int(os.environ.get("DATABASE_CONCURRENCY", POOL_SIZE))
+# databases requests may name, comma separated, only DATABASE when unset
+SERVER_DATABASES = [d.strip() for d in os.environ.get("SERVER_DATABASES", DATABASE or "").split(",") if d.strip()]
+MAX_BODY_BYTES = 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+            413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+            503: "Service Unavailable", 504: "Gateway Timeout"}
+_FLAGS = ("enable_hashjoin", "enable_mergejoin", "enable_nestloop", "enable_seqscan")
+
+
+# raised by handlers to answer with an error status and message
+class HTTPError(Exception):
+    status: int = None
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class PlanServer:
+    host: str = None
+    port: int = None
+    request_timeout: float = None
+    concurrency: int = None
+
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, request_timeout: float = REQUEST_TIMEOUT,
+                 concurrency: int = DATABASE_CONCURRENCY, databases: List[str] = None):
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.concurrency = max(1, concurrency)
+        self._databases = list(databases if databases is not None else SERVER_DATABASES)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency * max(1, len(self._databases)),
+                                            thread_name_prefix="server")
+        self._routes: Dict[Tuple[str, str], Callable] = {
+            ("GET", "/health"): self._health,
+            ("POST", "/explain"): self._explain,
+            ("POST", "/insights"): self._insights,
+            ("POST", "/diff"): self._diff,
+        }
+        for database in self._databases:
+            get_pool(database).ensure_capacity(self.concurrency)
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"serving on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # one request per connection, the response closes it
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+                handler = self._routes.get((method, path))
+                if handler is None:
+                    known = any(p == path for _, p in self._routes)
+                    raise HTTPError(405 if known else 404, f"no {method} {path}")
+                status, response = 200, await handler(body)
+            except HTTPError as e:
+                status, response = e.status, {"error": str(e)}
+            except Exception as e:
+                status, response = 500, {"error": f"{type(e).__name__}: {e}".strip()}
+            self._write_response(writer, status, response)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Any]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HTTPError(400, "malformed request line")
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method != "POST":
+            return method, target.split("?")[0], None
+        if "content-length" not in headers:
+            raise HTTPError(411, "a Content-Length header is required")
+        length = int(headers["content-length"]) if headers["content-length"].isdigit() else -1
+        if length < 0:
+            raise HTTPError(400, "invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"request bodies are limited to {MAX_BODY_BYTES} bytes")
+        try:
+            body = json.loads(await reader.readexactly(length)) if length else {}
+        except ValueError as e:
+            raise HTTPError(400, f"invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "the request body must be a JSON object")
+        return method, target.split("?")[0], body
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, response: Dict[str, Any]):
+        payload = json.dumps(response).encode()
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+
+    # Runs fn(cancel_token) on the thread pool once the database has a free slot. When the request times out
+    # the token cancels whatever query fn has in flight, so the connection is freed rather than left running.
+    # The slot is only given back once fn has returned, a request that gave up on its thread still holds it.
+    async def _run(self, database: str, fn: Callable[[CancelToken], Any]) -> Any:
+        token = CancelToken()
+        semaphore = self._semaphores.setdefault(database, asyncio.Semaphore(self.concurrency))
+
+        async def run():
+            await semaphore.acquire()
+            future = asyncio.get_running_loop().run_in_executor(self._executor, fn, token)
+            future.add_done_callback(lambda _: semaphore.release())
+            return await asyncio.shield(future)
+
+        try:
+            return await asyncio.wait_for(run(), self.request_timeout or None)
+        except asyncio.TimeoutError:
+            token.cancel()
+            raise HTTPError(504, f"the request took longer than {self.request_timeout}s")
+        except psycopg2.extensions.QueryCanceledError as e:
+            raise HTTPError(504, f"the query was cancelled: {e}".strip())
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            raise HTTPError(503, f"{type(e).__name__}: {e}".strip())
+        except psycopg2.Error as e:
+            raise HTTPError(422, f"{type(e).__name__}: {e}".strip())
+
+    def _database(self, body: Dict[str, Any]) -> str:
+        database = body.get("database") or DATABASE
+        if database not in self._databases:
+            raise HTTPError(400, f"unknown database {database}")
+        return database
+
+    # (steps, root_node, regression) for a body naming a query, explained on the database's pool and recorded in
+    # the plan history when one is configured, or carrying a saved plan, which is never recorded
+    async def _plan(self, body: Any) -> Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode, Regression | None]:
+        if not isinstance(body, dict):
+            raise HTTPError(400, "expected a JSON object with a query or a plan")
+        if "plan" in body:
+            # only parsed json, a string could name a file on this machine
+            if not isinstance(body["plan"], (list, dict)):
+                raise HTTPError(400, "plan must be EXPLAIN (FORMAT JSON) output")
+            try:
+                return *await asyncio.to_thread(load_query_plan, body["plan"]), None
+            except (KeyError, TypeError, ValueError) as e:
+                raise HTTPError(400, f"invalid plan: {type(e).__name__}: {e}".strip())
+
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, "a query or a plan is required")
+        flags = [body.get(flag, True) for flag in _FLAGS]
+        if not all(isinstance(f, bool) for f in flags):
+            raise HTTPError(400, f"{', '.join(_FLAGS)} must be booleans")
+        analyze = body.get("analyze", True)
+        use_cache = body.get("use_cache", True)
+        # "false" or 0 would otherwise run EXPLAIN ANALYZE, executing the query
+        if not isinstance(analyze, bool) or not isinstance(use_cache, bool):
+            raise HTTPError(400, "analyze and use_cache must be booleans")
+        statement_timeout = body.get("statement_timeout")
+        # bool is an int too, true would otherwise be a 1ms timeout
+        if statement_timeout is not None and (not isinstance(statement_timeout, int) or
+                                              isinstance(statement_timeout, bool) or statement_timeout < 0):
+            raise HTTPError(400, "statement_timeout must be a number of milliseconds")
+        database = self._database(body)
+        return await self._run(database, lambda token: _query_plan(
+            query, flags, token, use_cache and plan_history is None, analyze, statement_timeout, database))
+
+    async def _health(self, _) -> Dict[str, Any]:
+        return {"status": "ok", "databases": self._databases}
+
+    # the responses are built off the event loop, large plans take long enough to stall other connections
+    async def _explain(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(_explain_response, *await self._plan(body))
+
+    async def _insights(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        _, root_node, _ = await self._plan(body)
+        return await asyncio.to_thread(_insights_response, root_node)
+
+    async def _diff(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        (_, old_root, _), (_, new_root, _) = await asyncio.gather(self._plan(body.get("old")), self._plan(body.get("new")))
+        if old_root is None or new_root is None:
+            raise HTTPError(422, "no plan returned to compare")
+        return await asyncio.to_thread(_diff_response, old_root, new_root)
+
+
+def _query_plan(query: str, flags: List[bool], cancel_token: CancelToken, use_cache: bool, analyze: bool,
+                statement_timeout: int | None, database: str) -> Tuple[List[Tuple[str, Dict[str, str], Any]], QueryNode,
+                                                                       Regression | None]:
+    steps, root_node = get_query_plan(query, *flags, cancel_token=cancel_token, use_cache=use_cache, analyze=analyze,
+                                      statement_timeout=statement_timeout, database=database)
+    return steps, root_node, record_run(query, planner_settings(*flags), root_node, database)
+
+
+def _serialize(root_node: QueryNode) -> Dict[str, Any] | None:
+    return root_node.to_dict(derived=True) if root_node is not None else None
+
+
+def _explain_response(steps: List[Tuple[str, Dict[str, str], Any]], root_node: QueryNode,
+                      regression: Regression = None) -> Dict[str, Any]:
+    return {**plan_report(steps, root_node), "plan": _serialize(root_node),
+            "regression": regression.report() if regression is not None else None}
+
+
+def _insights_response(root_node: QueryNode) -> Dict[str, Any]:
+    if root_node is None:
+        return {"plan_insight": {}, "insights": []}
+    return {
+        "plan_insight": root_node.get_plan_insight(),
+        "insights": [{"operation": frame_label(node), "insights": node.get_node_insights()}
+                     for node in preorder(root_node)],
+    }
+
+
+def _diff_response(old_root: QueryNode, new_root: QueryNode) -> Dict[str, Any]:
+    return {"diff": get_plan_diff(old_root, new_root), "old": _serialize(old_root), "new": _serialize(new_root)}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve plan explanations, insights and diffs as JSON over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="seconds per request, 0 for no limit")
+    parser.add_argument("--concurrency", type=int, default=DATABASE_CONCURRENCY,
+                        help="requests running at once per database")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(PlanServer(args.host, args.port, args.timeout, args.concurrency).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
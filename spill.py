@@ -0,0 +1,86 @@
+from math import ceil
+from typing import Any, Dict, List, Tuple
+
+from explain import get_pool, fetch_plan, planner_settings, build_query_plan, match_plans, QueryNode, CancelToken, \
+    STATEMENT_TIMEOUT, preorder
+
+
+# The same query analyzed before and after raising work_mem, both inside one rolled-back transaction.
+class WorkMemWhatIf:
+    work_mem_kb: int = None
+    before_steps: List[Tuple[str, Dict[str, str], Any]] = None
+    before_root: QueryNode = None
+    after_steps: List[Tuple[str, Dict[str, str], Any]] = None
+    after_root: QueryNode = None
+
+    def __init__(self, before: Tuple, after: Tuple = None, work_mem_kb: int = None):
+        self.before_steps, self.before_root = before
+        if after is not None:
+            self.after_steps, self.after_root = after
+        self.work_mem_kb = work_mem_kb
+
+    # one row per operation that spilled before, with its time and temp usage before and after
+    def report(self) -> List[Dict[str, str]]:
+        if self.after_root is None:
+            return []
+        matches = match_plans(self.before_root, self.after_root)
+        rows = [{
+            "Operation": "Whole plan",
+            "Time before": f"{self.before_root.execution_time}ms",
+            "Time after": f"{self.after_root.execution_time}ms",
+            "Temp spill before": f"{self.before_root.temp_spill_mb(inclusive=True):.2f} MB",
+            "Temp spill after": f"{self.after_root.temp_spill_mb(inclusive=True):.2f} MB",
+        }]
+        for node in spilling_nodes(self.before_root):
+            after = matches.get(node)
+            rows.append({
+                "Operation": node.node_type + (f" on {', '.join(node.sort_key)}" if node.sort_key else ""),
+                "Time before": f"{node.actual_op_cost:.2f}ms",
+                "Time after": f"{after.actual_op_cost:.2f}ms" if after is not None else "not in new plan",
+                "Temp spill before": f"{node.temp_spill_mb():.2f} MB",
+                "Temp spill after": f"{after.temp_spill_mb():.2f} MB" if after is not None else "NA",
+            })
+        return rows
+
+    def summary(self) -> Dict[str, str]:
+        if self.after_root is None:
+            return {"Work Mem": "No operation spilled to disk, raising work_mem would not help."}
+        before, after = self.before_root.execution_time, self.after_root.execution_time
+        change = (after - before) / before * 100 if before else 0.0
+        return {
+            "Work Mem": f"Re-ran with work_mem = {ceil(self.work_mem_kb / 1024)}MB",
+            "Execution time": f"{before}ms before, {after}ms after ({change:+.2f}%)",
+        }
+
+
+# operations in the plan that spilled to disk for lack of work_mem
+def spilling_nodes(root: QueryNode) -> List[QueryNode]:
+    return [node for node in preorder(root) if node.work_mem_needed_kb() is not None]
+
+
+# Analyzes the query, and if any operation spilled to disk, analyzes it again with work_mem raised enough
+# to keep every one of them in memory (or to work_mem_kb when given). Both runs happen on one connection
+# inside the same transaction, which is rolled back, so the raised work_mem never outlives the comparison.
+# Each run is cancelled with QueryCanceledError after statement_timeout milliseconds (STATEMENT_TIMEOUT by default).
+def what_if_work_mem(query: str, enable_hj: bool, enable_mj: bool, enable_nfl: bool, enable_ss: bool,
+                     work_mem_kb: int = None, cancel_token: CancelToken = None,
+                     statement_timeout: int = None) -> WorkMemWhatIf:
+    settings = planner_settings(enable_hj, enable_mj, enable_nfl, enable_ss)
+    if statement_timeout is None:
+        statement_timeout = STATEMENT_TIMEOUT
+    with get_pool().connection() as conn:
+        before = build_query_plan(fetch_plan(conn, query, settings, cancel_token,
+                                             statement_timeout=statement_timeout))
+        if before[1] is None:
+            return WorkMemWhatIf(before)
+
+        if work_mem_kb is None:
+            needed = [n.work_mem_needed_kb() for n in spilling_nodes(before[1])]
+            if not needed:
+                return WorkMemWhatIf(before)
+            work_mem_kb = max(needed)
+
+        after = build_query_plan(fetch_plan(conn, query, {**settings, "work_mem": f"{work_mem_kb}kB"}, cancel_token,
+                                            statement_timeout=statement_timeout))
+
+    return WorkMemWhatIf(before, after, work_mem_kb)
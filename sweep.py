@@ -0,0 +1,164 @@
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Any, Dict, List, Tuple
+
+import psycopg2
+
+from cli import output_file
+from explain import get_pool, fetch_plan, build_query_plan, plan_signature, QueryNode, STATEMENT_TIMEOUT
+
+# planner toggles explored by a sweep, every combination of them is planned
+SWEEP_TOGGLES = ("enable_hashjoin", "enable_mergejoin", "enable_nestloop", "enable_seqscan",
+                 "enable_indexscan", "enable_bitmapscan", "enable_sort")
+# values of max_parallel_workers_per_gather explored by a sweep
+SWEEP_PARALLEL_WORKERS = (0, 2)
+
+
+# One distinct plan shape found by a sweep, with every combination of settings that produced it.
+class SweepPlan:
+    signature: int = None
+    settings: List[Dict[str, Any]] = None
+    estimated_cost: float = None
+    execution_time: float = None
+    steps: List[Tuple[str, Dict[str, str], Any]] = None
+    root_node: QueryNode = None
+
+    def __init__(self, signature: int, root_node: QueryNode):
+        self.signature = signature
+        self.root_node = root_node
+        self.estimated_cost = root_node.total_cost
+        self.settings = []
+
+    # the settings combination with the fewest planner features turned off
+    def least_restrictive_settings(self) -> Dict[str, Any]:
+        return min(self.settings, key=lambda s: sum(1 for v in s.values() if v is False))
+
+    def shape(self) -> str:
+        return describe_shape(self.root_node)
+
+
+# a compact one line rendering of a plan's operations, e.g. Hash Join(Seq Scan orders, Hash(Seq Scan customer))
+def describe_shape(root: QueryNode) -> str:
+    out = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            out.append(node)
+            continue
+        out.append(node.node_type + (f" {node.relation_name}" if node.relation_name else ""))
+        if node.children:
+            out.append("(")
+            stack.append(")")
+            for i, child in enumerate(reversed(node.children)):
+                stack.append(child)
+                if i + 1 < len(node.children):
+                    stack.append(", ")
+    return "".join(out)
+
+
+# every combination of the toggles and parallel worker counts
+def settings_combinations(toggles=SWEEP_TOGGLES, parallel_workers=SWEEP_PARALLEL_WORKERS) -> List[Dict[str, Any]]:
+    combinations = []
+    for values in product((True, False), repeat=len(toggles)):
+        for workers in parallel_workers:
+            settings = dict(zip(toggles, values))
+            settings["max_parallel_workers_per_gather"] = workers
+            combinations.append(settings)
+    return combinations
+
+
+def _estimate(query: str, settings: Dict[str, Any]) -> Tuple[Dict[str, Any], QueryNode | None]:
+    with get_pool().connection() as conn:
+        result = fetch_plan(conn, query, settings, analyze=False)
+    if not result:
+        return settings, None
+    return settings, QueryNode(result[0]["Plan"])
+
+
+# a plan whose run is cancelled by statement_timeout keeps its estimate, with root_node.statement_timeout set
+def _analyze(query: str, plan: SweepPlan, statement_timeout: int) -> SweepPlan:
+    try:
+        with get_pool().connection() as conn:
+            result = fetch_plan(conn, query, plan.least_restrictive_settings(), statement_timeout=statement_timeout)
+    except psycopg2.extensions.QueryCanceledError:
+        if not statement_timeout:
+            raise
+        plan.root_node.statement_timeout = statement_timeout
+        return plan
+    plan.steps, plan.root_node = build_query_plan(result)
+    if plan.root_node is not None:
+        plan.execution_time = plan.root_node.execution_time
+    return plan
+
+
+# Plans a query under every combination of planner settings, keeping one entry per distinct plan shape.
+# Planning only needs a plain EXPLAIN, so EXPLAIN ANALYZE is then run once per distinct shape rather than once
+# per combination. All of it is spread over the connection pool. Returns the plans fastest first, by actual time
+# when analyzed, by estimated cost otherwise. Each EXPLAIN ANALYZE is cancelled after statement_timeout
+# milliseconds (STATEMENT_TIMEOUT by default), its plan then ranks by estimated cost after the analyzed ones.
+def sweep_query_plans(query: str, toggles=SWEEP_TOGGLES, parallel_workers=SWEEP_PARALLEL_WORKERS,
+                      analyze: bool = True, statement_timeout: int = None) -> List[SweepPlan]:
+    if statement_timeout is None:
+        statement_timeout = STATEMENT_TIMEOUT
+    plans: Dict[int, SweepPlan] = {}
+    with ThreadPoolExecutor(max_workers=get_pool().max_size, thread_name_prefix="sweep") as executor:
+        estimates = executor.map(lambda s: _estimate(query, s), settings_combinations(toggles, parallel_workers))
+        for settings, root in estimates:
+            if root is None:
+                continue
+            signature = plan_signature(root)
+            if signature not in plans:
+                plans[signature] = SweepPlan(signature, root)
+            plans[signature].settings.append(settings)
+
+        if analyze:
+            list(executor.map(lambda p: _analyze(query, p, statement_timeout), plans.values()))
+
+    return sorted(plans.values(), key=lambda p: (p.execution_time if p.execution_time is not None else float("inf"),
+                                                 p.estimated_cost))
+
+
+# one row per distinct plan, for display
+def sweep_report(plans: List[SweepPlan]) -> List[Dict[str, str]]:
+    rows = []
+    for rank, plan in enumerate(plans, 1):
+        settings = plan.least_restrictive_settings()
+        changed = [f"{k}={v}" for k, v in settings.items() if v is False or k == "max_parallel_workers_per_gather"]
+        rows.append({
+            "Rank": f"{rank}",
+            "Estimated cost": f"{plan.estimated_cost:.2f}",
+            "Execution time": f"{plan.execution_time}ms" if plan.execution_time is not None else
+                              f"over {plan.root_node.statement_timeout}ms, cancelled" if plan.root_node.statement_timeout
+                              else "NA",
+            "Settings": ", ".join(changed) or "defaults",
+            "Combinations": f"{len(plan.settings)}",
+            "Plan": plan.shape(),
+        })
+    return rows
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Plan a query under every combination of planner settings "
+                                                 "and rank the distinct plans.")
+    parser.add_argument("query", help="the query, or a path to a .sql file holding it")
+    parser.add_argument("--estimate-only", action="store_true", help="rank by estimated cost, without executing")
+    parser.add_argument("-o", "--output", help="file to write the ranking to, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    query = args.query
+    if query.endswith(".sql"):
+        with open(query) as f:
+            query = f.read()
+
+    rows = sweep_report(sweep_query_plans(query, analyze=not args.estimate_only))
+    with output_file(args.output) as out:
+        for row in rows:
+            out.write(" | ".join(f"{k}: {v}" for k, v in row.items()) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import os
+
+from explain import load_query_plan
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# an EXPLAIN (FORMAT JSON) plan node, fields in snake case stand for their title case keys,
+# relation_name for "Relation Name", other keys are used as they are
+def node(node_type: str, *children, **fields):
+    plan = {"Node Type": node_type, "Startup Cost": 0.0, "Total Cost": 1.0, "Plan Rows": 1, "Plan Width": 4,
+            **{k if " " in k else k.replace("_", " ").title(): v for k, v in fields.items()}}
+    if children:
+        plan["Plans"] = list(children)
+    return plan
+
+
+def sample(name: str):
+    return load_query_plan(os.path.join(REPO, name))[1]
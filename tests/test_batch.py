@@ -0,0 +1,16 @@
+from batch import split_statements
+
+
+def test_statements_are_split_on_semicolons():
+    assert split_statements("select 1; select 2;\n-- done\n") == ["select 1", "select 2"]
+
+
+def test_semicolons_in_quotes_and_comments_do_not_split():
+    text = "select ';' as a, \"x;y\" from t; -- a; comment\nselect /* ; */ 2"
+    assert split_statements(text) == ["select ';' as a, \"x;y\" from t", "-- a; comment\nselect /* ; */ 2"]
+
+
+def test_dollar_quoted_bodies_stay_whole():
+    function = "CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql"
+    block = "DO $body$ BEGIN PERFORM 1; RAISE NOTICE '$$'; END $body$"
+    assert split_statements(f"{function};\n{block};\nselect $1::int;") == [function, block, "select $1::int"]
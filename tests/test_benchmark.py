@@ -0,0 +1,40 @@
+import pytest
+
+from benchmark import mann_whitney_u, _u_distribution, _percentile
+
+
+@pytest.mark.parametrize("xs, ys, u, p", [
+    # exact distribution: 1 of the C(6, 3) = 20 arrangements is this extreme on each side
+    ([1, 2, 3], [4, 5, 6], 0.0, 2 / 20),
+    ([1, 2, 3, 4, 5], [6, 7, 8, 9, 10], 0.0, 2 / 252),
+    ([1, 3, 5], [2, 4, 6], 3.0, 2 * 7 / 20),
+    # ties use the normal approximation with tie and continuity corrections
+    ([1, 1, 2, 2, 3], [2, 3, 3, 4, 4], 3.0, 0.0524116),
+])
+def test_mann_whitney_u_p_values(xs, ys, u, p):
+    assert mann_whitney_u(xs, ys) == pytest.approx((u, p))
+
+
+def test_mann_whitney_u_is_symmetric():
+    xs, ys = [3.1, 2.9, 3.4, 3.0, 3.3], [2.0, 2.5, 2.2, 3.05, 2.4]
+    u, p = mann_whitney_u(xs, ys)
+    u_swapped, p_swapped = mann_whitney_u(ys, xs)
+    assert u + u_swapped == len(xs) * len(ys)
+    assert p == pytest.approx(p_swapped)
+
+
+def test_identical_samples_are_not_significant():
+    assert mann_whitney_u([5.0] * 6, [5.0] * 6)[1] == 1.0
+
+
+def test_u_distribution_counts_every_arrangement():
+    counts = _u_distribution(3, 3)
+    assert counts == [1, 1, 2, 3, 3, 3, 3, 2, 1, 1]
+    assert sum(_u_distribution(5, 7)) == 792
+
+
+def test_nearest_rank_percentile():
+    values = list(range(1, 21))
+    assert _percentile(values, 95) == 19
+    assert _percentile(values, 100) == 20
+    assert _percentile([7.0], 95) == 7.0
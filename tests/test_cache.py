@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from cache import PlanCache, make_key, normalize_query
+
+
+def test_formatting_and_case_do_not_change_the_normalized_query():
+    assert normalize_query("SELECT *\n  FROM Orders -- all of them\nWHERE o_id = 1;") == \
+        normalize_query("select * from orders /* every row */ where o_id = 1")
+
+
+@pytest.mark.parametrize("literal", ["'ABC'", '"Orders"', "$$ABC$$", "$tag$ABC $$ not the end$tag$"])
+def test_quoted_text_keeps_its_case(literal):
+    assert literal in normalize_query(f"SELECT {literal} FROM t")
+    assert normalize_query(f"SELECT {literal}") != normalize_query(f"SELECT {literal.lower()}")
+
+
+def test_parameters_and_identifiers_with_dollars_are_not_dollar_quotes():
+    assert normalize_query("SELECT A$B$ FROM T WHERE X = $1 AND Y = $2") == \
+        "select a$b$ from t where x = $1 and y = $2"
+
+
+def test_settings_are_part_of_the_key():
+    assert make_key("select 1", {"enable_hashjoin": True}) != make_key("select 1", {"enable_hashjoin": False})
+    assert make_key("SELECT 1;", {"enable_hashjoin": True}) == make_key("select 1", {"enable_hashjoin": True})
+
+
+def test_lru_eviction_and_fresh_copies():
+    cache = PlanCache(max_entries=2)
+    cache.put("a", [{"Plan": {}}])
+    cache.put("b", [])
+    cache.get("a")[0]["mutated"] = True
+    cache.put("c", [])
+    assert cache.get("b") is None
+    assert cache.get("a") == [{"Plan": {}}]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_hits_and_misses_are_counted_across_threads():
+    cache = PlanCache()
+    cache.put("hit", [])
+
+    def lookups():
+        for _ in range(2000):
+            cache.get("hit")
+            cache.get("miss")
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (cache.hits, cache.misses) == (16000, 16000)
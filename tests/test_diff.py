@@ -0,0 +1,43 @@
+from explain import QueryNode, get_plan_diff, match_plans, preorder
+from plans import node, sample
+
+
+def scan(relation):
+    return node("Seq Scan", relation_name=relation, alias=relation)
+
+
+def test_identical_plans_match_node_for_node():
+    old, new = sample("sample_plan.json"), sample("sample_plan.json")
+    assert match_plans(old, new) == dict(zip(preorder(old), preorder(new)))
+    diff = get_plan_diff(old, new)
+    assert not diff["Removed"] and not diff["Inserted"]
+
+
+def test_join_method_change_is_reported_as_one_join():
+    diff = get_plan_diff(sample("sample_plan.json"), sample("sample_sortmerge_plan.json"))
+    assert [d["Join condition"] for d in diff["Joins"]] == ["(o.o_custkey = c.c_custkey)"]
+    assert "Hash Join" in diff["Joins"][0]["Description"] and "Merge Join" in diff["Joins"][0]["Description"]
+    assert sorted(d["Relation"] for d in diff["Scans"]) == ["customer", "orders"]
+    assert [d["Operation"] for d in diff["Removed"]] == ["Hash"]
+    assert [d["Operation"] for d in diff["Inserted"]] == ["Sort on o.o_custkey", "Sort on c.c_custkey"]
+
+
+def test_moved_subtrees_follow_their_operations():
+    old = QueryNode(node("Append", node("Sort", scan("orders"), sort_key=["o_orderkey"]),
+                         node("Hash", scan("customer"))))
+    new = QueryNode(node("Append", node("Hash", scan("customer")),
+                         node("Sort", scan("orders"), sort_key=["o_orderkey"])))
+    matches = match_plans(old, new)
+    assert len(matches) == 5
+    assert all(o.node_type == n.node_type and o.relation_name == n.relation_name for o, n in matches.items())
+
+
+def test_a_whole_subtree_match_does_not_orphan_an_earlier_one():
+    old = QueryNode(node("Append", node("Sort", scan("orders"), sort_key=["o_orderkey"]),
+                         node("Materialize", scan("orders"))))
+    new = QueryNode(node("Append", scan("orders"), node("Sort", scan("orders"), sort_key=["o_orderkey"])))
+    matches = match_plans(old, new)
+    assert len(set(matches.values())) == len(matches)
+    diff = get_plan_diff(old, new)
+    assert [d["Operation"] for d in diff["Removed"]] == ["Materialize"]
+    assert not diff["Inserted"]
@@ -0,0 +1,74 @@
+import asyncio
+
+import batch
+import history
+import server
+from explain import build_query_plan
+from history import PlanHistory, record_run
+from plans import node
+from server import PlanServer
+
+QUERY = "select * from orders"
+
+
+def analyzed(execution_time=1.0):
+    return build_query_plan([{"Plan": node("Seq Scan", relation_name="orders", actual_total_time=execution_time,
+                                           actual_rows=1, actual_loops=1),
+                              "Execution Time": execution_time}])
+
+
+def estimated():
+    return build_query_plan([{"Plan": node("Seq Scan", relation_name="orders")}])
+
+
+def configure(monkeypatch, tmp_path):
+    plan_history = PlanHistory(str(tmp_path / "history.sqlite"))
+    for module in (history, batch, server):
+        monkeypatch.setattr(module, "plan_history", plan_history)
+    return plan_history
+
+
+def test_only_analyzed_plans_are_recorded(monkeypatch, tmp_path):
+    plan_history = configure(monkeypatch, tmp_path)
+    record_run(QUERY, {}, estimated()[1])
+    record_run(QUERY, {}, analyzed()[1])
+    assert len(plan_history.runs(QUERY)) == 1
+
+
+def test_runs_on_other_databases_are_not_a_baseline(monkeypatch, tmp_path):
+    configure(monkeypatch, tmp_path)
+    for _ in range(3):
+        record_run(QUERY, {}, analyzed(1.0)[1])
+    assert record_run(QUERY, {}, analyzed(10.0)[1], database="tpcds") is None
+    assert record_run(QUERY, {}, analyzed(10.0)[1]) is not None
+
+
+def test_batch_records_fresh_runs(monkeypatch, tmp_path):
+    plan_history = configure(monkeypatch, tmp_path)
+    calls = []
+
+    def get_query_plan(query, *flags, use_cache, analyze):
+        calls.append(use_cache)
+        return analyzed(10.0 if len(calls) > 1 else 1.0)
+
+    monkeypatch.setattr(batch, "get_query_plan", get_query_plan)
+    assert "regression" not in batch._explain("a.sql", 0, QUERY, (True, True, True, True), True, True)
+    assert "Regression" in batch._explain("a.sql", 0, QUERY, (True, True, True, True), True, True)["regression"]
+    assert calls == [False, False]
+    assert len(plan_history.runs(QUERY)) == 2
+
+
+def test_server_records_fresh_runs(monkeypatch, tmp_path):
+    plan_history = configure(monkeypatch, tmp_path)
+    calls = []
+
+    def get_query_plan(query, *flags, use_cache, database, **options):
+        calls.append((use_cache, database))
+        return analyzed()
+
+    monkeypatch.setattr(server, "get_query_plan", get_query_plan)
+    plan_server = PlanServer(databases=["history_tests"])
+    *_, regression = asyncio.run(plan_server._plan({"query": QUERY, "database": "history_tests"}))
+    assert regression is None
+    assert calls == [(False, "history_tests")]
+    assert plan_history.runs(QUERY)[0].settings["database"] == "history_tests"
@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+
+import indexes
+from indexes import IndexCandidate, validate_candidate
+
+PLAN = [{"Plan": {"Node Type": "Seq Scan", "Relation Name": "orders", "Total Cost": 10.0, "Plan Rows": 1,
+                  "Actual Total Time": 1.0, "Actual Rows": 1, "Actual Loops": 1},
+         "Execution Time": 1.0}]
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.log.append(sql)
+
+    def fetchone(self):
+        return [PLAN]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+def validate(monkeypatch, analyze):
+    conn = FakeConnection()
+    monkeypatch.setattr(indexes, "get_pool", lambda: FakePool(conn))
+    monkeypatch.setattr(indexes, "STATEMENT_TIMEOUT", 5000)
+    candidate = IndexCandidate("public", "orders", ("o_custkey",))
+    candidate.sources.append(("select * from orders where o_custkey = 1", None))
+    validate_candidate(candidate, {}, analyze)
+    return [sql for sql in conn.log if not sql.startswith("SAVEPOINT")]
+
+
+def test_index_is_built_without_the_measurement_timeout(monkeypatch):
+    log = validate(monkeypatch, analyze=True)
+    explains = [sql for sql in log if "EXPLAIN" in sql]
+    assert all("set local statement_timeout = 5000;" in sql for sql in explains)
+    create = log.index(next(sql for sql in log if sql.startswith("CREATE INDEX")))
+    assert log[create - 1] == "RESET statement_timeout"
+
+
+def test_before_is_measured_after_a_warm_up_run(monkeypatch):
+    log = validate(monkeypatch, analyze=True)
+    create = log.index(next(sql for sql in log if sql.startswith("CREATE INDEX")))
+    assert sum("EXPLAIN" in sql for sql in log[:create]) == 2
+    assert sum("EXPLAIN" in sql for sql in log[create:]) == 1
+
+
+def test_estimates_are_not_warmed_up(monkeypatch):
+    log = validate(monkeypatch, analyze=False)
+    assert sum("EXPLAIN" in sql for sql in log) == 2
+    assert not any("statement_timeout =" in sql for sql in log)
@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dearpygui.dearpygui as dpg
+import pytest
+
+import interface
+from bench import generate_plan
+from explain import build_query_plan, load_query_plan
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def context():
+    dpg.create_context()
+    yield
+    dpg.destroy_context()
+
+
+# Runs a callback the way DPG 1.9 does: with as many of sender, app_data and user_data as its code takes,
+# and not at all when it has no __code__, as for a functools.partial.
+def run_dpg_callback(callback, user_data, sender=None, app_data=None):
+    assert hasattr(callback, "__code__"), f"DPG would silently skip {callback!r}"
+    callback(*(sender, app_data, user_data)[:callback.__code__.co_argcount])
+
+
+# every item of a type below the windows, walked from them as get_all_items crashes once tables are built
+def items_of_type(item_type: str):
+    found, stack = [], list(dpg.get_windows())
+    while stack:
+        item = stack.pop()
+        if dpg.get_item_type(item) == f"mvAppItemType::{item_type}":
+            found.append(item)
+        for children in (dpg.get_item_children(item) or {}).values():
+            stack.extend(children)
+    return found
+
+
+def test_large_graph_draws_every_node(context, monkeypatch):
+    _, root = build_query_plan([{"Plan": generate_plan(450)}])
+    scheduled = []
+    monkeypatch.setattr(dpg, "set_frame_callback",
+                        lambda frame, callback, user_data=None: scheduled.append((callback, user_data)))
+
+    interface._build_graph_window(root)
+    assert len(items_of_type("mvNode")) == interface.GRAPH_BATCH_SIZE
+    while scheduled:
+        run_dpg_callback(*scheduled.pop(0))
+
+    nodes = sum(1 for _ in interface.layout_order(root))
+    assert nodes > interface.GRAPH_BATCH_SIZE
+    assert len(items_of_type("mvNode")) == nodes
+    assert len(items_of_type("mvNodeLink")) == nodes - 1
+
+
+def test_go_to_buttons_open_the_page_of_their_step(context):
+    qep, root = build_query_plan([{"Plan": generate_plan(450)}])
+    with dpg.window():
+        parent = dpg.add_group()
+        graph_button = dpg.add_button()
+    interface._render_plan(qep, root, parent, graph_button, "Plan Summary")
+
+    pages = next(i for i in items_of_type("mvText") if str(dpg.get_value(i)).startswith("Page "))
+    for label, attr in (("Go to costliest", "costliest_node"), ("Go to slowest", "slowest_node")):
+        button = next(b for b in items_of_type("mvButton") if dpg.get_item_label(b) == label)
+        index = next(i for i, (_, _, n) in enumerate(qep) if n is getattr(root, attr))
+        run_dpg_callback(dpg.get_item_callback(button), dpg.get_item_user_data(button), button)
+        assert dpg.get_value(pages).startswith(f"Page {index // interface.PAGE_SIZE + 1} of ")
+
+
+def test_plans_are_rendered_on_the_gui_thread(context, monkeypatch):
+    with dpg.window():
+        for name in ("main_g", "old_g", "new_g", "labels", "status_g"):
+            monkeypatch.setattr(interface, name, dpg.add_group())
+        for name in ("old_status", "new_status"):
+            monkeypatch.setattr(interface, name, dpg.add_text(""))
+        for name in ("old_b", "new_b", "cancel_b"):
+            monkeypatch.setattr(interface, name, dpg.add_button())
+    run = interface.ExplainRun()
+    monkeypatch.setattr(interface, "current_run", run)
+
+    plans = {"old": load_query_plan(os.path.join(REPO, "sample_plan.json")),
+             "new": load_query_plan(os.path.join(REPO, "sample_sortmerge_plan.json"))}
+    rendered_on = []
+    render_plan = interface._render_plan
+    monkeypatch.setattr(interface, "_render_plan",
+                        lambda *args: rendered_on.append(threading.get_ident()) or render_plan(*args))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for side, plan in plans.items():
+            future = executor.submit(lambda p: (p, None), plan)
+            future.add_done_callback(interface._on_ui_thread(interface._plan_done_callback, run, side))
+
+    assert not dpg.get_item_children(interface.old_g, 1) and not dpg.get_item_children(interface.main_g, 1)
+    interface.run_ui_tasks()
+    assert rendered_on == [threading.get_ident()] * 2
+    assert dpg.get_item_children(interface.old_g, 1) and dpg.get_item_children(interface.new_g, 1)
+    assert any(dpg.get_value(t) == "Plan Diff Report!" for t in items_of_type("mvText"))
@@ -0,0 +1,31 @@
+import threading
+
+from explain import ConnectionPool
+
+
+class FakeConnection:
+    closed = False
+
+    def rollback(self):
+        pass
+
+
+def test_raising_capacity_wakes_waiting_threads(monkeypatch):
+    pool = ConnectionPool(max_size=1)
+    monkeypatch.setattr(pool, "_connect", FakeConnection)
+    pool.acquire()
+
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: pool.acquire(timeout=5) and acquired.set())
+    waiter.start()
+    assert not acquired.wait(0.1)
+    pool.ensure_capacity(2)
+    assert acquired.wait(1)
+    waiter.join()
+    assert pool.max_size == 2
+
+
+def test_capacity_is_never_lowered():
+    pool = ConnectionPool(max_size=4)
+    pool.ensure_capacity(2)
+    assert pool.max_size == 4
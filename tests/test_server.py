@@ -0,0 +1,47 @@
+import asyncio
+import threading
+
+import pytest
+
+from server import PlanServer, HTTPError
+
+
+@pytest.fixture
+def server():
+    return PlanServer(databases=["tpch"])
+
+
+@pytest.mark.parametrize("body", [
+    {"query": "select 1", "analyze": "false"},
+    {"query": "select 1", "analyze": 0},
+    {"query": "select 1", "use_cache": "no"},
+    {"query": "select 1", "statement_timeout": True},
+    {"query": "select 1", "statement_timeout": -1},
+    {"query": "select 1", "enable_hashjoin": 1},
+])
+def test_invalid_options_are_rejected(server, body):
+    with pytest.raises(HTTPError) as e:
+        asyncio.run(server._plan(body))
+    assert e.value.status == 400
+
+
+def test_timed_out_requests_hold_their_slot_until_their_thread_returns():
+    server = PlanServer(request_timeout=0.3, concurrency=1, databases=["tpch", "tpcds"])
+    release, started = threading.Event(), []
+
+    def blocking(token):
+        started.append("first")
+        release.wait(5)
+
+    async def scenario():
+        with pytest.raises(HTTPError) as e:
+            await server._run("tpch", blocking)
+        assert e.value.status == 504
+        second = asyncio.ensure_future(server._run("tpch", lambda token: started.append("second")))
+        await asyncio.sleep(0.1)
+        assert started == ["first"]
+        release.set()
+        await second
+        assert started == ["first", "second"]
+
+    asyncio.run(scenario())
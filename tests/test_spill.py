@@ -0,0 +1,19 @@
+from explain import build_query_plan
+from plans import node
+from spill import WorkMemWhatIf
+
+
+def analyzed(execution_time):
+    return build_query_plan([{"Plan": node("Sort", sort_key=["o_orderdate"], actual_total_time=execution_time, actual_rows=1, actual_loops=1),
+                              "Execution Time": execution_time}])
+
+
+def test_summary_reports_the_change_in_execution_time():
+    summary = WorkMemWhatIf(analyzed(8.0), analyzed(2.0), 8192).summary()
+    assert summary["Work Mem"] == "Re-ran with work_mem = 8MB"
+    assert summary["Execution time"] == "8.0ms before, 2.0ms after (-75.00%)"
+
+
+def test_summary_of_an_instant_query_does_not_divide_by_zero():
+    summary = WorkMemWhatIf(analyzed(0.0), analyzed(0.0), 8192).summary()
+    assert summary["Execution time"] == "0.0ms before, 0.0ms after (+0.00%)"
@@ -0,0 +1,97 @@
+from explain import build_query_plan, preorder
+from plans import node, sample
+
+
+def build(plan):
+    return build_query_plan([{"Plan": plan}])[1]
+
+
+def test_times_and_rows_are_totalled_over_loops():
+    root = build(node("Nested Loop",
+                      node("Seq Scan", relation_name="a", actual_total_time=5.0, actual_rows=100, actual_loops=1,
+                           parent_relationship="Outer"),
+                      node("Index Scan", relation_name="b", actual_total_time=0.02, actual_rows=2, actual_loops=100,
+                           parent_relationship="Inner"),
+                      actual_total_time=9.0, actual_rows=200, actual_loops=1))
+    outer, inner = root.children
+    assert inner.inclusive_time == 2.0
+    assert inner.total_rows == 200
+    assert root.actual_op_cost == 9.0 - 5.0 - 2.0
+
+
+def test_parallel_loops_overlap():
+    root = build(node("Gather",
+                      node("Parallel Seq Scan", relation_name="a", actual_total_time=30.0, actual_rows=1000,
+                           actual_loops=3, parent_relationship="Outer"),
+                      actual_total_time=40.0, actual_rows=3000, actual_loops=1, workers_planned=2, workers_launched=2))
+    scan = root.children[0]
+    # two workers and the leader each ran one loop of 30ms at the same time
+    assert scan.processes == 3
+    assert scan.inclusive_time == 30.0
+    assert scan.total_rows == 3000
+    assert root.actual_op_cost == 10.0
+
+
+def test_parallel_time_is_the_slowest_process():
+    workers = [{"Worker Number": 0, "Actual Total Time": 45.0, "Actual Loops": 1, "Actual Rows": 1500},
+               {"Worker Number": 1, "Actual Total Time": 10.0, "Actual Loops": 1, "Actual Rows": 500}]
+    root = build(node("Gather",
+                      node("Parallel Seq Scan", relation_name="a", actual_total_time=20.0, actual_rows=1000,
+                           actual_loops=3, parent_relationship="Outer", workers=workers),
+                      actual_total_time=50.0, actual_rows=3000, actual_loops=1, workers_planned=2, workers_launched=2))
+    assert root.children[0].inclusive_time == 45.0
+    assert root.actual_op_cost == 5.0
+
+
+def test_child_times_never_exceed_their_parent():
+    for root in (sample("sample_plan.json"), sample("sample_sortmerge_plan.json")):
+        for parent in preorder(root):
+            assert parent.actual_op_cost >= 0
+            for child in parent.children:
+                assert child.inclusive_time <= parent.inclusive_time
+
+
+def test_estimated_plans_have_no_times():
+    root = build(node("Seq Scan", relation_name="a"))
+    assert root.inclusive_time is None and root.actual_op_cost is None and root.total_rows is None
+
+
+def test_cte_time_is_charged_to_its_scans_by_rows_read():
+    root = build(node("Hash Join",
+                      node("Seq Scan", relation_name="orders", actual_total_time=10.0, actual_rows=10, actual_loops=1,
+                           parent_relationship="InitPlan", subplan_name="CTE x"),
+                      node("CTE Scan", actual_total_time=12.0, actual_rows=3, actual_loops=1,
+                           parent_relationship="Outer", **{"CTE Name": "x"}),
+                      node("Hash",
+                           node("CTE Scan", actual_total_time=6.0, actual_rows=1, actual_loops=1,
+                                parent_relationship="Outer", **{"CTE Name": "x"}),
+                           actual_total_time=6.5, actual_rows=1, actual_loops=1, parent_relationship="Inner"),
+                      actual_total_time=20.0, actual_rows=3, actual_loops=1))
+    cte, first_scan, hash_node = root.children
+    # the CTE's 10ms are inside the scans', split 3 to 1 by the rows they read
+    assert first_scan.actual_op_cost == 12.0 - 7.5
+    assert hash_node.children[0].actual_op_cost == 6.0 - 2.5
+    assert cte.actual_op_cost == 10.0
+    assert root.actual_op_cost == 20.0 - 12.0 - 6.5
+
+
+def test_initplan_time_is_taken_out_of_the_operation_using_it():
+    root = build(node("Result",
+                      node("Aggregate",
+                           node("Seq Scan", relation_name="b", actual_total_time=4.0, actual_rows=10, actual_loops=1,
+                                parent_relationship="Outer"),
+                           actual_total_time=5.0, actual_rows=1, actual_loops=1, parent_relationship="InitPlan",
+                           subplan_name="InitPlan 1 (returns $0)"),
+                      node("Seq Scan", relation_name="a", filter="(a.x > $0)", actual_total_time=15.0, actual_rows=10,
+                           actual_loops=1, parent_relationship="Outer"),
+                      actual_total_time=16.0, actual_rows=10, actual_loops=1))
+    _, scan = root.children
+    assert scan.actual_op_cost == 15.0 - 5.0
+    assert root.actual_op_cost == 16.0 - 15.0
+
+
+def test_rows_removed_by_filter_is_only_shown_for_analyzed_scans():
+    estimated = build(node("Seq Scan", relation_name="a", rows_removed_by_filter=5))
+    assert estimated._explain_ss()[1]["Rows removed by filter"].startswith("NA\n")
+    analyzed = build(node("Seq Scan", relation_name="a", actual_total_time=1.0, actual_rows=1, actual_loops=1))
+    assert analyzed._explain_ss()[1]["Rows removed by filter"].startswith("0\n")
@@ -0,0 +1,40 @@
+from workload import substitute_parameters
+
+# (table, column) -> (most common values, histogram bounds), as read from pg_stats
+STATS = {
+    ("orders", "o_custkey"): (["5", "7", "9", "11"], []),
+    ("orders", "o_totalprice"): ([], ["10", "20", "30", "40"]),
+    ("customer", "c_name"): ([], ['Jo "O\'Neil"']),
+}
+
+
+def substitute(query):
+    return substitute_parameters(None, query, dict(STATS))
+
+
+def test_scalars_come_from_the_column_statistics():
+    assert substitute("SELECT * FROM orders o WHERE o.o_custkey = $1 AND o_totalprice > $2 LIMIT $3") == \
+        "SELECT * FROM orders o WHERE o.o_custkey = '5' AND o_totalprice > '30' LIMIT 100"
+
+
+def test_between_takes_the_lower_and_upper_quartiles():
+    assert substitute("SELECT * FROM orders WHERE o_totalprice BETWEEN $1 AND $2") == \
+        "SELECT * FROM orders WHERE o_totalprice BETWEEN '20' AND '40'"
+
+
+def test_array_parameters_get_array_literals():
+    assert substitute("SELECT * FROM orders WHERE o_custkey = ANY($1)") == \
+        "SELECT * FROM orders WHERE o_custkey = ANY('{\"5\",\"7\",\"9\"}')"
+    assert substitute("SELECT * FROM orders WHERE o_totalprice <> ALL ($1::numeric[])") == \
+        "SELECT * FROM orders WHERE o_totalprice <> ALL ('{\"30\"}'::numeric[])"
+
+
+def test_array_elements_are_quoted():
+    assert substitute("SELECT * FROM customer WHERE c_name = ANY($1)") == \
+        "SELECT * FROM customer WHERE c_name = ANY('{\"Jo \\\"O''Neil\\\"\"}')"
+
+
+def test_parameters_without_statistics_stay_valid():
+    stats = {**STATS, ("orders", "o_comment"): ([], []), ("orders", "o_id"): ([], [])}
+    assert substitute_parameters(None, "SELECT * FROM orders WHERE o_comment = $1 AND o_id = ANY($2)", stats) == \
+        "SELECT * FROM orders WHERE o_comment = NULL AND o_id = ANY('{}')"
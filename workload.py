@@ -0,0 +1,289 @@
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from cli import output_file
+from explain import get_query_plan, get_pool, QueryNode, preorder
+
+# Explains the statements taking the most time on the server, as recorded by the pg_stat_statements extension,
+# and reports which operations, relations and insights that time goes to across the whole workload.
+# Usage: python workload.py --top 50 --order total --workers 4 --output hotspots.json
+
+# number of statements explained by default
+TOP_STATEMENTS = 50
+# values put in for LIMIT and OFFSET parameters, which have no statistics to draw from
+LIMIT_PARAMETER = 100
+OFFSET_PARAMETER = 0
+# most common values put in for a parameter holding an array, as in = ANY($1)
+ARRAY_PARAMETER_VALUES = 3
+# insights every analyzed operation gets, the first says nothing about a hotspot and the second is counted
+# by its verdict
+_UNRANKED_INSIGHTS = ("Percentage Of Time Spent On Operation",)
+_GRADED_INSIGHTS = ("Row Estimation Quality",)
+# statements EXPLAIN can analyze, anything else (SET, BEGIN, VACUUM...) is skipped
+_EXPLAINABLE = re.compile(r"^\s*(select|with|insert|update|delete|values|table)\b", re.IGNORECASE)
+
+_PARAMETER = re.compile(r"\$(\d+)(?!\d)")
+_IDENTIFIER = r'((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)'
+_COMPARISON = r"(=|<>|!=|<=|>=|<|>|~~\*?|!~~\*?|(?:not\s+)?i?like)"
+# the column a parameter is compared with, looking at the text before and after it
+_COLUMN_BEFORE = re.compile(_IDENTIFIER + r"\s*" + _COMPARISON + r"\s*(?:(?:any|some|all)\s*\(\s*)?$",
+                            re.IGNORECASE)
+_COLUMN_AFTER = re.compile(r"^\s*" + _COMPARISON + r"\s*" + _IDENTIFIER, re.IGNORECASE)
+_IN_LIST = re.compile(_IDENTIFIER + r"\s+(?:not\s+)?in\s*\([^()]*$", re.IGNORECASE)
+_BETWEEN = re.compile(_IDENTIFIER + r"\s+between\s+(\S+\s+and\s+)?$", re.IGNORECASE)
+_LIMIT = re.compile(r"\b(limit|offset)\s*$", re.IGNORECASE)
+# parameters holding an array: compared with ANY, SOME or ALL, or cast to an array type
+_ARRAY_BEFORE = re.compile(r"\b(?:any|some|all)\s*\(\s*$", re.IGNORECASE)
+_ARRAY_AFTER = re.compile(r"^\s*::\s*[\w\s\".]+\[\]")
+# tables named in FROM and JOIN clauses, with their aliases
+_TABLE = re.compile(r"\b(?:from|join|,)\s+" + _IDENTIFIER + r"(?:\s+(?:as\s+)?(?!(?:on|using|where|join|inner|left|"
+                    r"right|full|cross|natural|group|order|limit|offset|union|except|intersect|having|window|for|"
+                    r"lateral)\b)(\w+))?", re.IGNORECASE)
+
+
+# One statement from pg_stat_statements. query is as normalized by postgres, with $1, $2... for constants,
+# sql the same with representative values put back in. Once explained it has steps and root_node, or error.
+class Statement:
+    queryid: int = None
+    query: str = None
+    calls: int = None
+    total_time: float = None
+    mean_time: float = None
+    rows: int = None
+    sql: str = None
+    steps: List[Tuple[str, Dict[str, str], Any]] = None
+    root_node: QueryNode = None
+    error: str = None
+
+    def __init__(self, queryid: int, query: str, calls: int, total_time: float, mean_time: float, rows: int):
+        self.queryid = queryid
+        self.query = query
+        self.calls = calls
+        self.total_time = total_time
+        self.mean_time = mean_time
+        self.rows = rows
+
+    # share of each operation in this statement's time on the server, by its share of the explained plan's time,
+    # or of its estimated cost when the plan could only be estimated
+    def node_times(self) -> List[Tuple[QueryNode, float]]:
+        root = self.root_node
+        if root is None:
+            return []
+        nodes = list(preorder(root))
+        if root.analyzed() and root.inclusive_time:
+            return [(n, (n.actual_op_cost or 0) / root.inclusive_time * self.total_time) for n in nodes]
+        if root.total_cost:
+            return [(n, max(0.0, n.op_cost or 0) / root.total_cost * self.total_time) for n in nodes]
+        return []
+
+
+# Reads the top statements of the current database from pg_stat_statements, by total or mean execution time.
+def top_statements(conn, limit: int = TOP_STATEMENTS, order: str = "total") -> List[Statement]:
+    if order not in ("total", "mean"):
+        raise ValueError(f"order must be total or mean, not {order}")
+    with conn.cursor() as cursor:
+        # the time columns were renamed in postgres 13
+        cursor.execute("SELECT attname FROM pg_attribute WHERE attrelid = 'pg_stat_statements'::regclass")
+        columns = {row[0] for row in cursor.fetchall()}
+        total, mean = ("total_exec_time", "mean_exec_time") if "total_exec_time" in columns else \
+            ("total_time", "mean_time")
+        cursor.execute(
+            f"SELECT queryid, query, calls, {total}, {mean}, rows FROM pg_stat_statements "
+            f"WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+            f"ORDER BY {total if order == 'total' else mean} DESC")
+        statements = []
+        for row in cursor:
+            if len(statements) >= limit:
+                break
+            query = row[1]
+            if _EXPLAINABLE.match(query) and "pg_stat_statements" not in query:
+                statements.append(Statement(*row))
+    return statements
+
+
+# Puts a representative value back in for every $n of a normalized query: the most common value of the
+# column it is compared with, or a value from the middle of its histogram for range comparisons, from pg_stats.
+# LIMIT and OFFSET get LIMIT_PARAMETER and OFFSET_PARAMETER, anything else NULL.
+# stats caches pg_stats lookups across calls, keyed by (table, column).
+def substitute_parameters(conn, query: str, stats: Dict[Tuple[str, str], Tuple[List[str], List[str]]] = None) -> str:
+    stats = {} if stats is None else stats
+    tables = _tables(query)
+
+    def value(match) -> str:
+        before, after = query[max(0, match.start() - 200):match.start()], query[match.end():match.end() + 200]
+        limit = _LIMIT.search(before)
+        if limit:
+            return str(LIMIT_PARAMETER if limit.group(1).lower() == "limit" else OFFSET_PARAMETER)
+
+        position = 0.5
+        array = bool(_ARRAY_BEFORE.search(before) or _ARRAY_AFTER.match(after))
+        between = _BETWEEN.search(before)
+        in_list = _IN_LIST.search(before)
+        column_before = _COLUMN_BEFORE.search(before)
+        column_after = _COLUMN_AFTER.search(after)
+        if between:
+            column, equality = between.group(1), False
+            position = 0.75 if between.group(2) else 0.25
+        elif column_before:
+            column, equality = column_before.group(1), column_before.group(2) in ("=", "<>", "!=")
+        elif in_list:
+            column, equality = in_list.group(1), True
+        elif column_after:
+            column, equality = column_after.group(2), column_after.group(1) in ("=", "<>", "!=")
+        else:
+            return "'{}'" if array else "NULL"
+
+        common, histogram = _column_stats(conn, tables, column, stats)
+        if array:
+            # an untyped array literal, postgres casts it to the column's array type as it would a scalar
+            values = common[:ARRAY_PARAMETER_VALUES] or histogram[len(histogram) // 2:][:1]
+            elements = ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+            return "'{" + elements.replace("'", "''") + "}'"
+        if histogram and not (equality and common):
+            v = histogram[min(len(histogram) - 1, int(len(histogram) * position))]
+        elif common:
+            v = common[0]
+        else:
+            return "NULL"
+        return "'" + v.replace("'", "''") + "'"
+
+    return _PARAMETER.sub(value, query)
+
+
+# alias or name -> table for every table in the query's FROM and JOIN clauses
+def _tables(query: str) -> Dict[str, str]:
+    tables = {}
+    for match in _TABLE.finditer(query):
+        table = _unquote(match.group(1).split(".")[-1])
+        tables[table] = table
+        if match.group(2):
+            tables[match.group(2).lower()] = table
+    return tables
+
+
+def _unquote(identifier: str) -> str:
+    return identifier[1:-1] if identifier.startswith('"') else identifier.lower()
+
+
+def _column_stats(conn, tables: Dict[str, str], column: str,
+                  stats: Dict[Tuple[str, str], Tuple[List[str], List[str]]]) -> Tuple[List[str], List[str]]:
+    parts = column.split(".")
+    name = _unquote(parts[-1])
+    if len(parts) > 1:
+        candidates = [tables.get(_unquote(parts[0]), _unquote(parts[0]))]
+    else:
+        candidates = sorted(set(tables.values()))
+
+    for table in candidates:
+        if (table, name) not in stats:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT most_common_vals::text::text[], histogram_bounds::text::text[] FROM pg_stats "
+                               "WHERE schemaname NOT IN ('pg_catalog', 'information_schema') "
+                               "AND tablename = %s AND attname = %s LIMIT 1", (table, name))
+                row = cursor.fetchone()
+            stats[(table, name)] = (row[0] or [], row[1] or []) if row else ([], [])
+        if stats[(table, name)] != ([], []):
+            return stats[(table, name)]
+    return [], []
+
+
+def _explain(statement: Statement, flags: Tuple[bool, bool, bool, bool], analyze: bool) -> Statement:
+    try:
+        statement.steps, statement.root_node = get_query_plan(statement.sql, *flags, analyze=analyze)
+    except Exception as e:
+        statement.error = f"{type(e).__name__}: {e}".strip()
+    return statement
+
+
+# Reads the top statements, fills in their parameters and explains them, at most workers at once.
+def collect_workload(limit: int = TOP_STATEMENTS, order: str = "total", workers: int = 4,
+                     flags: Tuple[bool, bool, bool, bool] = (True, True, True, True),
+                     analyze: bool = True) -> List[Statement]:
+    with get_pool().connection() as conn:
+        statements = top_statements(conn, limit, order)
+        stats = {}
+        for statement in statements:
+            statement.sql = substitute_parameters(conn, statement.query, stats)
+
+    get_pool().ensure_capacity(workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="workload") as executor:
+        return list(executor.map(lambda s: _explain(s, flags, analyze), statements))
+
+
+# Where the workload's time goes. Every operation of every explained plan is credited with its share of its
+# statement's total time on the server, then the credits are summed by operation type, by relation and by the
+# insights raised on the operations. Each list is sorted by time, largest first.
+def hotspot_report(statements: List[Statement]) -> Dict[str, Any]:
+    operators = defaultdict(lambda: [0.0, 0])
+    relations = defaultdict(lambda: [0.0, 0])
+    insights = defaultdict(lambda: [0.0, 0])
+    workload_time = 0.0
+    explained = [s for s in statements if s.root_node is not None]
+    for statement in explained:
+        workload_time += statement.total_time
+        for node, ms in statement.node_times():
+            for totals, key in ((operators, node.node_type), (relations, node.relation_name)):
+                if key is not None:
+                    totals[key][0] += ms
+                    totals[key][1] += 1
+            for label, text in node.get_node_insights().items():
+                if label in _UNRANKED_INSIGHTS:
+                    continue
+                if label in _GRADED_INSIGHTS:
+                    label = f"{label}: {text.splitlines()[0]}"
+                insights[label][0] += ms
+                insights[label][1] += 1
+
+    def ranked(totals: Dict[str, List], label: str) -> List[Dict[str, Any]]:
+        return [{
+            label: key,
+            "Time": f"{ms:.2f}ms",
+            "Share": f"{ms / workload_time * 100:.2f}%" if workload_time else "NA",
+            "Operations": count,
+        } for key, (ms, count) in sorted(totals.items(), key=lambda kv: -kv[1][0])]
+
+    return {
+        "Summary": {
+            "Statements": len(statements),
+            "Explained": len(explained),
+            "Failed": sum(1 for s in statements if s.error is not None),
+            "Workload Time": f"{workload_time:.2f}ms",
+        },
+        "Operators": ranked(operators, "Operator"),
+        "Relations": ranked(relations, "Relation"),
+        "Insights": ranked(insights, "Insight"),
+        "Statements": [{
+            "Query": s.sql or s.query,
+            "Calls": s.calls,
+            "Total Time": f"{s.total_time:.2f}ms",
+            "Mean Time": f"{s.mean_time:.2f}ms",
+            **({"Error": s.error} if s.error is not None else {}),
+            **({"Plan": s.root_node.get_plan_insight()} if s.root_node is not None else {}),
+        } for s in statements],
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Explain the statements taking the most time in "
+                                                 "pg_stat_statements and report where the workload's time goes.")
+    parser.add_argument("-n", "--top", type=int, default=TOP_STATEMENTS, help="number of statements to explain")
+    parser.add_argument("--order", choices=("total", "mean"), default="total", help="rank by total or mean time")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of statements explained at once")
+    parser.add_argument("-o", "--output", help="file to write the JSON report to, defaults to stdout")
+    parser.add_argument("--estimate-only", action="store_true", help="only plan the statements, without executing")
+    args = parser.parse_args(argv)
+
+    report = hotspot_report(collect_workload(args.top, args.order, args.workers, analyze=not args.estimate_only))
+    with output_file(args.output) as out:
+        json.dump(report, out, indent=2)
+        out.write("\n")
+    return 1 if report["Summary"]["Failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())